@@ -13,8 +13,8 @@ if [ "$upstream_loc" = LOCAL ] || [ -z "$upstream_loc" ] ; then
     # Nothing to do. Really we shouldn't have been called.
     cat_cmd="true"
 elif [[ "$upstream_loc" =~ : ]] ; then
-    # Remote delete
-    cat_cmd="ssh -T ${upstream_loc%%:*} cat >> ${upstream_loc#*:}/cells_processed.txt"
+    # Remote delete, using the shared connection if the driver has set up SSH_POOL_OPTS
+    cat_cmd="ssh ${SSH_POOL_OPTS:-} -T ${upstream_loc%%:*} cat >> ${upstream_loc#*:}/cells_processed.txt"
 else
     # Local dir, then
     cat_cmd="eval cat >> ${upstream_loc#*:}/cells_processed.txt"
@@ -55,10 +55,20 @@ if [ -e "$ENVIRON_SH" ] ; then
            PROJECT_PAGE_URL   GENOLOGICSRC        REPORT_LINK \
            RSYNC_CMD          RT_SYSTEM           STALL_TIME \
            DEL_REMOTE_CELLS   PROJECT_NAME_LIST   PROM_RUNS_BATCH \
-           SNAKE_THREADS      LOCAL_CORES \
-           EXTRA_SNAKE_FLAGS  EXTRA_SNAKE_CONFIG  MAIN_SNAKE_TARGETS
+           SNAKE_THREADS      LOCAL_CORES         SCAN_JOBS \
+           UPSTREAM_CACHE     UPSTREAM_SLACK      UPSTREAM_FULL_LISTING \
+           EXTRA_SNAKE_FLAGS  EXTRA_SNAKE_CONFIG  MAIN_SNAKE_TARGETS \
+           COMPRESS_PROFILE
 fi
 
+# Finished runs are noted in this index so they need not be re-examined every time.
+# Set RUN_INDEX to an empty string to disable this, or run "driver.sh --full-rescan"
+# to check every run and rebuild the index.
+RUN_INDEX="${RUN_INDEX-$PROM_RUNS/.run_status_index.json}"
+export RUN_INDEX
+FULL_RESCAN=0
+[ "${1:-}" != --full-rescan ] || FULL_RESCAN=1
+
 # LOG_DIR is ignored if MAINLOG is set explicitly.
 LOG_DIR="${LOG_DIR:-${HOME}/hesiod/logs}"
 EXP_NAME_REGEX="${EXP_NAME_REGEX:-${RUN_NAME_REGEX:-.+_.+_.+}}"
@@ -412,11 +422,14 @@ action_cell_ready_internal(){
                    nanostats            convert_final_summary    sample_names )
       ( cd "$RUN_OUTPUT"
 
-        scan_cells.py -m -r "${CELLSREADY[@]}" "${CELLSDONE[@]}" -c "${CELLS[@]}" > sc_data.yaml
+        # The index saves re-listing directories that have not changed since the last scan.
+        # Setting SCAN_JOBS allows cells to be scanned in parallel.
+        scan_cells.py -m --index sc_data.index.json ${SCAN_JOBS:+-j "$SCAN_JOBS"} \
+            -r "${CELLSREADY[@]}" "${CELLSDONE[@]}" -c "${CELLS[@]}" > sc_data.yaml
 
         Snakefile.main ${MAIN_SNAKE_TARGETS:-copy_pod5 main} \
             -f -R "${always_run[@]}" \
-            --config ${EXTRA_SNAKE_CONFIG:-}
+            --config ${EXTRA_SNAKE_CONFIG:-} ${COMPRESS_PROFILE:+compress_profile="$COMPRESS_PROFILE"}
       ) |& plog
 
     ) |& plog
@@ -560,6 +573,8 @@ do_sync(){
     # See doc/syncing.txt
     # Called per experiment, and needs to sync all cells for which there is a remote
     # in $UPSTREAM_INFO but no {cell}.synced
+    # The commands are not run here but added to $SYNC_JOB_LIST for sync_scheduler.py, then
+    # finish_sync is called for each experiment once they have all run.
 
     # If break was set, abort any other syncs
     if [ "$BREAK" != 0 ] ; then
@@ -575,15 +590,49 @@ do_sync(){
         log "Error - unexpected status $STATUS in do_sync"
         return
     fi
+    SYNC_STARTED+=("$EXPERIMENT")
 
     # Work out the right SYNC_CMD. The instrument/upstream name is the second part of
     # the EXPERIMENT.
-    local instrument sync_cmd
+    local instrument sync_cmd bwlimit
     instrument=`sed 's/[^_]\+_\([^_]\+\)_.*/\1/' <<<"$EXPERIMENT"`
     eval sync_cmd="\${SYNC_CMD_${instrument}:-}"
     sync_cmd="${sync_cmd:-$SYNC_CMD}"  # Or the default?
     sync_cmd="${sync_cmd:-false}"      # Well there should be a command :-/
 
+    # If SYNC_TRICKLE_CMD is set, cells that are still running upstream just have the files
+    # that MinKNOW has finished with synced, so there is little left to copy at the end.
+    local trickle_cmd trickle_age
+    eval trickle_cmd="\${SYNC_TRICKLE_CMD_${instrument}:-}"
+    trickle_cmd="${trickle_cmd:-${SYNC_TRICKLE_CMD:-}}"
+    eval trickle_age="\${SYNC_TRICKLE_AGE_${instrument}:-}"
+    trickle_age="${trickle_age:-${SYNC_TRICKLE_AGE:-300}}"
+
+    # If SYNC_BATCH_CMD is set, all the cells are synced in one go, with the list of
+    # cells in ${files_from}
+    local batch_cmd files_from="" batch_upstream=""
+    eval batch_cmd="\${SYNC_BATCH_CMD_${instrument}:-}"
+    batch_cmd="${batch_cmd:-${SYNC_BATCH_CMD:-}}"
+    if [ -n "$trickle_cmd" ] && [ -n "$batch_cmd" ] ; then
+        plog "Ignoring SYNC_BATCH_CMD as cells must be synced one at a time in trickle mode"
+        batch_cmd=""
+    fi
+    if [ -n "$batch_cmd" ] ; then
+        files_from="$run_dir_full/pipeline/sync_files_from.txt"
+        : >"$files_from"
+    fi
+
+    # The bandwidth cap for the instrument is shared between the jobs that may run at once
+    local bwlimit_kib
+    eval bwlimit="\${SYNC_BWLIMIT_${instrument}:-${SYNC_BWLIMIT:-}}"
+    if [ -z "$bwlimit" ] ; then
+        true
+    elif bwlimit_kib="$(bwlimit_to_kib "$bwlimit")" ; then
+        bwlimit=$(( $bwlimit_kib / $(sync_jobs_for "$instrument") ))
+    else
+        log "Error - cannot share SYNC_BWLIMIT value '$bwlimit' between jobs, so using it as-is"
+    fi
+
     # Loop through cells
     while IFS=$'\t' read experiment upstream cell ; do
 
@@ -606,18 +655,17 @@ do_sync(){
                 upstream_host=""
             fi
             upstream_path="${upstream#*:}"
-
-            # Run the SYNC_CMD - if the return code is 130 or 20 then abort all
-            # pending ops (presume Ctrl+C was pressed) else if there is an error
-            # proceed to the next experiment. Note it is essential to redirect stdin!
-            # Also unset IFS to avoid re-splitting on spaces in filenames.
-            IFS= eval echo "Running: $sync_cmd" | plog
-            if IFS= eval $sync_cmd </dev/null |&plog ; then
-                true
-            elif [ $? = 130 -o $? = 20 ] ; then
-                touch pipeline/sync.failed ; BREAK=1 ; return
+            run="$experiment"
+
+            if [ -n "$batch_cmd" ] ; then
+                # Just add it to the list
+                printf "%s\n" "$cell" >>"$files_from"
+                batch_upstream="$upstream"
+            elif [ -n "$trickle_cmd" ] ; then
+                files_from="$run_dir_full/pipeline/$(cell_to_tfn "$cell").settled_files.txt"
+                queue_sync_job "$cell" "$sync_cmd" "$trickle_cmd"
             else
-                touch pipeline/sync.failed ; return
+                queue_sync_job "$cell" "$sync_cmd"
             fi
         else
             plog "Cell $cell is already synced and/or complete"
@@ -625,8 +673,93 @@ do_sync(){
 
     done < <(awk -F $'\t' -v expid="$EXPERIMENT" '$1 == expid {print}' <<<"$UPSTREAM_INFO")
 
-    check_for_ready_cells
-    mv pipeline/sync.started pipeline/sync.done
+    # In batch mode, sync all the cells in a single job. The upstream is the same for
+    # every cell in an experiment.
+    if [ -n "$batch_upstream" ] ; then
+        upstream="$batch_upstream" cell=""
+        plog "Syncing `wc -l <"$files_from"` cells from $upstream in one batch"
+        queue_sync_job "$EXPERIMENT" "$batch_cmd"
+    fi
+}
+
+queue_sync_job(){
+    # Queue a sync command, along with all the variables it may use, to be run by
+    # sync_scheduler.py. Unset IFS to avoid re-splitting on spaces in filenames.
+    # Any ssh in the command goes via the wrapper, so it shares the pooled connection.
+    # If a trickle command is given, that is run instead while the cell is still running
+    # upstream, with the files to copy listed in $files_from (see list_settled_files.sh).
+    # usage: queue_sync_job label command [trickle_command]
+    local job_cmd run_cmd
+    IFS= eval echo "Queueing: $2" | plog
+    printf -v run_cmd 'IFS= eval %q' "$2"
+    if [ -n "${3:-}" ] ; then
+        IFS= eval echo "Queueing while the cell is running: $3" | plog
+        printf -v run_cmd 'rc=0 ; list_settled_files.sh "$upstream" "$cell" %q >"$files_from" || rc=$? ; if [ $rc = 3 ] ; then %s ; elif [ $rc = 0 ] ; then IFS= eval %q ; else exit $rc ; fi' \
+            "$trickle_age" "$run_cmd" "$3"
+    fi
+    printf -v job_cmd 'ssh(){ local IFS=" " ; command ssh ${SSH_POOL_OPTS:-} "$@" ; } ; EXPERIMENT=%q upstream=%q upstream_host=%q upstream_path=%q cell=%q run=%q run_dir=%q run_dir_full=%q bwlimit=%q files_from=%q ; %s' \
+        "$EXPERIMENT" "$upstream" "$upstream_host" "$upstream_path" "$cell" \
+        "$run" "$run_dir" "$run_dir_full" "$bwlimit" "$files_from" "$run_cmd"
+    SYNC_JOB_LIST+="$(printf '%s\t' "$EXPERIMENT" "$instrument" "$run_dir_full" \
+                                "$per_expt_log" "$1")$job_cmd"$'\n'
+}
+
+finish_sync(){
+    # Called per experiment after sync_scheduler.py has run all the jobs from do_sync,
+    # with $1 being the result from sync_scheduler.py
+    unset per_expt_log
+    per_expt_logname="sync_from_upstream.log"
+
+    # If the return code was 130 or 20 then abort all pending ops (presume Ctrl+C
+    # was pressed) else if there is an error proceed to the next experiment.
+    case "$1" in
+        done)    plog "Sync completed at `date`"
+                 check_for_ready_cells
+                 precompress_fastq
+                 mv pipeline/sync.started pipeline/sync.done ;;
+        aborted) plog "Sync aborted at `date`"
+                 touch pipeline/sync.failed ; BREAK=1 ;;
+        *)       plog "Sync failed at `date`"
+                 touch pipeline/sync.failed ;;
+    esac
+}
+
+precompress_fastq(){
+    # If PRECOMPRESS_FASTQ is set, compress the FASTQ files that have arrived for cells
+    # which are still syncing, using this many jobs, so that Snakefile.main has less to do
+    # when the cells are ready. This holds up the driver, so no new file is started after
+    # PRECOMPRESS_TIME_LIMIT seconds and the rest wait for the next sync. See fq_precompress.py
+    [ -n "${PRECOMPRESS_FASTQ:-}" ] || return 0
+
+    local cell cells=()
+    for cell in ${CELLSPENDING[@]+"${CELLSPENDING[@]}"} ; do
+        [ -e "pipeline/$(cell_to_tfn "$cell").synced" ] || cells+=("$cell")
+    done
+    [ ${#cells[@]} != 0 ] || return 0
+
+    plog "Pre-compressing FASTQ for ${#cells[@]} cells that are still syncing"
+    fq_precompress.py -j "$PRECOMPRESS_FASTQ" -t "${PRECOMPRESS_TIME_LIMIT:-300}" \
+        ${COMPRESS_PROFILE:+--profile "$COMPRESS_PROFILE"} \
+        "$PWD" "${cells[@]}" |& plog || \
+        log "Error pre-compressing FASTQ for $EXPERIMENT"
+}
+
+bwlimit_to_kib(){
+    # Convert an rsync-style bandwidth limit (eg. 20000, 500K, 10M, 1G) to KiB/s, or
+    # return 1 if it is not in a form we can divide.
+    [[ "$1" =~ ^([0-9]+)([KkMmGg]?)$ ]] || return 1
+    case "${BASH_REMATCH[2]}" in
+        [Mm]) echo $(( 10#${BASH_REMATCH[1]} * 1024 )) ;;
+        [Gg]) echo $(( 10#${BASH_REMATCH[1]} * 1024 * 1024 )) ;;
+        *)    echo $(( 10#${BASH_REMATCH[1]} )) ;;
+    esac
+}
+
+sync_jobs_for(){
+    # How many sync jobs to run at once for an instrument
+    local jobs
+    eval jobs="\${SYNC_JOBS_${1}:-${SYNC_JOBS:-1}}"
+    echo "$jobs"
 }
 
 ###--->>> UTILITY FUNCTIONS <<<---###
@@ -907,10 +1040,19 @@ get_run_status() {
   # invoke run_status.py in CWD and collect some meta-information about the experiment.
   # We're passing this info to the state functions via global variables.
 
+  # If get_all_run_status was called, the answer should already be in ALL_RUN_STATUS,
+  # in a block headed with "RunDir: $1".
+  local runstatus="" line v
+  if [ -n "${ALL_RUN_STATUS:-}" ] ; then
+    runstatus="$(awk -v d="$1" '/^RunDir: / {p = (substr($0, 9) == d) ; next} p' \
+                     <<<"$ALL_RUN_STATUS")"
+  fi
+
   # This construct allows error output to be seen in the log.
-  local runstatus line v
-  runstatus="$(run_status.py -I "$1" <<<"$UPSTREAM_INFO")" || \
+  if [ -z "$runstatus" ] ; then
+    runstatus="$(run_status.py -I "$1" <<<"$UPSTREAM_INFO")" || \
         run_status.py -I "$1" <<<"$UPSTREAM_INFO" | log 2>&1
+  fi
 
   # Capture the various parts into variables (see test/grs.sh)
   for v in EXPERIMENT/Experiment \
@@ -933,21 +1075,93 @@ get_run_status() {
   RUN_OUTPUT="$(readlink -f "$1/pipeline/output" || true)"
 }
 
+get_all_run_status() {
+  # Invoke run_status.py just once for all the run directories given, so that UPSTREAM_INFO
+  # is only parsed once, and save the output in ALL_RUN_STATUS for get_run_status.
+  # If this fails, get_run_status will fall back to checking the runs one at a time.
+  ALL_RUN_STATUS=""
+  [ $# != 0 ] || return 0
+
+  local opts=-IB
+  [ "$FULL_RESCAN" = 0 ] || opts=-IBF
+
+  ALL_RUN_STATUS="$(run_status.py $opts "$@" <<<"$UPSTREAM_INFO" 2> >(log))" || {
+        log "Failed to get the status of all runs at once. Checking them individually."
+        ALL_RUN_STATUS="" ; }
+
+  # Note the runs that are finished, so the scanning loop can skip them, along with
+  # the message to log for each.
+  local run msg
+  while IFS=$'\t' read -r run msg ; do
+    FINISHED_RUNS["$run"]="$msg"
+  done < <(awk -F $'\t' \
+                '/^RunDir: /     {d = substr($0, 9)}
+                 /^Experiment: / {e = substr($0, 13)}
+                 /^Cells: /      {c = (length($0) > 7) ? NF : 0}
+                 /^PipelineStatus: (complete|aborted|stripped)$/ {
+                    print d "\t" e " with " c " cell(s) and status=" substr($0, 17) }' \
+                <<<"$ALL_RUN_STATUS")
+}
+
+ssh_pool_close(){
+    # Shut down the shared SSH connections and remove the sockets
+    local sock
+    [ -n "${SSH_POOL_DIR:-}" ] || return 0
+    for sock in "$SSH_POOL_DIR"/* ; do
+        [ -S "$sock" ] && ssh -o ControlPath="$sock" -O exit pooled >/dev/null 2>&1 || true
+    done
+    rm -rf "$SSH_POOL_DIR"
+}
+
+###--->>> SSH CONNECTION POOL <<<---###
+# All SSH connections to an upstream host during this run of the driver share a single
+# master connection, so only the first one pays for the connection setup. If the master
+# connection dies, ssh just connects directly instead. Set SSH_POOL=no to disable this.
+# Sync commands get the options via a wrapper function (see queue_sync_job) and rsync
+# picks them up from RSYNC_RSH.
+if [ "${SSH_POOL:-yes}" != no ] ; then
+    SSH_POOL_DIR="$(mktemp -d "${TMPDIR:-/tmp}/hesiod_ssh.XXXXXX")"
+    SSH_POOL_OPTS="-o ControlMaster=auto -o ControlPath=$SSH_POOL_DIR/%C -o ControlPersist=${SSH_POOL_PERSIST:-120}"
+    RSYNC_RSH="${RSYNC_RSH:-ssh $SSH_POOL_OPTS}"
+    export SSH_POOL_OPTS RSYNC_RSH
+    trap 'ssh_pool_close ; log "=== `date`. Finished run; PID=$$ ==="' EXIT
+fi
+
 ###--->>> GET INFO FROM UPSTREAM SERVER(S) <<<---###
+# The listings are run concurrently so that one slow or unreachable instrument does not
+# hold up the rest, and each is killed after UPSTREAM_TIMEOUT (or UPSTREAM_TIMEOUT_{NAME})
+# seconds. The results are then collected in the order given in $UPSTREAM.
 export UPSTREAM_LOC UPSTREAM_NAME
 UPSTREAM_INFO="" UPSTREAM_LOCS=() UPSTREAM_FAILS=()
+upstream_tmp="$(mktemp -d)"
+upstream_pids=()
 
 for UPSTREAM_NAME in $UPSTREAM ; do
     eval UPSTREAM_LOC="\$UPSTREAM_${UPSTREAM_NAME}"
+    eval upstream_timeout="\${UPSTREAM_TIMEOUT_${UPSTREAM_NAME}:-${UPSTREAM_TIMEOUT:-120}}"
+
+    log ">> Looking for ${UPSTREAM_NAME} upstream runs in $UPSTREAM_LOC"
+    timeout -k 10 "$upstream_timeout" list_remote_cells.sh \
+        >"$upstream_tmp/${#UPSTREAM_LOCS[@]}.tsv" 2>"$upstream_tmp/${#UPSTREAM_LOCS[@]}.err" &
+    upstream_pids+=($!)
     UPSTREAM_LOCS+=("$UPSTREAM_LOC")
+done
+
+for nn in "${!upstream_pids[@]}" ; do
+    UPSTREAM_LOC="${UPSTREAM_LOCS[$nn]}"
 
     # If this fails (network error or whatever) we still want to process local stuff
-    log ">> Looking for ${UPSTREAM_NAME} upstream runs in $UPSTREAM_LOC"
-    UPSTREAM_INFO+="$(list_remote_cells.sh 2> >(log) ; printf $)" \
-        || UPSTREAM_FAILS+=("$UPSTREAM_LOC")
+    wait "${upstream_pids[$nn]}" && rc=0 || rc=$?
+    log <"$upstream_tmp/$nn.err"
+    if [ $rc != 0 ] ; then
+        [ $rc != 124 ] || log "Timed out looking for upstream runs in $UPSTREAM_LOC"
+        UPSTREAM_FAILS+=("$UPSTREAM_LOC")
+    fi
+    UPSTREAM_INFO+="$(cat "$upstream_tmp/$nn.tsv" ; printf $)"
     # https://stackoverflow.com/questions/15184358/how-to-avoid-bash-command-substitution-to-remove-the-newline-character
     UPSTREAM_INFO=${UPSTREAM_INFO%$}
 done
+rm -rf "$upstream_tmp"
 printf "%s" "$UPSTREAM_INFO" | debug
 log "Found `printf "%s" "$UPSTREAM_INFO" | wc -l` cells in upstream runs"
 unset UPSTREAM_LOC UPSTREAM_NAME
@@ -989,16 +1203,27 @@ if [ -z "${prom_runs_list:-}" ] && [ -z "$UPSTREAM_INFO" ] ; then
     exit 1
 fi
 
-# For starters scan through each prom_run dir until we find something that needs dealing with.
-BREAK=0
+# Get the status of all the runs we are interested in with one call to run_status.py
+runs_to_check=()
 for run in "${prom_runs_list[@]}" ; do
-
     if ! [[ "`basename $run`" =~ ^${EXP_NAME_REGEX}$ ]] ; then
         debug "Ignoring `basename $run`"
         continue
     fi
+    runs_to_check+=("$run")
+done
+declare -A FINISHED_RUNS=()
+get_all_run_status ${runs_to_check[@]+"${runs_to_check[@]}"}
+
+# For starters scan through each prom_run dir until we find something that needs dealing with.
+BREAK=0
+for run in ${runs_to_check[@]+"${runs_to_check[@]}"} ; do
 
-    # TODO - consider pruning the list of runs to avoid get_run_status on every old run.
+    # There is nothing to do for complete, aborted or stripped runs
+    if [ -n "${FINISHED_RUNS[$run]:-}" ] ; then
+        debug "${FINISHED_RUNS[$run]}"
+        continue
+    fi
 
     # This sets EXPERIMENT, STATUS, etc. as a side-effect
     get_run_status "$run"
@@ -1029,6 +1254,8 @@ done
 if [ "$BREAK" != 0 ] ; then
     wait ; exit
 fi
+# Runs may have changed state since, so don't use the saved statuses again
+ALL_RUN_STATUS=""
 
 # Now synthesize new run events
 STATUS=new
@@ -1089,7 +1316,8 @@ if [ "${#SYNC_QUEUE[@]}" != 0 ] ; then
         nn=$(( $nn + 1 ))
     done
 
-    # Second loop actually syncs
+    # Second loop works out what needs syncing
+    SYNC_JOB_LIST="" SYNC_STARTED=()
     for EXPERIMENT in "${SYNC_QUEUE[@]}" ; do
         run_dir="$(dir_for_run "$EXPERIMENT")"
         run_dir_full="$PROM_RUNS/$run_dir"
@@ -1103,6 +1331,31 @@ if [ "${#SYNC_QUEUE[@]}" != 0 ] ; then
         set -e
         popd >/dev/null
     done
+
+    # Now run all the commands, several at once if SYNC_JOBS is set. The limits are keyed
+    # by the instrument names that do_sync put in the job list.
+    sync_limits=()
+    for instrument in $(cut -f2 <<<"$SYNC_JOB_LIST" | sort -u) ; do
+        sync_limits+=(-l "${instrument}=$(sync_jobs_for "$instrument")")
+    done
+    sync_results="$(sync_scheduler.py -j "${SYNC_JOBS:-1}" ${sync_limits[@]+"${sync_limits[@]}"} \
+                        <<<"$SYNC_JOB_LIST" 2> >(log))" || log "Error running sync_scheduler.py"
+
+    # And the third loop deals with the outcome
+    for EXPERIMENT in ${SYNC_STARTED[@]+"${SYNC_STARTED[@]}"} ; do
+        run_dir="$(dir_for_run "$EXPERIMENT")"
+        run_dir_full="$PROM_RUNS/$run_dir"
+        get_run_status "$run_dir_full"
+
+        # An experiment with nothing to sync is done. If sync_scheduler.py failed we
+        # can't tell, so assume the worst.
+        sync_result="$(awk -F $'\t' -v e="$EXPERIMENT" '$1 == e {print $2}' <<<"$sync_results")"
+        [ -n "$sync_result" ] || grep -q "^$EXPERIMENT"$'\t' <<<"$SYNC_JOB_LIST" || sync_result=done
+
+        pushd "$run_dir_full" >/dev/null
+        finish_sync "$sync_result"
+        popd >/dev/null
+    done
 fi
 
 wait
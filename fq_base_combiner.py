@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+"""Combine several .count files into one, as fq_base_combiner.awk did, but also
+   adding up the length and mean-Q histograms. If any of the inputs are old files
+   without histograms, the output will have none either.
+"""
+
+import logging as L
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+from hesiod import load_yaml
+from hesiod.FastqCounter import format_counts, merge_hists
+
+def main(args):
+
+    L.basicConfig( level = L.DEBUG if args.verbose else L.WARNING,
+                   format = "{levelname}:{message}",
+                   style = '{' )
+
+    all_counts = []
+    for f in args.counts:
+        L.debug(f"Reading {f}")
+        all_counts.append(load_yaml(f))
+
+    print(combine_counts(all_counts, fn=args.fn), end='')
+
+def combine_counts(all_counts, fn="unknown"):
+    """Add up a list of dicts as loaded from .count files, and return the text of
+       the combined file.
+    """
+    total_reads = 0
+    total_bases = 0
+    non_n_bases = 0
+    min_len = 0
+    max_len = 0
+
+    for c in all_counts:
+        total_reads += c['total_reads']
+        total_bases += c['total_bases']
+        non_n_bases += c['non_n_bases']
+
+        # An empty file says '0-0' which must not reset the min_len, as it would
+        # have done in the awk version.
+        if not c['total_reads']:
+            continue
+
+        # This works if the read length is already an int or a single string
+        rlsplit = str(c['read_length']).split('-')
+        max_len = max(max_len, int(rlsplit[-1]))
+        if min_len == 0 or int(rlsplit[0]) < min_len:
+            min_len = int(rlsplit[0])
+
+    # The total may not be integral if a file was truncated
+    if total_reads != int(total_reads):
+        total_reads = "{:.6g}".format(total_reads)
+
+    hists = dict()
+    for h in ['length_hist', 'meanq_hist']:
+        if all(h in c for c in all_counts):
+            hists[h] = merge_hists(c[h] for c in all_counts)
+
+    return format_counts( fn,
+                          total_reads = total_reads,
+                          min_len = min_len,
+                          max_len = max_len,
+                          total_bases = total_bases,
+                          non_n_bases = non_n_bases,
+                          **hists )
+
+def parse_args(*args):
+    description = """Combine .count files made by fq_base_counter.py or fq_merge.py"""
+
+    parser = ArgumentParser( description = description,
+                             formatter_class = ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("counts", nargs='+',
+                        help=".count files to add up")
+    parser.add_argument("-n", "--fn", default="unknown",
+                        help="Filename to report in the output")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Print more logging to stderr")
+
+    return parser.parse_args(*args)
+
+if __name__=="__main__":
+    main(parse_args())
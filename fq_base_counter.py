@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+"""Count the reads and bases in a FASTQ file, producing a .count file.
+   This is a drop-in replacement for fq_base_counter.awk, which was CPU-bound on
+   the larger cells. The output format is exactly the same.
+
+   Normally fq_merge.py makes the .count files while it compresses the data, but this
+   is useful for counting existing files. Input may be gzipped.
+"""
+
+import os, sys
+import logging as L
+import gzip
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+from hesiod.FastqCounter import FastqCounter, BLOCK_SIZE
+
+def main(args):
+
+    L.basicConfig( level = L.DEBUG if args.verbose else L.WARNING,
+                   format = "{levelname}:{message}",
+                   style = '{' )
+
+    counter = FastqCounter()
+    for f in (args.fastq or ['-']):
+        L.debug(f"Reading {f}")
+        with open_fastq(f) as fh:
+            while True:
+                chunk = fh.read(BLOCK_SIZE)
+                if not chunk:
+                    break
+                counter.update(chunk)
+    counter.finish()
+
+    if args.fn:
+        fn = args.fn
+    elif args.fastq and len(args.fastq) == 1:
+        fn = os.path.basename(args.fastq[0])
+        if fn.endswith('.gz'):
+            fn = fn[:-3]
+    else:
+        fn = "unknown"
+
+    print(counter.format(fn), end='')
+
+def open_fastq(filename):
+    """Open a FASTQ file in binary mode, which may be gzipped or '-' for stdin.
+    """
+    if filename == '-':
+        return open(sys.stdin.fileno(), 'rb', closefd=False)
+    elif filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    else:
+        return open(filename, 'rb')
+
+def parse_args(*args):
+    description = """Count reads and bases in FASTQ files, in the same format as
+                     fq_base_counter.awk. Multiple files are counted together."""
+
+    parser = ArgumentParser( description = description,
+                             formatter_class = ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("fastq", nargs='*',
+                        help="FASTQ files to count. Default is to read from stdin.")
+    parser.add_argument("-n", "--fn",
+                        help="Filename to report in the output. Default is to use the"
+                             " name of the input file, if there is just one.")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Print more logging to stderr")
+
+    return parser.parse_args(*args)
+
+if __name__=="__main__":
+    main(parse_args())
@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+
+"""Concatenate a bunch of FASTQ files into a single .fastq.gz, and at the same time
+   produce the .count and .md5 files that go with it.
+
+   This used to be three steps in the concat_gzip_md5sum_fastq rule:
+     1) cat | pigz > out.fastq.gz
+     2) pigz -cd out.fastq.gz | fq_base_counter.awk > out.fastq.count
+     3) md5sum out.fastq.gz > out.fastq.gz.md5
+   which meant reading all the data three times and decompressing it again. Here the
+   input is read just once, and each buffer is fed to the compressor and to the counter,
+   while the compressed output is checksummed as it is written out. The outputs should be
+   byte-identical to what the old rule made, since we still use pigz for compression.
+
+   Already-gzipped inputs are appended to the output as-is (after the files which need
+   compressing), but are decompressed in order to count the reads, and this decompression
+   also serves to validate the gzip CRCs, as 'pigz -t' did before. With --threads, this
+   is done for several files at once.
+
+   With --precompressed, any files already compressed or checked by fq_precompress.py are
+   just copied from the cache along with their saved counts. The output is then a
+   different sequence of gzip members, but decompresses to exactly the same FASTQ.
+
+   For big inputs the work can be split over several jobs. With --shard I/N (counting
+   from 0) just the I-th of N contiguous slices of the inputs, balanced by size, is
+   merged into its own .gz file, with the counts saved in a .json file alongside. Then
+   --from_shards concatenates the shards in order and adds up their counts, which is
+   cheap since nothing is recompressed.
+
+   With --resume the output is written to a .partial file and a .journal records each
+   point where the output ends with a complete gzip member, along with the counts so far.
+   If the job is killed, running it again truncates the .partial file to the last of
+   these and carries on from the next input file, re-reading the part already written to
+   get the MD5. Uncompressed inputs are compressed in batches of --checkpoint_size bytes,
+   so not too much work is lost.
+
+   With --bgzf the output is BGZF (blocked gzip, as made by bgzip) rather than the output
+   of the compressor, and a .gzi index is saved alongside, so readers can decompress the
+   file in parallel or seek to any point in it (see hesiod/Bgzf.py). Every input has to be
+   compressed afresh, so the cache and the journal are not used, but shards still work.
+"""
+
+import os
+import logging as L
+import hashlib
+import shlex
+import json
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from functools import partial
+
+from hesiod import slurp_file, md5sum_line
+from hesiod.FastqCounter import FastqCounter, BLOCK_SIZE
+from hesiod.FastqCache import ( FastqCache, DEFAULT_COMPRESSOR,
+                                compress_fastq, copy_and_sum, append_gz,
+                                append_gz_parallel, GzipChecker )
+from hesiod.Bgzf import BgzfWriter, BGZF_EOF, save_gzi, load_gzi
+
+def main(args):
+
+    L.basicConfig( level = L.DEBUG if args.verbose else L.INFO,
+                   format = "{levelname}:{message}",
+                   style = '{' )
+
+    if args.from_shards:
+        L.info(f"Concatenating {len(args.from_shards)} shards into {args.out}")
+        with open(args.out, "wb") as out_fh:
+            counter, md5 = concat_shards(args.from_shards, out_fh, bgzf=args.bgzf)
+        if args.bgzf:
+            with open(args.out + ".gzi", "wb") as gfh:
+                save_gzi(concat_gzi(args.from_shards), gfh)
+    else:
+        fastq_files = slurp_file(args.fofn) if args.fofn else []
+        fastq_gz_files = slurp_file(args.fofn_gz) if args.fofn_gz else []
+        if args.shard:
+            shard, nshards = map(int, args.shard.split('/'))
+            fastq_files, fastq_gz_files = shard_slice(fastq_files, fastq_gz_files, shard, nshards)
+        L.info(f"Merging {len(fastq_files)} fastq and {len(fastq_gz_files)} fastq.gz files"
+               f" into {args.out}")
+
+        if args.bgzf:
+            with open(args.out, "wb") as out_fh:
+                counter, md5, index = merge_fastq_bgzf( fastq_files,
+                                                        fastq_gz_files,
+                                                        out_fh,
+                                                        threads = args.threads or 1,
+                                                        finish = not args.shard,
+                                                        eof = not args.shard )
+            with open(args.out + ".gzi", "wb") as gfh:
+                save_gzi(index, gfh)
+        else:
+            compressor = shlex.split(args.compressor)
+            if args.threads:
+                compressor.append(f"-p{args.threads}")
+
+            cache = FastqCache(args.precompressed, compressor) if args.precompressed else None
+
+            journal = None
+            out_file = args.out
+            if args.resume:
+                out_file = args.out + ".partial"
+                journal = MergeJournal( args.out + ".journal",
+                                        journal_key(fastq_files, fastq_gz_files, compressor) )
+
+            # When resuming, MergeJournal.resume() decides how much of the file to keep
+            out_mode = "r+b" if journal and os.path.exists(out_file) else "w+b"
+            try:
+                with open(out_file, out_mode) as out_fh:
+                    counter, md5 = merge_fastq( fastq_files,
+                                                fastq_gz_files,
+                                                out_fh,
+                                                compressor = compressor,
+                                                cache = cache,
+                                                finish = not args.shard,
+                                                journal = journal,
+                                                batch_size = args.checkpoint_size if journal else None,
+                                                gz_jobs = args.threads or 1 )
+            finally:
+                if journal:
+                    journal.close()
+
+            if journal:
+                os.replace(out_file, args.out)
+                journal.remove()
+
+        if args.shard:
+            # Save the counts for --from_shards, noting if the shard ended cleanly
+            whole = counter.at_record_boundary()
+            counter.finish()
+            with open(args.out + ".json", "w") as jfh:
+                json.dump(dict(whole=whole, counts=counter.as_dict()), jfh)
+
+    # The filename in the .count file is the output file minus the .gz
+    out_base = os.path.basename(args.out)
+    if args.counts:
+        with open(args.counts, "w") as cfh:
+            print(counter.format(out_base[:-3] if out_base.endswith(".gz") else out_base),
+                  file=cfh, end='')
+    if args.md5:
+        with open(args.md5, "w") as mfh:
+            print(md5sum_line(md5.hexdigest(), out_base), file=mfh, end='')
+
+    L.info(f"Wrote {counter.total_reads()} reads")
+
+def merge_fastq( fastq_files, fastq_gz_files, out_fh, compressor=None, cache=None, finish=True,
+                 journal=None, batch_size=None, gz_jobs=1 ):
+    """Does the actual work. The uncompressed files are piped through the compressor
+       command, and the compressed files tacked on the end.
+       If a FastqCache is supplied, any files found in the cache are appended as ready-made
+       gzip members, with the saved counts, and only the rest are compressed.
+       If a MergeJournal is supplied, we carry on from the last checkpoint (if any) and
+       save a new checkpoint after each part of the output is written. In this case
+       out_fh must be open for reading and writing.
+       If batch_size is set, the files are compressed or checked in batches of about
+       this many bytes.
+       The .fastq.gz files are checked gz_jobs at a time, but still written in order.
+       Returns the counter and the hashlib MD5 object. The counter is not finished if
+       finish=False.
+    """
+    counter = FastqCounter()
+    md5 = hashlib.md5()
+    cache_hits = 0
+
+    # How many of the input files (fastq then fastq.gz) are already in the output
+    files_done = 0
+    if journal:
+        files_done, counter = journal.resume(out_fh, md5)
+        if files_done:
+            L.info(f"Resuming after {files_done} files")
+
+    def _checkpoint(n):
+        # We can only save the counter if it has no partial record
+        if journal and counter.at_record_boundary():
+            journal.checkpoint(out_fh, n, counter)
+
+    # Files are compressed in batches between the cached ones, so the order is kept
+    to_compress = []
+    to_compress_size = 0
+    def _flush():
+        nonlocal to_compress_size
+        compress_fastq(to_compress, out_fh, compressor, counter, md5)
+        to_compress.clear()
+        to_compress_size = 0
+
+    for n, f in enumerate(fastq_files):
+        if n < files_done:
+            continue
+        cached = cache and cache.lookup(f)
+        if cached:
+            if to_compress:
+                _flush()
+                _checkpoint(n)
+            # The saved counts can only be used if the previous file ended cleanly
+            if counter.at_record_boundary():
+                append_cached(*cached, out_fh, md5, counter)
+                cache_hits += 1
+                _checkpoint(n + 1)
+                continue
+        to_compress.append(f)
+        if batch_size:
+            to_compress_size += os.stat(f).st_size
+            if to_compress_size >= batch_size:
+                _flush()
+                _checkpoint(n + 1)
+
+    # If there were no files, or none were cached, this works as it always did
+    if to_compress or not out_fh.tell():
+        _flush()
+        _checkpoint(len(fastq_files))
+
+    # Now the .fastq.gz files, checking several at once if gz_jobs is set
+    to_check = []
+    to_check_size = 0
+    def _check():
+        nonlocal to_check_size
+        append_gz_parallel(to_check, out_fh, md5, counter, jobs=gz_jobs)
+        to_check.clear()
+        to_check_size = 0
+
+    for n, f in enumerate(fastq_gz_files, start=len(fastq_files)):
+        if n < files_done:
+            continue
+        cached = cache and cache.lookup(f)
+        if cached:
+            if to_check:
+                _check()
+                _checkpoint(n)
+            if counter.at_record_boundary():
+                append_cached(*cached, out_fh, md5, counter)
+                cache_hits += 1
+                _checkpoint(n + 1)
+                continue
+        to_check.append(f)
+        if batch_size:
+            to_check_size += os.stat(f).st_size
+            if to_check_size >= batch_size:
+                _check()
+                _checkpoint(n + 1)
+
+    if to_check:
+        _check()
+        _checkpoint(len(fastq_files) + len(fastq_gz_files))
+
+    if cache:
+        L.info(f"Used pre-compressed data for {cache_hits} of"
+               f" {len(fastq_files) + len(fastq_gz_files)} files")
+
+    if finish:
+        counter.finish()
+    return counter, md5
+
+def merge_fastq_bgzf( fastq_files, fastq_gz_files, out_fh, threads=1, finish=True, eof=True ):
+    """As merge_fastq() but the output is BGZF, so every input is compressed (or
+       decompressed and compressed again) by BgzfWriter on the given number of threads.
+       The EOF block is left off if eof=False.
+       Returns the counter, the hashlib MD5 object and the index for the .gzi file.
+    """
+    counter = FastqCounter()
+    md5 = hashlib.md5()
+
+    with BgzfWriter(out_fh, md5, threads=threads, eof=eof) as writer:
+        for f in fastq_files:
+            with open(f, "rb") as ifh:
+                for chunk in iter(partial(ifh.read, BLOCK_SIZE), b''):
+                    counter.update(chunk)
+                    writer.write(chunk)
+
+        for f in fastq_gz_files:
+            checker = GzipChecker(f, counter, sink=writer.write)
+            with open(f, "rb") as ifh:
+                for chunk in iter(partial(ifh.read, BLOCK_SIZE), b''):
+                    checker.update(chunk)
+            checker.finish()
+
+    if finish:
+        counter.finish()
+    return counter, md5, writer.index
+
+def journal_key(fastq_files, fastq_gz_files, compressor):
+    """Something to identify the inputs to a merge, so we don't resume with the wrong
+       ones. If any file has changed size or mtime we need to start again.
+    """
+    inputs = [ [f, os.stat(f).st_size, os.stat(f).st_mtime_ns]
+               for f in [ *fastq_files, *fastq_gz_files ] ]
+    return hashlib.md5(json.dumps([inputs, compressor]).encode()).hexdigest()
+
+class MergeJournal:
+    """The progress of a merge, saved so it can be resumed if the job is killed. The
+       journal is JSON lines, the first of which has the key for the inputs, then one for
+       each checkpoint with the number of input files done, the size of the output at
+       that point and the counts.
+    """
+    def __init__(self, journal_file, key):
+        self.journal_file = journal_file
+        self.key = key
+        self._fh = None
+
+    def last_checkpoint(self):
+        """Get the last checkpoint saved for these inputs, or None.
+        """
+        try:
+            with open(self.journal_file) as fh:
+                lines = fh.read().splitlines()
+        except FileNotFoundError:
+            return None
+
+        last = None
+        for n, l in enumerate(lines):
+            try:
+                entry = json.loads(l)
+            except ValueError:
+                # The last line may be incomplete
+                break
+            if n == 0:
+                if entry.get('key') != self.key:
+                    return None
+            else:
+                last = entry
+        return last
+
+    def resume(self, out_fh, md5):
+        """Truncate the output to the last checkpoint and feed what is left to the md5.
+           Returns the number of files done and the counter, which will be 0 and a new
+           counter if we are starting afresh.
+        """
+        cp = self.last_checkpoint()
+        out_fh.seek(0, os.SEEK_END)
+        if cp and cp['offset'] <= out_fh.tell():
+            out_fh.truncate(cp['offset'])
+            out_fh.seek(0)
+            for chunk in iter(partial(out_fh.read, BLOCK_SIZE), b''):
+                md5.update(chunk)
+            self._fh = open(self.journal_file, "a")
+            return cp['done'], FastqCounter.from_dict(cp['counts'])
+
+        # Start again
+        out_fh.seek(0)
+        out_fh.truncate()
+        self._fh = open(self.journal_file, "w")
+        print(json.dumps(dict(key=self.key)), file=self._fh, flush=True)
+        return 0, FastqCounter()
+
+    def checkpoint(self, out_fh, done, counter):
+        """Record that the first done files are in the output, making sure the output
+           is on disk first.
+        """
+        out_fh.flush()
+        os.fsync(out_fh.fileno())
+        print( json.dumps(dict(done=done, offset=out_fh.tell(), counts=counter.as_dict())),
+               file=self._fh, flush=True )
+
+    def close(self):
+        if self._fh:
+            self._fh.close()
+            self._fh = None
+
+    def remove(self):
+        """The merge is done, so the journal is no longer needed.
+        """
+        self.close()
+        os.unlink(self.journal_file)
+
+def shard_slice(fastq_files, fastq_gz_files, shard, nshards):
+    """Get the fastq and fastq.gz files for one of nshards contiguous slices of all the
+       input files, splitting by the file sizes. Returns two lists, either of which may be
+       empty. All the files go in some shard, and in the same order.
+    """
+    all_files = [ *fastq_files, *fastq_gz_files ]
+    sizes = [ os.stat(f).st_size for f in all_files ]
+    total = sum(sizes) or 1
+
+    # Each file goes in the shard where it starts
+    res = []
+    pos = 0
+    for i, size in enumerate(sizes):
+        if min(pos * nshards // total, nshards - 1) == shard:
+            res.append(i)
+        pos += size
+
+    return ( [ all_files[i] for i in res if i < len(fastq_files) ],
+             [ all_files[i] for i in res if i >= len(fastq_files) ] )
+
+def concat_shards(shard_files, out_fh, bgzf=False):
+    """Concatenate the shards made with --shard, and add up the counts. If any shard but the
+       last stopped part way through a FASTQ record, the counts can't just be added so we
+       have to decompress everything and count it again.
+       BGZF shards have no EOF block, so if bgzf is set one is added on the end.
+       Returns the counter and the hashlib MD5 object.
+    """
+    md5 = hashlib.md5()
+    shard_counts = []
+    for f in shard_files:
+        with open(f + ".json") as jfh:
+            shard_counts.append(json.load(jfh))
+        with open(f, "rb") as ifh:
+            copy_and_sum(ifh, out_fh, md5)
+    if bgzf:
+        md5.update(BGZF_EOF)
+        out_fh.write(BGZF_EOF)
+
+    counter = FastqCounter()
+    if all( sc['whole'] for sc in shard_counts[:-1] ):
+        for sc in shard_counts:
+            counter.add(FastqCounter.from_dict(sc['counts']))
+    else:
+        L.warning("Shards do not split on FASTQ records. Counting all the reads again.")
+        for f in shard_files:
+            append_gz(f, None, None, counter)
+        counter.finish()
+
+    return counter, md5
+
+def concat_gzi(shard_files):
+    """Combine the .gzi indexes for BGZF shards, shifting each one by the size of the
+       shards before it. The last entry for each shard is the end of its data, which is
+       also the start of the next shard.
+    """
+    index = []
+    coffset = uoffset = 0
+    for f in shard_files:
+        with open(f + ".gzi", "rb") as gfh:
+            shard_index = load_gzi(gfh)
+        index.extend( (c + coffset, u + uoffset) for c, u in shard_index )
+        coffset += os.stat(f).st_size
+        if shard_index:
+            uoffset += shard_index[-1][1]
+    return index
+
+def append_cached(gz_file, cached_counter, out_fh, md5, counter):
+    """Append a pre-compressed file to out_fh, and add on the saved counts.
+    """
+    with open(gz_file, "rb") as ifh:
+        copy_and_sum(ifh, out_fh, md5)
+    counter.add(cached_counter)
+
+def parse_args(*args):
+    description = """Merge, compress, count and checksum FASTQ files in a single pass."""
+
+    parser = ArgumentParser( description = description,
+                             formatter_class = ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--fofn",
+                        help="File listing the uncompressed FASTQ files to merge")
+    parser.add_argument("--fofn_gz",
+                        help="File listing the gzipped FASTQ files to append")
+    parser.add_argument("-o", "--out", required=True,
+                        help="Output .fastq.gz file")
+    parser.add_argument("--md5",
+                        help="Output .md5 file, in the format made by md5sum")
+    parser.add_argument("--counts",
+                        help="Output .count file, in the format made by fq_base_counter.awk")
+    parser.add_argument("-z", "--compressor", default=DEFAULT_COMPRESSOR,
+                        help="Command used to compress the uncompressed inputs")
+    parser.add_argument("-p", "--threads", type=int,
+                        help="Number of threads for the compressor")
+    parser.add_argument("--shard",
+                        help="Just merge shard I of N, given as I/N, saving the counts in"
+                             " a .json file alongside the output")
+    parser.add_argument("--from_shards", nargs='+',
+                        help="Concatenate these shards, ignoring --fofn and --fofn_gz")
+    parser.add_argument("--resume", action="store_true",
+                        help="Keep a journal, and resume from it if a previous run was killed")
+    parser.add_argument("--checkpoint_size", type=int, default=2**30,
+                        help="With --resume, compress about this many bytes between checkpoints")
+    parser.add_argument("--precompressed",
+                        help="Run directory with data cached by fq_precompress.py")
+    parser.add_argument("--bgzf", action="store_true",
+                        help="Write BGZF, with a .gzi index, instead of using the compressor")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Print more logging to stderr")
+
+    args = parser.parse_args(*args)
+    if args.bgzf and (args.resume or args.precompressed):
+        parser.error("--bgzf cannot be used with --resume or --precompressed")
+
+    return args
+
+if __name__=="__main__":
+    main(parse_args())
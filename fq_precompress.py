@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+"""Compress and count the FASTQ files for cells which are still being synced, so that
+   fq_merge.py --precompressed has little left to do once the cell is ready.
+
+   Each file in the fastq_* directories of the cells which has not been modified for
+   --min_age seconds, and is not already in the cache, is compressed into
+   pipeline/precompressed in the run directory (see hesiod/FastqCache.py).
+   Files which are already gzipped are just checked and counted.
+   Running this again is cheap, as only new or changed files are looked at. With
+   --time_limit no new file is started after that many seconds, and the rest are left
+   for the next run, so this can be run on every sync without holding things up.
+"""
+
+import os
+import time
+import shlex
+import logging as L
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from concurrent.futures import ThreadPoolExecutor
+
+from hesiod.FastqCache import FastqCache
+from hesiod.Compression import PROFILES, DEFAULT_PROFILE, compression_profile, compressor_command
+
+def main(args):
+
+    L.basicConfig( level = L.DEBUG if args.verbose else L.INFO,
+                   format = "{levelname}:{message}",
+                   style = '{' )
+
+    # The compressor should match what Snakefile.main will use
+    compressor = shlex.split( args.compressor or
+                              compressor_command(compression_profile(args.profile)) )
+    if args.threads:
+        compressor.append(f"-p{args.threads}")
+    cache = FastqCache(args.run_dir, compressor)
+
+    settled_before = time.time() - args.min_age
+    to_do = [ f for c in args.cells
+                for f in find_fastq(os.path.join(args.run_dir, c), settled_before)
+                if not cache.lookup(f) ]
+    L.info(f"Pre-compressing {len(to_do)} FASTQ files")
+
+    deadline = time.time() + args.time_limit if args.time_limit else None
+    def _store(filename):
+        # Files already started are allowed to finish
+        if deadline and time.time() > deadline:
+            return None
+        return cache.store(filename)
+
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        results = list(executor.map(_store, to_do))
+
+    L.info(f"Cached {results.count(True)} files")
+    if results.count(None):
+        L.info(f"Reached the time limit. Leaving {results.count(None)} files for next time")
+
+def find_fastq(cell_dir, settled_before):
+    """Find the .fastq and .fastq.gz files in any fastq_* directory (or barcode
+       subdirectory) of the cell, which were last modified before settled_before.
+    """
+    res = []
+    if not os.path.isdir(cell_dir):
+        return res
+    for top in sorted(os.listdir(cell_dir)):
+        if not top.startswith("fastq_"):
+            continue
+        for dirpath, dirnames, filenames in os.walk(os.path.join(cell_dir, top)):
+            dirnames.sort()
+            for f in sorted(filenames):
+                if not f.endswith((".fastq", ".fastq.gz")):
+                    continue
+                f = os.path.join(dirpath, f)
+                if os.stat(f).st_mtime < settled_before:
+                    res.append(f)
+    return res
+
+def parse_args(*args):
+    description = """Compress and count FASTQ files into the cache used by fq_merge.py."""
+
+    parser = ArgumentParser( description = description,
+                             formatter_class = ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("run_dir",
+                        help="The run directory")
+    parser.add_argument("cells", nargs='+',
+                        help="Cells to look at, relative to the run directory")
+    parser.add_argument("--min_age", type=int, default=300,
+                        help="Skip files modified less than this many seconds ago")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Compress this many files at once")
+    parser.add_argument("-t", "--time_limit", type=int, default=0,
+                        help="Start no new files after this many seconds. 0 for no limit")
+    parser.add_argument("--profile", choices=PROFILES, default=DEFAULT_PROFILE,
+                        help="Compression profile, as set by compress_profile for Snakefile.main")
+    parser.add_argument("-z", "--compressor",
+                        help="Command used to compress the files, overriding --profile")
+    parser.add_argument("-p", "--threads", type=int,
+                        help="Number of threads for each compressor")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Print more logging to stderr")
+
+    return parser.parse_args(*args)
+
+if __name__=="__main__":
+    main(parse_args())
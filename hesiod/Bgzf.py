@@ -0,0 +1,149 @@
+"""Writing BGZF, the blocked gzip format used by bgzip and samtools, plus the .gzi index
+   that goes with it.
+
+   A BGZF file is a series of gzip members, each holding at most 64KiB of data and with
+   the compressed size of the member saved in an extra header field. Any gzip reader can
+   decompress it, so 'zcat' works as it always did. But a reader that knows the format can
+   find the start of every block without decompressing anything, and so can decompress
+   the blocks in parallel. The .gzi index lists the compressed and uncompressed offset of
+   each block, so a reader can also jump to any point in the uncompressed data (see
+   'bgzip -b ... -s ...' or pysam.libcbgzf).
+
+   This is written in Python rather than piping through bgzip, so that it works in the
+   same way as fq_merge.py does with pigz, and because bgzip may not be installed.
+   zlib releases the GIL, so compressing the blocks on several threads works well.
+"""
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# As bgzip, the data is cut into blocks of 0xff00 bytes, so that even if the data does not
+# compress at all the block stays within the 64KiB limit.
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_MAX_BLOCK = 0x10000
+
+# The default level for bgzip
+BGZF_LEVEL = 6
+
+# A block with no data, which by convention marks the end of the file
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+def bgzf_block(data, level=BGZF_LEVEL):
+    """Compress up to BGZF_BLOCK_SIZE bytes of data into one BGZF block.
+    """
+    zobj = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = zobj.compress(data) + zobj.flush()
+    if len(cdata) + 26 > BGZF_MAX_BLOCK:
+        # Should not happen given the block size, but storing the data is always safe
+        zobj = zlib.compressobj(0, zlib.DEFLATED, -15)
+        cdata = zobj.compress(data) + zobj.flush()
+
+    # The header has the BC extra field, with the total size of the block minus 1
+    header = struct.pack( "<4BI2BH2BHH", 31, 139, 8, 4, 0, 0, 255,
+                          6, 66, 67, 2, len(cdata) + 25 )
+    return header + cdata + struct.pack("<2I", zlib.crc32(data), len(data))
+
+class BgzfWriter:
+    """Writes data to out_fh as BGZF, updating the md5 (if any) with the compressed
+       output. Blocks are compressed on up to threads threads at once, but always written
+       in order. Call close() at the end, or use this as a context manager, to write any
+       remaining data and then the EOF marker. If eof=False the EOF marker is left off, so
+       that more BGZF data may be appended later.
+
+       The index has a (compressed offset, uncompressed offset) pair for the end of each
+       block, which is the start of the next one, as made by 'bgzip -i'. The offsets are
+       relative to where out_fh was when we started.
+    """
+    def __init__(self, out_fh, md5=None, level=BGZF_LEVEL, threads=1, eof=True):
+        self.out_fh = out_fh
+        self.md5 = md5
+        self.level = level
+        self.eof = eof
+        self.index = []
+
+        self._coffset = 0
+        self._uoffset = 0
+        self._buf = bytearray()
+        self._executor = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+        self._threads = threads
+        self._pending = deque()
+
+    def write(self, data):
+        self._buf += data
+        if len(self._buf) >= BGZF_BLOCK_SIZE:
+            nblocks = len(self._buf) // BGZF_BLOCK_SIZE
+            for n in range(nblocks):
+                self._submit(bytes(self._buf[n * BGZF_BLOCK_SIZE:(n+1) * BGZF_BLOCK_SIZE]))
+            del self._buf[:nblocks * BGZF_BLOCK_SIZE]
+
+    def _submit(self, data):
+        if not self._executor:
+            self._write_block(bgzf_block(data, self.level), len(data))
+            return
+
+        self._pending.append((self._executor.submit(bgzf_block, data, self.level), len(data)))
+        # Don't let too much pile up in memory
+        while len(self._pending) > self._threads * 4:
+            self._write_block(*self._next_pending())
+
+    def _next_pending(self):
+        future, size = self._pending.popleft()
+        return future.result(), size
+
+    def _write_block(self, block, size):
+        if self.md5:
+            self.md5.update(block)
+        self.out_fh.write(block)
+        self._coffset += len(block)
+        self._uoffset += size
+        self.index.append((self._coffset, self._uoffset))
+
+    def flush(self):
+        """Write out all the data so far, even if the last block is short.
+        """
+        if self._buf:
+            self._submit(bytes(self._buf))
+            self._buf.clear()
+        while self._pending:
+            self._write_block(*self._next_pending())
+
+    def close(self):
+        """Write out everything, then the EOF marker.
+        """
+        try:
+            self.flush()
+            if self.eof:
+                if self.md5:
+                    self.md5.update(BGZF_EOF)
+                self.out_fh.write(BGZF_EOF)
+        finally:
+            if self._executor:
+                self._executor.shutdown()
+                self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0]:
+            # Don't write an EOF to a broken file
+            if self._executor:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+        else:
+            self.close()
+
+def save_gzi(index, fh):
+    """Save the index in the binary .gzi format used by bgzip and htslib, which is the
+       number of entries and then the pairs of offsets, all as 64-bit little-endian.
+    """
+    fh.write(struct.pack("<Q", len(index)))
+    for coffset, uoffset in index:
+        fh.write(struct.pack("<2Q", coffset, uoffset))
+
+def load_gzi(fh):
+    """Read a .gzi file back into a list of (compressed offset, uncompressed offset).
+    """
+    n, = struct.unpack("<Q", fh.read(8))
+    return [ struct.unpack("<2Q", fh.read(16)) for i in range(n) ]
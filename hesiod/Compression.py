@@ -0,0 +1,54 @@
+"""Compression settings for the files we make with pigz, ie. the merged FASTQ and the
+   sequencing summary.
+
+   We always used 'pigz -9', but on nanopore FASTQ this costs a lot of CPU time for a
+   couple of percent in size. So the settings are grouped into named profiles, which can
+   be chosen with compress_profile in the Snakemake config (or COMPRESS_PROFILE for the
+   driver), and any setting can be overridden with compress_level, compress_block and
+   compress_threads. Use scripts/benchmark_compression.py to see what the options give on
+   real data before changing the default.
+"""
+
+# The 'max' profile is what we had before.
+# level is the pigz level, block is the pigz block size in KiB and threads is the number
+# of threads for each FASTQ merge job.
+PROFILES = dict( max      = dict(level=9, block=512, threads=8),
+                 balanced = dict(level=6, block=512, threads=8),
+                 fast     = dict(level=3, block=512, threads=8) )
+DEFAULT_PROFILE = 'max'
+
+# Commands for the codecs that scripts/benchmark_compression.py knows about. Only gzip
+# format can be used for the outputs, as the customers expect .gz files and fq_merge.py
+# concatenates gzip members, but other codecs may be compared. {level} and {block} are
+# filled in, and the thread option is added if the codec has one.
+CODECS = dict( pigz = dict(cmd="pigz -nT -{level} -b{block}", threads="-p{threads}"),
+               gzip = dict(cmd="gzip -n -{level}",            threads=None),
+               zstd = dict(cmd="zstd -q -{level}",            threads="-T{threads}"),
+               lz4  = dict(cmd="lz4 -q -{level}",             threads=None),
+               xz   = dict(cmd="xz -{level}",                 threads="-T{threads}") )
+
+def compression_profile(name=None, **overrides):
+    """Get the settings for the named profile (or the default one) as a dict, with any
+       of the overrides which are not None applied.
+    """
+    try:
+        profile = dict(PROFILES[name or DEFAULT_PROFILE])
+    except KeyError:
+        raise ValueError(f"Unknown compression profile {name!r}. Choose from {list(PROFILES)}")
+
+    for k, v in overrides.items():
+        if k not in profile:
+            raise ValueError(f"Unknown compression setting {k!r}")
+        if v is not None:
+            profile[k] = int(v)
+
+    return profile
+
+def compressor_command(profile, codec='pigz', threads=False):
+    """Get the command line for the codec with the settings from the profile. Normally
+       the threads are left off, since the pipeline adds them to suit each job.
+    """
+    cmd = CODECS[codec]['cmd'].format(**profile)
+    if threads and CODECS[codec]['threads']:
+        cmd += " " + CODECS[codec]['threads'].format(**profile)
+    return cmd
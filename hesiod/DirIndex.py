@@ -0,0 +1,90 @@
+"""A persistent cache of directory listings, so that scan_cells.py does not have to
+   re-list every fastq_pass, pod5 etc. directory on every run.
+
+   A directory listing is only re-used if the mtime of the directory is unchanged, which
+   is the case unless files have been added, removed or renamed. A single stat() of each
+   directory is much cheaper than listing tens of thousands of files on Lustre.
+"""
+import os
+import json
+import time
+import threading
+import logging as L
+
+# A listing made within this many seconds of the directory mtime is not trusted, since
+# the directory could be modified again within the same mtime tick and we'd never know.
+RACY_SECONDS = 2
+
+def listdir(path):
+    """Uncached version of DirIndex.listdir(). Returns a list of [name, is_dir] for the
+       given directory, in the order the filesystem gives them. A missing directory
+       yields an empty list.
+    """
+    try:
+        with os.scandir(path) as it:
+            return [ [e.name, e.is_dir()] for e in it ]
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+class DirIndex:
+    """Index of directory listings, keyed by path, loaded from and saved to a JSON file.
+       Each entry is { "mtime_ns": int, "listed_at": float, "entries": [[name, is_dir], ...] }
+    """
+    def __init__(self, index_file=None, rebuild=False):
+        self.index_file = index_file
+        self.index = dict()
+
+        # What we actually looked at in this run, which is what we'll save
+        self.visited = dict()
+        self.hits = 0
+        self.misses = 0
+        # scan_cells may call us from several threads
+        self._lock = threading.Lock()
+
+        if index_file and not rebuild:
+            try:
+                with open(index_file) as fh:
+                    self.index = json.load(fh)
+            except FileNotFoundError:
+                L.debug(f"No index at {index_file}. Starting afresh.")
+            except ValueError:
+                L.warning(f"Ignoring corrupt index {index_file}")
+
+    def listdir(self, path):
+        """As the listdir() function, but cached.
+        """
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+
+        cached = self.index.get(path)
+        if ( cached and cached['mtime_ns'] == mtime_ns and
+             (cached['listed_at'] - mtime_ns / 1e9) > RACY_SECONDS ):
+            with self._lock:
+                self.hits += 1
+                self.visited[path] = cached
+            return cached['entries']
+
+        listed_at = time.time()
+        entries = listdir(path)
+
+        with self._lock:
+            self.misses += 1
+            self.visited[path] = dict( mtime_ns = mtime_ns,
+                                       listed_at = listed_at,
+                                       entries = entries )
+        return entries
+
+    def save(self):
+        """Save the listings used in this run, atomically replacing the old index.
+        """
+        if not self.index_file:
+            return
+
+        L.debug(f"Directory index: {self.hits} listings re-used, {self.misses} re-scanned")
+
+        tmp_file = f"{self.index_file}.tmp"
+        with open(tmp_file, 'w') as fh:
+            json.dump(self.visited, fh)
+        os.replace(tmp_file, self.index_file)
@@ -0,0 +1,295 @@
+"""A cache of pre-compressed FASTQ files, so that the compression work for a cell can be
+   done by fq_precompress.py as the files arrive, rather than all at the end. Then
+   fq_merge.py only needs to concatenate the ready-made gzip members and add up the counts.
+
+   The cache lives in pipeline/precompressed under the run directory. For each FASTQ file
+   there is a .gz file with the compressed data and a .json file with the size and mtime
+   of the original, the compressor command, and the counts, at the same relative path as
+   the original. An entry made with a different compressor command (eg. for another
+   compression profile) is not used, as the output would not match. For files
+   which are already gzipped only the .json is saved, so the original can be appended
+   without decompressing it again. The .json is written last, so an entry without one is
+   incomplete and is ignored.
+"""
+import os
+import re
+import json
+import shlex
+import logging as L
+import zlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from queue import Queue, Full
+from subprocess import Popen, PIPE
+
+from .FastqCounter import FastqCounter, BLOCK_SIZE
+from .Compression import compression_profile, compressor_command
+
+# This matches PIGZ in Snakefile.main with the default profile, minus the -p setting
+DEFAULT_COMPRESSOR = compressor_command(compression_profile())
+
+# Where the cache goes, relative to the run directory
+CACHE_SUBDIR = "pipeline/precompressed"
+
+# How far (in blocks of BLOCK_SIZE) each worker in append_gz_parallel() may get ahead
+MAX_QUEUED_BLOCKS = 64
+
+def compress_fastq(fastq_files, out_fh, compressor=None, counter=None, md5=None):
+    """Pipe the files through the compressor command to out_fh. The counter (if any) is fed
+       the uncompressed data and the md5 (if any) the compressed output.
+    """
+    if compressor is None:
+        compressor = shlex.split(DEFAULT_COMPRESSOR)
+
+    # Note that even with no input files the compressor still runs, so the output is
+    # always a valid (if empty) gzip file, as it was with 'xargs -r cat | pigz'.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with Popen(compressor + ["-c"], stdin=PIPE, stdout=PIPE) as zproc:
+            # Something needs to be reading the output while we're writing the input
+            drain = executor.submit(copy_and_sum, zproc.stdout, out_fh, md5)
+
+            try:
+                for f in fastq_files:
+                    with open(f, "rb") as ifh:
+                        for chunk in iter(partial(ifh.read, BLOCK_SIZE), b''):
+                            zproc.stdin.write(chunk)
+                            if counter:
+                                counter.update(chunk)
+            finally:
+                zproc.stdin.close()
+
+            drain.result()
+
+        if zproc.returncode:
+            raise RuntimeError(f"Compressor {compressor[0]} exited with status {zproc.returncode}")
+
+def copy_and_sum(in_fh, out_fh, md5=None):
+    """Copy in_fh to out_fh, updating the checksum as we go.
+    """
+    for chunk in iter(partial(in_fh.read, BLOCK_SIZE), b''):
+        if md5:
+            md5.update(chunk)
+        out_fh.write(chunk)
+
+class GzipChecker:
+    """Decompresses gzip data fed in chunks of any size, passing the FASTQ to a counter,
+       and to the sink function if there is one.
+       zlib checks the CRC and length of each gzip member for us, and as there may be
+       several members in the file we have to keep making new decompressors.
+    """
+    def __init__(self, filename, counter, sink=None):
+        self.filename = filename
+        self.counter = counter
+        self.sink = sink
+        self._dobj = zlib.decompressobj(wbits=31)
+        self._in_member = False
+
+    def update(self, chunk):
+        try:
+            while chunk:
+                data = self._dobj.decompress(chunk)
+                self.counter.update(data)
+                if self.sink:
+                    self.sink(data)
+                self._in_member = True
+                if self._dobj.eof:
+                    # Start of the next member, if any
+                    chunk = self._dobj.unused_data
+                    self._dobj = zlib.decompressobj(wbits=31)
+                    self._in_member = False
+                else:
+                    chunk = b''
+        except zlib.error as e:
+            raise RuntimeError(f"Corrupt gzip data in {self.filename}: {e}")
+
+    def finish(self):
+        if self._in_member:
+            raise RuntimeError(f"Corrupt gzip data in {self.filename}: file is truncated")
+
+def append_gz(filename, out_fh, md5, counter):
+    """Copy a gzipped file to out_fh, and at the same time decompress the data for the
+       counter, which checks the file is valid.
+       out_fh and md5 may be None if we only want the counts.
+    """
+    checker = GzipChecker(filename, counter)
+
+    with open(filename, "rb") as ifh:
+        for chunk in iter(partial(ifh.read, BLOCK_SIZE), b''):
+            if md5:
+                md5.update(chunk)
+            if out_fh:
+                out_fh.write(chunk)
+            checker.update(chunk)
+
+    checker.finish()
+
+def append_gz_parallel(filenames, out_fh, md5, counter, jobs=1):
+    """As append_gz() for a list of files, but checking several files at once. As the size
+       of each file is known, each worker writes its file straight to the right place in
+       the output with os.pwrite(), so the files are still only read once. The chunks are
+       passed back to be added to the md5 in order, and each worker can get up to
+       MAX_QUEUED_BLOCKS ahead of this.
+    """
+    if jobs <= 1 or len(filenames) <= 1:
+        for f in filenames:
+            append_gz(f, out_fh, md5, counter)
+        return
+
+    out_fh.flush()
+    fd = out_fh.fileno()
+    offsets = [ out_fh.tell() ]
+    for f in filenames:
+        offsets.append(offsets[-1] + os.stat(f).st_size)
+
+    queues = [ Queue(maxsize=MAX_QUEUED_BLOCKS) for f in filenames ]
+    stop = threading.Event()
+
+    def _put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=1)
+                return
+            except Full:
+                pass
+
+    def _worker(i):
+        # Each file gets a counter of its own, which we add on at the end
+        file_counter = FastqCounter()
+        checker = GzipChecker(filenames[i], file_counter)
+        pos = offsets[i]
+        try:
+            with open(filenames[i], "rb") as ifh:
+                for chunk in iter(partial(ifh.read, BLOCK_SIZE), b''):
+                    if stop.is_set():
+                        return None
+                    written = 0
+                    while written < len(chunk):
+                        written += os.pwrite(fd, chunk[written:], pos + written)
+                    pos += written
+                    _put(queues[i], chunk)
+                    checker.update(chunk)
+            checker.finish()
+            if pos != offsets[i+1]:
+                raise RuntimeError(f"{filenames[i]} changed size while being copied")
+        finally:
+            _put(queues[i], None)
+        return file_counter
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [ executor.submit(_worker, i) for i in range(len(filenames)) ]
+        try:
+            for i, q in enumerate(queues):
+                for chunk in iter(q.get, None):
+                    md5.update(chunk)
+                file_counter = futures[i].result()
+
+                if counter.at_record_boundary():
+                    counter.add(file_counter)
+                else:
+                    # The last file was broken, so this one has to be counted as a
+                    # continuation of it, which means reading it again.
+                    append_gz(filenames[i], None, None, counter)
+        finally:
+            stop.set()
+
+    out_fh.seek(offsets[-1])
+
+def compressor_key(compressor=None):
+    """The compressor command as saved in the cache. The thread count is left off, as it
+       makes no difference to what pigz outputs.
+    """
+    return " ".join( a for a in (compressor or shlex.split(DEFAULT_COMPRESSOR))
+                     if not re.fullmatch(r"-p\d+", a) )
+
+class FastqCache:
+    """Pre-compressed FASTQ files and their counts, for the FASTQ files in run_dir.
+    """
+    def __init__(self, run_dir, compressor=None):
+        self.run_dir = run_dir
+        self.cache_dir = os.path.join(run_dir, CACHE_SUBDIR)
+        self.compressor = compressor
+        self.compressor_key = compressor_key(compressor)
+
+    def _paths(self, filename):
+        """Get the cached .gz and the .json file for filename, or None if the file is not
+           in the run directory.
+        """
+        rel = os.path.relpath(filename, self.run_dir)
+        if rel.startswith('..'):
+            return None
+        base = os.path.join(self.cache_dir, rel)
+        if filename.endswith('.gz'):
+            return filename, base + '.json'
+        else:
+            return base + '.gz', base + '.json'
+
+    def lookup(self, filename):
+        """Get (gz_file, counter) for the file, or None if there is no entry, or the
+           original has changed since it was cached, or it was compressed with a different
+           command.
+        """
+        paths = self._paths(filename)
+        if not paths:
+            return None
+        gz_file, json_file = paths
+
+        try:
+            with open(json_file) as fh:
+                entry = json.load(fh)
+            st = os.stat(filename)
+            gz_size = os.stat(gz_file).st_size
+        except (FileNotFoundError, NotADirectoryError, ValueError):
+            return None
+
+        if [ st.st_size, st.st_mtime_ns, gz_size ] != \
+           [ entry['size'], entry['mtime_ns'], entry['gz_size'] ]:
+            return None
+
+        # Files which were gzipped already are used as they are
+        if gz_file != filename and entry.get('compressor') != self.compressor_key:
+            return None
+
+        return gz_file, FastqCounter.from_dict(entry['counts'])
+
+    def store(self, filename):
+        """Compress and count a file into the cache, or for a .fastq.gz just count it.
+           Returns False if the file could not be cached, either because it changed
+           while we were reading it or because it does not hold whole FASTQ records, in
+           which case the counts could not simply be added to those for other files.
+        """
+        paths = self._paths(filename)
+        if not paths:
+            return False
+        gz_file, json_file = paths
+        os.makedirs(os.path.dirname(json_file), exist_ok=True)
+        tmp_suffix = f".{os.getpid()}.tmp"
+
+        st = os.stat(filename)
+        counter = FastqCounter()
+        if gz_file == filename:
+            append_gz(filename, None, None, counter)
+        else:
+            with open(gz_file + tmp_suffix, "wb") as out_fh:
+                compress_fastq([filename], out_fh, self.compressor, counter)
+
+        st2 = os.stat(filename)
+        if not ( counter.at_record_boundary() and
+                 (st.st_size, st.st_mtime_ns) == (st2.st_size, st2.st_mtime_ns) ):
+            L.debug(f"Not caching {filename}")
+            if gz_file != filename:
+                os.unlink(gz_file + tmp_suffix)
+            return False
+
+        if gz_file != filename:
+            os.replace(gz_file + tmp_suffix, gz_file)
+        entry = dict( size = st.st_size,
+                      mtime_ns = st.st_mtime_ns,
+                      gz_size = os.stat(gz_file).st_size,
+                      compressor = None if gz_file == filename else self.compressor_key,
+                      counts = counter.as_dict() )
+        with open(json_file + tmp_suffix, "w") as fh:
+            json.dump(entry, fh)
+        os.replace(json_file + tmp_suffix, json_file)
+
+        return True
@@ -0,0 +1,262 @@
+"""Read and base counting for FASTQ data, giving the same results as fq_base_counter.awk
+   but working on whole buffers at a time rather than line-by-line.
+
+   As well as the totals, we collect a read length histogram and a mean quality histogram.
+   These can simply be added together for any number of files, so we can get N50 and
+   quantiles per barcode, cell or project without going back to the reads.
+"""
+import zlib
+from functools import partial
+
+# Decompressed FASTQ is read in blocks this big
+BLOCK_SIZE = 1024 * 1024
+
+class FastqCounter:
+    """Counts reads and bases in a stream of FASTQ data. Feed it the data in any size
+       of chunks with update(), then call finish() at the end.
+
+       Rather than splitting the data into lines, which copies every line, we step through
+       the buffer with bytes.find() and count the Ns in place with bytes.count(), so the
+       scanning is all done in C. With long ONT reads there are few enough lines that the
+       Python loop costs next to nothing.
+    """
+    def __init__(self):
+        self.lines = 0
+        self.total_bases = 0
+        self.non_n_bases = 0
+        self.min_len = 0
+        self.max_len = 0
+
+        # length_bin(length) -> [reads, bases]
+        self.length_hist = dict()
+        # int(mean Phred score) -> reads
+        self.meanq_hist = dict()
+
+        # Any incomplete line left over from the last chunk
+        self._partial = b''
+
+    def update(self, data):
+        """Count all the complete lines in data, saving any partial line for later.
+        """
+        pos = 0
+        if self._partial:
+            nl = data.find(b'\n')
+            if nl == -1:
+                self._partial += data
+                return
+            # Only copy the one line that straddles the chunks, not the whole chunk
+            self._scan(self._partial + data[:nl+1])
+            pos = nl + 1
+
+        pos = self._scan(data, pos)
+        self._partial = data[pos:]
+
+    def finish(self):
+        """Account for a final line with no newline, as awk would.
+        """
+        if self._partial:
+            self._scan(self._partial + b'\n')
+            self._partial = b''
+
+    def _scan(self, buf, pos=0):
+        """Count the complete lines in buf, starting at pos, and return the position
+           after the last one.
+        """
+        find = buf.find
+        count = buf.count
+        mv = memoryview(buf)
+        lines = self.lines
+
+        while True:
+            nl = find(b'\n', pos)
+            if nl == -1:
+                break
+            lines += 1
+            if lines % 4 == 2:
+                self._add_seq(nl - pos, count(b'N', pos, nl))
+            elif lines % 4 == 0:
+                self._add_qual(nl - pos, byte_sum(mv, pos, nl))
+            pos = nl + 1
+
+        self.lines = lines
+        return pos
+
+    def _add_seq(self, seq_len, n_count):
+        self.total_bases += seq_len
+        self.non_n_bases += seq_len - n_count
+        if seq_len > self.max_len:
+            self.max_len = seq_len
+        if self.min_len == 0 or seq_len < self.min_len:
+            self.min_len = seq_len
+
+        lh = self.length_hist.setdefault(length_bin(seq_len), [0, 0])
+        lh[0] += 1
+        lh[1] += seq_len
+
+    def _add_qual(self, qual_len, qual_sum):
+        """Note this is the plain average of the Phred scores, not the score of the
+           average error probability which ONT quote, so it will come out a little higher.
+        """
+        meanq = (qual_sum // qual_len - 33) if qual_len else 0
+        self.meanq_hist[meanq] = self.meanq_hist.get(meanq, 0) + 1
+
+    def at_record_boundary(self):
+        """True if everything seen so far is whole FASTQ records, in which case counts
+           for more data can be added on with add().
+        """
+        return self.lines % 4 == 0 and not self._partial
+
+    def add(self, other):
+        """Add the counts from another FastqCounter, as if the data had been fed to this
+           one. This one must be at a record boundary for this to be right. If the other
+           is not finished, any partial line is carried over.
+        """
+        self.lines += other.lines
+        self.total_bases += other.total_bases
+        self.non_n_bases += other.non_n_bases
+        self.max_len = max(self.max_len, other.max_len)
+        if other.min_len and (self.min_len == 0 or other.min_len < self.min_len):
+            self.min_len = other.min_len
+
+        self.length_hist = merge_hists([self.length_hist, other.length_hist])
+        self.meanq_hist = merge_hists([self.meanq_hist, other.meanq_hist])
+        self._partial = other._partial
+
+    def as_dict(self):
+        """The counts as a dict that can be saved as JSON and loaded with from_dict()
+        """
+        return dict( lines = self.lines,
+                     total_bases = self.total_bases,
+                     non_n_bases = self.non_n_bases,
+                     min_len = self.min_len,
+                     max_len = self.max_len,
+                     length_hist = self.length_hist,
+                     meanq_hist = self.meanq_hist )
+
+    @classmethod
+    def from_dict(cls, d):
+        """Re-make a finished counter from the output of as_dict(). JSON turns the
+           histogram keys into strings, so turn them back.
+        """
+        counter = cls()
+        for k in ['lines', 'total_bases', 'non_n_bases', 'min_len', 'max_len']:
+            setattr(counter, k, d[k])
+        counter.length_hist = { int(k): v for k, v in d['length_hist'].items() }
+        counter.meanq_hist = { int(k): v for k, v in d['meanq_hist'].items() }
+        return counter
+
+    def total_reads(self):
+        """The awk version prints NR/4, which may not be a whole number if the
+           file is broken.
+        """
+        if self.lines % 4:
+            return "{:.6g}".format(self.lines / 4)
+        return str(self.lines // 4)
+
+    def format(self, filename="unknown"):
+        """Returns the text of the .count file
+        """
+        return format_counts( filename,
+                              total_reads = self.total_reads(),
+                              min_len = self.min_len,
+                              max_len = self.max_len,
+                              total_bases = self.total_bases,
+                              non_n_bases = self.non_n_bases,
+                              length_hist = self.length_hist,
+                              meanq_hist = self.meanq_hist )
+
+def count_fastq(fh, block_size=BLOCK_SIZE):
+    """Count everything in a binary file handle. Returns a finished FastqCounter.
+    """
+    counter = FastqCounter()
+    for chunk in iter(partial(fh.read, block_size), b''):
+        counter.update(chunk)
+    counter.finish()
+
+    return counter
+
+def byte_sum(buf, start, end, adler32=zlib.adler32):
+    """Add up the byte values in buf[start:end], which must be a memoryview.
+       sum() would have to make a Python int for every byte, but the first half of an
+       Adler-32 checksum is the sum of the bytes modulo 65521, and for up to 520 quality
+       characters (max '~' == 126) the sum cannot reach 65521, so this gets the exact
+       answer much faster.
+    """
+    total = 0
+    for s in range(start, end, 520):
+        total += adler32(buf[s:min(s + 520, end)], 0) & 0xffff
+    return total
+
+def length_bin(n):
+    """Log-scaled bins for the read lengths, with 8 bins per doubling of the length,
+       so each bin is no more than 1/8 the width of the values in it. Lengths up to 15
+       get a bin of their own.
+    """
+    e = max(n.bit_length() - 4, 0)
+    return (n >> e) << e
+
+def format_hist(hist):
+    """Histograms are written as a YAML flow mapping, on one line, in order.
+    """
+    return "{" + ", ".join(f"{k}: {v}" for k, v in sorted(hist.items())) + "}"
+
+def format_counts( filename, total_reads, min_len, max_len, total_bases, non_n_bases,
+                   length_hist=None, meanq_hist=None ):
+    """Returns the text of a .count file. This is YAML, but we format it directly to
+       be sure we get the same thing as fq_base_counter.awk did. The histograms are
+       left off if they are None.
+    """
+    lines = [ f"filename:    {filename}",
+              f"total_reads: {total_reads}",
+              f"read_length: {min_len}-{max_len}",
+              f"total_bases: {total_bases}",
+              f"non_n_bases: {non_n_bases}" ]
+    if length_hist is not None:
+        lines.append(f"length_hist: {format_hist(length_hist)}")
+    if meanq_hist is not None:
+        lines.append(f"meanq_hist: {format_hist(meanq_hist)}")
+
+    return "\n".join(lines) + "\n"
+
+def merge_hists(hists):
+    """Add up a list of histograms, of either type.
+    """
+    res = dict()
+    for h in hists:
+        for k, v in h.items():
+            if isinstance(v, list):
+                res[k] = [ a + b for a, b in zip(res.get(k, [0] * len(v)), v) ]
+            else:
+                res[k] = res.get(k, 0) + v
+
+    return dict(sorted(res.items()))
+
+def hist_n50(length_hist):
+    """Estimate the N50 from a length histogram. We can't get the exact answer, so
+       give the mean length of the reads in the bin where the N50 falls.
+    """
+    half_bases = sum(v[1] for v in length_hist.values()) / 2
+    cum_bases = 0
+    for k, (reads, bases) in sorted(length_hist.items(), reverse=True):
+        cum_bases += bases
+        if reads and cum_bases >= half_bases:
+            return round(bases / reads)
+
+    return 0
+
+def hist_quantile(hist, q):
+    """Estimate the q-th quantile (0 to 1) of the reads in a histogram. For a
+       length histogram the answer is the mean length within the relevant bin. For a
+       mean-Q histogram it's just the Q score.
+    """
+    def _reads(v):
+        return v[0] if isinstance(v, list) else v
+
+    target = sum(_reads(v) for v in hist.values()) * q
+    cum_reads = 0
+    for k, v in sorted(hist.items()):
+        cum_reads += _reads(v)
+        if _reads(v) and cum_reads >= target:
+            return round(v[1] / v[0]) if isinstance(v, list) else k
+
+    return 0
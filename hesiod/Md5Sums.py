@@ -0,0 +1,98 @@
+"""MD5 sums for lots of files at once, as needed by Snakefile.checksummer, giving the same
+   output as md5sum.
+
+   The files are read in big blocks, and several are hashed at once on separate threads.
+   hashlib releases the GIL while it works on a big buffer, as does reading the file, so
+   this scales well with threads, and the speed is limited by the filesystem rather than
+   by having one md5sum process per batch.
+
+   So that we don't hash everything again when the checksummer is re-run on a directory,
+   a manifest can be saved alongside the md5sums.txt, which has the size, mtime and inode
+   of each file along with the MD5. If none of these have changed on the next run, the
+   MD5 is taken from the manifest.
+"""
+import os
+import json
+import hashlib
+import logging as L
+from concurrent.futures import ThreadPoolExecutor
+
+from . import md5sum_line
+
+# Read files in blocks this big
+HASH_BLOCK_SIZE = 16 * 1024 * 1024
+
+def md5_file(filename, block_size=HASH_BLOCK_SIZE):
+    """Get the MD5 hex digest of one file.
+    """
+    md5 = hashlib.md5()
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    with open(filename, 'rb', buffering=0) as fh:
+        for n in iter(lambda: fh.readinto(buf), 0):
+            md5.update(view[:n])
+    return md5.hexdigest()
+
+def md5sum_files(filenames, base_dir='.', jobs=1, manifest=None):
+    """Get the md5sum lines for the files, which are relative to base_dir, hashing up
+       to jobs files at once. The lines are in the same order as the files.
+       If a manifest dict is supplied, an entry is added for each file.
+    """
+    def _md5sum(f):
+        path = os.path.join(base_dir, f)
+        # Stat before hashing, so if the file changes while we read it the next run
+        # will see that it has changed.
+        sig = stat_signature(os.stat(path))
+        md5 = md5_file(path)
+        if manifest is not None:
+            manifest[f] = [*sig, md5]
+        return md5sum_line(md5, f)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(_md5sum, filenames))
+
+def md5_line_key(line):
+    """Sort key for md5sum lines, being the file name part as it appears in the line.
+    """
+    return line.partition('  ')[2]
+
+def stat_signature(st):
+    """The parts of a stat result which tell us if a file has changed since we last
+       hashed it, as a list so it looks the same after a round trip through JSON.
+    """
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+def reuse_md5sums(files, manifest):
+    """Split the files, a list of (name, stat signature) pairs, into those which need
+       to be hashed and those whose MD5 can be taken from the old manifest. Returns the
+       list of (name, stat signature) to hash and a manifest of the rest.
+    """
+    to_hash = []
+    reused = dict()
+    for name, sig in files:
+        entry = manifest.get(name)
+        if sig and entry and entry[:-1] == sig:
+            reused[name] = entry
+        else:
+            to_hash.append((name, sig))
+    return to_hash, reused
+
+def load_manifest(filename):
+    """Load a manifest saved by save_manifest(). If there is no manifest, or it can't
+       be read, we just get an empty one and everything will be hashed.
+    """
+    try:
+        with open(filename) as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return dict()
+    except (OSError, ValueError) as e:
+        L.warning(f"Ignoring unreadable manifest {filename}: {e}")
+        return dict()
+
+def save_manifest(manifest, filename):
+    """Save the manifest, which is a dict of {name: [size, mtime_ns, inode, md5]}.
+    """
+    with open(filename + ".part", "w") as fh:
+        json.dump(manifest, fh, sort_keys=True)
+    os.replace(filename + ".part", filename)
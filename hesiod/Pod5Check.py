@@ -0,0 +1,275 @@
+"""Check that a pod5 file is structurally sound, without needing the pod5 library.
+
+   We used to run 'pod5 view -I -o /dev/null' on every file to check it, but that starts
+   a new Python process per file and decodes the metadata of every read, when all we want
+   to know is that the copy is complete and not corrupted. Here we look only at the parts
+   of the file that describe the layout:
+
+     1) The signature and section marker at each end of the file, and the pod5 footer.
+     2) The table of embedded files in the pod5 footer. Each must lie within the file,
+        with a section marker before and after it.
+     3) Each embedded file, which is an Arrow IPC file. It must start and end with the
+        Arrow magic, and the Arrow footer must list record batches which lie within it.
+     4) Optionally, a few of the record batches. The message header of each must agree
+        with the Arrow footer, and the buffers must lie within the batch.
+
+   This means reading a few KB from each file, at most, so it is cheap enough to run on
+   every copy. The footers are FlatBuffers, and we only need a few fields, so there is a
+   minimal reader here rather than a dependency on pyarrow or flatbuffers.
+   See https://github.com/nanoporetech/pod5-file-format/blob/master/docs/SPECIFICATION.md
+   and https://arrow.apache.org/docs/format/Columnar.html#ipc-file-format
+"""
+import os
+import struct
+
+POD5_SIGNATURE = b"\x8bPOD\r\n\x1a\n"
+POD5_FOOTER_MAGIC = b"FOOTER\x00\x00"
+ARROW_MAGIC = b"ARROW1"
+
+# Read this much of the end of the file for the checks. The footer is normally a few
+# hundred bytes.
+POD5_TAIL_SIZE = 1024 * 1024
+
+# The ContentType enum in the pod5 footer
+POD5_CONTENT_TYPES = ["ReadsTable", "SignalTable", "ReadIdIndex", "OtherIndex", "RunInfoTable"]
+# Every pod5 file has these, whatever the version
+POD5_REQUIRED_TABLES = ["ReadsTable", "SignalTable"]
+
+# The MessageHeader union type for a RecordBatch in an Arrow message
+ARROW_RECORD_BATCH = 3
+
+def check_pod5_ends(head, tail, size):
+    """Check the start and end of a pod5 file, given the first 24 bytes, the last
+       bytes (at least 40) and the size of the file. Raises a RuntimeError if anything
+       is wrong, or else returns the footer.
+    """
+    if size < 24 + 8 + 32 or len(tail) < 8 + 32:
+        raise RuntimeError(f"file of {size} bytes is too short to be pod5")
+    if head[:8] != POD5_SIGNATURE:
+        raise RuntimeError("missing the pod5 signature at the start")
+    if tail[-8:] != POD5_SIGNATURE:
+        raise RuntimeError("missing the pod5 signature at the end - truncated?")
+
+    # The same section marker comes after the first signature and before the last
+    marker = head[8:24]
+    if tail[-24:-8] != marker:
+        raise RuntimeError("the section markers at the start and end do not match")
+
+    footer_len, = struct.unpack("<q", tail[-32:-24])
+    footer_start = len(tail) - 32 - footer_len
+    # The footer magic must fit between the start of the file and the footer, and
+    # within the tail we were given.
+    if not ( 0 < footer_len and footer_start >= 8 and
+             size - 32 - footer_len >= 24 + 8 ):
+        raise RuntimeError(f"bad pod5 footer length {footer_len}")
+    if tail[footer_start-8:footer_start] != POD5_FOOTER_MAGIC:
+        raise RuntimeError("missing the pod5 footer")
+
+    return tail[footer_start:-32]
+
+class FlatTable:
+    """Just enough of a FlatBuffers reader to get fields out of a table, by the index of
+       the field in the schema. Anything out of bounds raises a struct.error.
+    """
+    def __init__(self, buf, pos=None):
+        self.buf = buf
+        if pos is None:
+            # The root table
+            pos, = self._unpack("I", 0)
+        self.pos = pos
+        self.vtable = pos - self._unpack("i", pos)[0]
+        self.vtable_len, = self._unpack("H", self.vtable)
+
+    def _unpack(self, fmt, pos):
+        # unpack_from would count a negative offset from the end
+        if pos < 0:
+            raise struct.error(f"offset {pos} is out of bounds")
+        return struct.unpack_from("<" + fmt, self.buf, pos)
+
+    def _field_pos(self, idx):
+        """Position of the field in the buffer, or None if it is not set.
+        """
+        voffset = 4 + 2 * idx
+        if voffset >= self.vtable_len:
+            return None
+        offset, = self._unpack("H", self.vtable + voffset)
+        return self.pos + offset if offset else None
+
+    def scalar(self, idx, fmt, default=0):
+        pos = self._field_pos(idx)
+        return default if pos is None else self._unpack(fmt, pos)[0]
+
+    def table(self, idx):
+        pos = self._field_pos(idx)
+        return None if pos is None else FlatTable(self.buf, pos + self._unpack("I", pos)[0])
+
+    def _vector(self, idx, elem_size):
+        """Position of the first element and the length of a vector field.
+        """
+        pos = self._field_pos(idx)
+        if pos is None:
+            return pos, 0
+        pos += self._unpack("I", pos)[0]
+        n, = self._unpack("I", pos)
+        if pos + 4 + n * elem_size > len(self.buf):
+            raise struct.error(f"vector of {n} items overruns the buffer")
+        return pos + 4, n
+
+    def string(self, idx):
+        pos, n = self._vector(idx, 1)
+        return None if pos is None else bytes(self.buf[pos:pos+n]).decode(errors='replace')
+
+    def tables(self, idx):
+        pos, n = self._vector(idx, 4)
+        return [ FlatTable(self.buf, p + self._unpack("I", p)[0])
+                 for p in range(pos or 0, (pos or 0) + n * 4, 4) ]
+
+    def structs(self, idx, fmt):
+        size = struct.calcsize("<" + fmt)
+        pos, n = self._vector(idx, size)
+        return [ self._unpack(fmt, p) for p in range(pos or 0, (pos or 0) + n * size, size) ]
+
+def _pread(fh, length, offset):
+    """Read exactly length bytes at offset, or raise a RuntimeError.
+    """
+    data = os.pread(fh.fileno(), length, offset)
+    if len(data) != length:
+        raise RuntimeError(f"short read of {len(data)} bytes at {offset} - truncated?")
+    return data
+
+def _sample(items, n):
+    """Pick n items spread evenly through the list, always including the first and last.
+    """
+    if n >= len(items):
+        return list(items)
+    if n == 1:
+        return items[:1]
+    return [ items[round(i * (len(items) - 1) / (n - 1))] for i in range(n) ]
+
+def check_arrow_file(fh, offset, length, sample_batches=0):
+    """Check an Arrow IPC file embedded in fh at offset. Returns the number of record
+       batches, or raises a RuntimeError.
+    """
+    if length < 8 + 10:
+        raise RuntimeError(f"embedded file of {length} bytes is too short for Arrow")
+    if _pread(fh, 8, offset)[:6] != ARROW_MAGIC:
+        raise RuntimeError(f"missing the Arrow magic at the start of the table at {offset}")
+
+    # The file ends with the Arrow footer, its length, and the magic again
+    tail = _pread(fh, 10, offset + length - 10)
+    if tail[4:] != ARROW_MAGIC:
+        raise RuntimeError(f"missing the Arrow magic at the end of the table at {offset}")
+    footer_len, = struct.unpack("<i", tail[:4])
+    footer_start = length - 10 - footer_len
+    if not ( 0 < footer_len and footer_start >= 8 ):
+        raise RuntimeError(f"bad Arrow footer length {footer_len} in the table at {offset}")
+
+    try:
+        footer = FlatTable(_pread(fh, footer_len, offset + footer_start))
+        if footer.table(1) is None:
+            raise RuntimeError(f"no schema in the Arrow footer of the table at {offset}")
+        # Block is a struct of offset, metadata length, (padding), body length
+        dictionaries = footer.structs(2, "qi4xq")
+        batches = footer.structs(3, "qi4xq")
+    except struct.error as e:
+        raise RuntimeError(f"corrupt Arrow footer in the table at {offset}: {e}")
+
+    for b_offset, meta_len, body_len in dictionaries + batches:
+        if not ( b_offset >= 8 and meta_len >= 8 and body_len >= 0 and
+                 b_offset + meta_len + body_len <= footer_start ):
+            raise RuntimeError( f"Arrow block at {b_offset} does not fit in the table at"
+                                f" {offset}" )
+
+    for b_offset, meta_len, body_len in _sample(batches, sample_batches):
+        check_record_batch(fh, offset + b_offset, meta_len, body_len)
+
+    return len(batches)
+
+def check_record_batch(fh, offset, meta_len, body_len):
+    """Check the message header of an Arrow record batch against the block in the Arrow
+       footer which points to it.
+    """
+    meta = _pread(fh, meta_len, offset)
+    # An encapsulated message starts with 0xFFFFFFFF and then the length of the header
+    continuation, size = struct.unpack_from("<Ii", meta)
+    if continuation != 0xFFFFFFFF or not ( 0 < size <= meta_len - 8 ):
+        raise RuntimeError(f"bad Arrow message header for the record batch at {offset}")
+
+    try:
+        message = FlatTable(meta[8:8+size])
+        header_type = message.scalar(1, "B")
+        msg_body_len = message.scalar(3, "q")
+        batch = message.table(2)
+        buffers = batch.structs(2, "qq") if batch else []
+    except struct.error as e:
+        raise RuntimeError(f"corrupt Arrow message for the record batch at {offset}: {e}")
+
+    if header_type != ARROW_RECORD_BATCH or batch is None:
+        raise RuntimeError(f"the message at {offset} is not a record batch")
+    if msg_body_len != body_len:
+        raise RuntimeError( f"record batch at {offset} has a body of {msg_body_len} bytes"
+                            f" but the Arrow footer says {body_len}" )
+    for b_offset, b_len in buffers:
+        if not ( b_offset >= 0 and b_len >= 0 and b_offset + b_len <= body_len ):
+            raise RuntimeError(f"a buffer in the record batch at {offset} overruns the body")
+
+def check_pod5_tables(fh, size, marker, footer, sample_batches=0):
+    """Check the embedded tables of a pod5 file, given the open file, its size, the
+       section marker and the pod5 footer (as returned by check_pod5_ends). Returns
+       a summary of what was found, or raises a RuntimeError.
+    """
+    try:
+        footer_t = FlatTable(footer)
+        res = dict( file_identifier = footer_t.string(0),
+                    software = footer_t.string(1),
+                    pod5_version = footer_t.string(2) )
+        # EmbeddedFile is a table of offset, length, format, content_type
+        contents = [ (t.scalar(0, "q"), t.scalar(1, "q"), t.scalar(3, "h"))
+                     for t in footer_t.tables(3) ]
+    except struct.error as e:
+        raise RuntimeError(f"corrupt pod5 footer: {e}")
+
+    # The footer, with its marker before and magic after, is at the end of the file
+    footer_magic_start = size - 32 - len(footer) - 8
+    res['tables'] = []
+    for offset, length, content_type in contents:
+        ct_name = ( POD5_CONTENT_TYPES[content_type]
+                    if 0 <= content_type < len(POD5_CONTENT_TYPES)
+                    else f"ContentType{content_type}" )
+        # Each file has a marker before and, after padding to 8 bytes, a marker after
+        end_marker = offset + length + (-length % 8)
+        if not ( offset >= 24 and length > 0 and end_marker + 16 <= footer_magic_start ):
+            raise RuntimeError(f"{ct_name} at {offset} does not fit in the file")
+        if ( _pread(fh, 16, offset - 16) != marker or
+             _pread(fh, 16, end_marker) != marker ):
+            raise RuntimeError(f"missing the section marker around the {ct_name} at {offset}")
+
+        batches = check_arrow_file(fh, offset, length, sample_batches)
+        res['tables'].append(dict( content_type = ct_name,
+                                   offset = offset,
+                                   length = length,
+                                   record_batches = batches ))
+
+    for ct_name in POD5_REQUIRED_TABLES:
+        if ct_name not in [ t['content_type'] for t in res['tables'] ]:
+            raise RuntimeError(f"no {ct_name} in the pod5 file")
+
+    return res
+
+def check_pod5(filename, sample_batches=0):
+    """Check the structure of a pod5 file, and up to sample_batches record batches from
+       each table. Returns a summary of what was found. On error, a RuntimeError is raised
+       naming the file.
+    """
+    try:
+        with open(filename, 'rb') as fh:
+            size = os.fstat(fh.fileno()).st_size
+            head = os.pread(fh.fileno(), 24, 0)
+            tail_size = min(size, POD5_TAIL_SIZE)
+            tail = os.pread(fh.fileno(), tail_size, size - tail_size)
+
+            footer = check_pod5_ends(head, tail, size)
+            return check_pod5_tables(fh, size, head[8:24], footer, sample_batches)
+
+    except (RuntimeError, OSError) as e:
+        raise RuntimeError(f"Bad pod5 file {filename}: {e}") from e
@@ -0,0 +1,104 @@
+"""Copy a pod5 file, making the MD5 sum and checking the file structure as we go, so the
+   data is read just once. This replaces 'cp' then 'md5sum' then 'pod5 view -I', which
+   read every file three times, and these files are big.
+
+   The buffer is allocated with mmap, so it is page-aligned, and read into directly with
+   readinto(), so the data is not copied around in Python. The source file is never read
+   again, so we tell the kernel to drop it from the page cache as we go, and the same for
+   the copy once it is written out, rather than pushing everything else out of the cache.
+
+   The signature and section marker at each end of the file and the footer are checked
+   on the data as it passes, since these are what go missing if a file is truncated or
+   was still being written. Then the embedded tables are checked by reading their
+   footers back from the copy, which is a few KB per file. See hesiod/Pod5Check.py.
+"""
+import os
+import mmap
+import hashlib
+import threading
+import logging as L
+
+from hesiod.Pod5Check import check_pod5_ends, check_pod5_tables, POD5_TAIL_SIZE
+
+# Copy in blocks this big. Must be a multiple of the page size.
+COPY_BLOCK_SIZE = 16 * 1024 * 1024
+
+def _drop_cache(fd, offset, length):
+    """Tell the kernel we won't need these pages again. For a file being written this
+       starts the write-back, and the pages are dropped once they are clean.
+    """
+    try:
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+    except (AttributeError, OSError):
+        # Not all systems or filesystems support this, and it's only advice
+        pass
+
+def copy_pod5( src, dest, block_size=COPY_BLOCK_SIZE, drop_cache=True,
+               check_tables=True, sample_batches=0 ):
+    """Copy src to dest, checking the pod5 structure. Returns the MD5 hex digest.
+       The copy is made under a temporary name and renamed once it checks out, so dest
+       never holds a partial file, even if two jobs copy the same file at once.
+       With check_tables=False only the ends of the file are checked. sample_batches is
+       passed on to check_pod5_tables().
+       On error, a RuntimeError is raised naming the file.
+    """
+    tmp_dest = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+    md5 = hashlib.md5()
+    buf = mmap.mmap(-1, block_size)
+    view = memoryview(buf)
+    head = b''
+    tail = b''
+    pos = 0
+
+    try:
+        with open(src, 'rb', buffering=0) as ifh, open(tmp_dest, 'wb', buffering=0) as ofh:
+            in_fd, out_fd = ifh.fileno(), ofh.fileno()
+            if drop_cache:
+                try:
+                    os.posix_fadvise(in_fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                except (AttributeError, OSError):
+                    pass
+
+            while True:
+                n = ifh.readinto(buf)
+                if not n:
+                    break
+                chunk = view[:n]
+                md5.update(chunk)
+
+                written = 0
+                while written < n:
+                    written += ofh.write(chunk[written:])
+
+                if len(head) < 24:
+                    head += bytes(chunk[:24 - len(head)])
+                tail = (tail + bytes(chunk[-POD5_TAIL_SIZE:]))[-POD5_TAIL_SIZE:]
+
+                if drop_cache:
+                    _drop_cache(in_fd, pos, n)
+                    _drop_cache(out_fd, pos, n)
+                pos += n
+                del chunk
+
+            if drop_cache:
+                # Catch anything that was still dirty the first time
+                _drop_cache(out_fd, 0, 0)
+
+        footer = check_pod5_ends(head, tail, pos)
+        if check_tables:
+            with open(tmp_dest, 'rb') as cfh:
+                check_pod5_tables(cfh, pos, head[8:24], footer, sample_batches)
+        os.replace(tmp_dest, dest)
+
+    except (RuntimeError, OSError) as e:
+        try:
+            os.unlink(tmp_dest)
+        except FileNotFoundError:
+            pass
+        raise RuntimeError(f"Failed to copy {src}: {e}") from e
+    finally:
+        view.release()
+        buf.close()
+
+    L.debug(f"Copied {pos} bytes from {src} to {dest}")
+    return md5.hexdigest()
@@ -0,0 +1,112 @@
+"""A persistent index of runs that are in a terminal state (complete, aborted, stripped),
+   so that run_status.py does not have to re-examine years of finished runs on every
+   cycle of the driver.
+
+   An entry is only re-used if the mtimes of the run directory, the pipeline directory
+   and each library directory are unchanged, and if the upstream info for the experiment
+   matches what was seen when the entry was made. Adding or removing any touch file
+   changes the mtime of the pipeline directory, so this catches all the state changes
+   RunStatus cares about.
+"""
+import os
+import json
+import logging as L
+
+from .DirIndex import RACY_SECONDS
+
+# Statuses which are not expected to change unless something is done to the run
+TERMINAL_STATES = ['complete', 'aborted', 'stripped']
+
+def stat_stamps(run_dir, libraries=()):
+    """Get the mtime_ns of the run directory, the pipeline directory and each of the
+       library directories, or None if any of them is missing.
+    """
+    stamps = dict()
+    for d in ['.', 'pipeline', *sorted(libraries)]:
+        try:
+            stamps[d] = os.stat(os.path.join(run_dir, d)).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+    return stamps
+
+class RunIndex:
+    """Index of finished runs, keyed by run directory, loaded from and saved to a JSON file.
+       Each entry is { "stamps": {dir: mtime_ns}, "listed_at": float,
+                       "upstream": [loc, [cells]] or None, "yaml": str }
+    """
+    def __init__(self, index_file=None, rebuild=False):
+        self.index_file = index_file
+        self.index = dict()
+
+        # What we saw in this run, which is what we'll save
+        self.visited = dict()
+        self.hits = 0
+        self.misses = 0
+
+        if index_file and not rebuild:
+            try:
+                with open(index_file) as fh:
+                    self.index = json.load(fh)
+            except FileNotFoundError:
+                L.debug(f"No index at {index_file}. Starting afresh.")
+            except ValueError:
+                L.warning(f"Ignoring corrupt index {index_file}")
+
+    @staticmethod
+    def _upstream_key(upstream_info):
+        """Reduce the upstream info for one experiment to something we can save as JSON
+           and compare.
+        """
+        if not upstream_info:
+            return None
+        return [ upstream_info.get('loc'), sorted(upstream_info.get('cells', ())) ]
+
+    def lookup(self, run_dir, upstream_info=None):
+        """Get the saved status YAML for the run, or None if the run needs to be examined.
+        """
+        entry = self.index.get(run_dir)
+        if not entry:
+            self.misses += 1
+            return None
+
+        stamps = stat_stamps(run_dir, [ d for d in entry['stamps'] if d not in ['.', 'pipeline'] ])
+        if ( stamps != entry['stamps'] or
+             self._upstream_key(upstream_info) != entry['upstream'] or
+             (entry['listed_at'] - max(stamps.values()) / 1e9) <= RACY_SECONDS ):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.visited[run_dir] = entry
+        return entry['yaml']
+
+    def add(self, run_dir, status, yaml, listed_at, libraries=(), upstream_info=None):
+        """Record the status YAML for a run, if the run is in a terminal state.
+           listed_at must be the time.time() from before the run was examined.
+        """
+        if status not in TERMINAL_STATES:
+            return
+
+        stamps = stat_stamps(run_dir, libraries)
+        if stamps is None:
+            return
+
+        self.visited[run_dir] = dict( stamps = stamps,
+                                      listed_at = listed_at,
+                                      upstream = self._upstream_key(upstream_info),
+                                      yaml = yaml )
+
+    def save(self):
+        """Save the entries used in this run, atomically replacing the old index.
+           Several copies of the driver may be doing this at once, so the temp
+           file name must be unique.
+        """
+        if not self.index_file:
+            return
+
+        L.debug(f"Run index: {self.hits} runs re-used, {self.misses} examined")
+
+        tmp_file = f"{self.index_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as fh:
+            json.dump(self.visited, fh)
+        os.replace(tmp_file, self.index_file)
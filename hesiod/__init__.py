@@ -256,6 +256,17 @@ def slurp_file(filename):
     with open(filename) as fh:
         return [ l.rstrip("\n") for l in fh ]
 
+def md5sum_line(hexdigest, filename):
+    """Format a line exactly as 'md5sum -- filename' would print it, so that files
+       we checksum in Python are indistinguishable from those done with md5sum.
+       md5sum escapes backslashes and newlines and flags this with a leading '\'.
+    """
+    if '\\' in filename or '\n' in filename:
+        filename = filename.replace('\\', '\\\\').replace('\n', '\\n')
+        return f"\\{hexdigest}  {filename}\n"
+
+    return f"{hexdigest}  {filename}\n"
+
 def get_common_prefix(list_of_filenames, extn=r"\..+", base_only=True):
     """Used by the Snakefiles. Chop extn (which is a regex) off every file
        in the list and see if that leaves a common prefix. If so, return it.
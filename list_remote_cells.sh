@@ -14,7 +14,17 @@ set -euo pipefail
 # Try:
 # $ env UPSTREAM_LOC=prom@promethion:/data UPSTREAM_NAME=EGS1 ./list_remote_cells.sh
 
+# If UPSTREAM_CACHE is set to a directory, the last listing is saved there and on most
+# calls we only look in the library directories modified since the last call, or with a
+# cell directory modified since then (as when other_reports appears), then patch up the
+# saved listing. A full listing is made every UPSTREAM_FULL_LISTING seconds
+# to catch anything that was missed or deleted. If the upstream location can't be reached
+# the saved listing is printed and the exit status is 3, to flag that it may be stale.
+# Without a saved listing, the exit status is non-zero if the upstream location can't be
+# reached, but zero if it simply has no cells in it.
+
 pattern='*/*/20??????_*_????????/other_reports'
+cells_pattern='20??????_*_????????/other_reports'
 
 # Prevent glob expansion in local shell
 set -o noglob
@@ -25,14 +35,81 @@ if [[ -z "$UPSTREAM_LOC" ]] ; then
 elif [[ "$UPSTREAM_LOC" =~ : ]] ; then
     # This works as long as there are no rogue spaces. Note the fairly short
     # connection timeout - if the network is down we want to fail fast.
-    ls_cmd="ssh -o ConnectTimeout=5 -T ${UPSTREAM_LOC%%:*} cd ${UPSTREAM_LOC#*:} && ls -df $pattern"
+    # If the driver has set up SSH_POOL_OPTS the connection will be shared.
+    run_cmd="ssh ${SSH_POOL_OPTS:-} -o ConnectTimeout=5 -T ${UPSTREAM_LOC%%:*} cd ${UPSTREAM_LOC#*:} &&"
 else
-    ls_cmd="eval cd ${UPSTREAM_LOC} && set +o noglob && ls -df $pattern"
+    run_cmd="eval cd ${UPSTREAM_LOC} && set +o noglob &&"
 fi
+# ls fails if nothing matches the pattern, which is not an error, but if ssh or cd fails
+# the whole command must fail.
+ls_cmd="$run_cmd { ls -df $pattern || true ; }"
 
 # UPSTREAM_NAME must be set
 instrument="$UPSTREAM_NAME"
 
+# Get the raw listing as a list of experiment/library/cell
+full_listing(){
+    $ls_cmd | sed 's,/[^/]*$,,' | env LC_ALL=C sort -u -t/ -k1,1 -k3
+}
+
+# Find the library directories modified since $1 (seconds since the epoch), or with a cell
+# directory modified since then, and list the cells in each. Adding other_reports to a cell
+# does not change the mtime of the library directory, so we have to look at both levels.
+# The libraries are printed with a trailing / so we can tell them apart.
+changed_listing(){
+    $run_cmd find . -mindepth 2 -maxdepth 3 -type d -newermt @"$1" \
+        -exec sh -c "'for d ; do case \"\$d\" in ./*/*/*) d=\"\${d%/*}\" ;; esac ; echo \"\$d\" ; done |
+                      sort -u | while IFS= read -r d ; do
+                        echo \"\$d/\" ; ls -df \"\$d\"/$cells_pattern 2>/dev/null ; done ; true'" \
+        sh '{}' + \
+        | sed 's,^\./,,; s,/[^/]*$,,'
+}
+
+if [[ -z "${UPSTREAM_CACHE:-}" ]] ; then
+    rc=0
+    listing="$(full_listing)" || rc=$?
+else
+    snapshot="$UPSTREAM_CACHE/${instrument}.snapshot"
+    stamp="$UPSTREAM_CACHE/${instrument}.stamp"
+    full_every="${UPSTREAM_FULL_LISTING:-3600}"
+    # Allow for clock skew between here and upstream, and for other_reports appearing
+    # some time after the cell directory.
+    slack="${UPSTREAM_SLACK:-900}"
+
+    last_poll=0 last_full=0
+    if [[ -e "$snapshot" ]] && [[ -e "$stamp" ]] ; then
+        read last_poll last_full <"$stamp" || true
+    fi
+    now="$(date +%s)"
+
+    rc=0
+    if (( now - last_full >= full_every )) ; then
+        listing="$(full_listing)" || rc=$?
+        last_full="$now"
+    else
+        # Cells from libraries that changed replace those in the snapshot
+        listing="$(changed_listing $(( last_poll - slack )) )" || rc=$?
+        listing="$(awk -F/ 'NR==FNR { if (NF == 2) changed[$0] = 1 ; else if (NF) print ; next }
+                            !(($1 "/" $2) in changed) { print }' \
+                       - "$snapshot" <<<"$listing" | env LC_ALL=C sort -u -t/ -k1,1 -k3)"
+    fi
+
+    if [[ "$rc" != 0 ]] ; then
+        if [[ -e "$snapshot" ]] && [[ -e "$stamp" ]] ; then
+            echo "Cannot reach $UPSTREAM_LOC. Using the listing from $(date -d @"$last_poll")" >&2
+            listing="$(cat "$snapshot")"
+            rc=3
+        else
+            listing=""
+        fi
+    else
+        printf "%s\n" "$listing" | awk 'NF' >"$snapshot.tmp"
+        mv "$snapshot.tmp" "$snapshot"
+        echo "$now $last_full" >"$stamp"
+        rc=0
+    fi
+fi
+
 # Chop the last dir name and condense all the results.
 # Then plonk the date from the first flowcell onto the experiment name.
 last_dir=''
@@ -63,5 +140,9 @@ while read l ; do
     fi
     echo "$last_munged"$'\t'"$UPSTREAM_LOC/$this_dir"$'\t'"$cell"
 
-done < <($ls_cmd | sed 's,/[^/]*$,,' | env LC_ALL=C sort -u -t/ -k1,1 -k3 )
+done < <(awk 'NF' <<<"$listing")
 
+if [[ "$rc" != 0 ]] && [[ "$rc" != 3 ]] ; then
+    echo "Failed to list the cells in $UPSTREAM_LOC" >&2
+fi
+exit ${rc:-0}
@@ -0,0 +1,28 @@
+#!/bin/bash
+set -euo pipefail
+
+# For trickle syncing (see SYNC_TRICKLE_CMD in environ.sh.sample) we want to copy
+# the files in a cell that MinKNOW has finished writing, while the cell is still running.
+# usage: list_settled_files.sh <upstream> <cell> <age>
+
+# This lists the files in <upstream>/<cell> that have not been modified for <age> seconds,
+# relative to <upstream> as needed for "rsync --files-from". The final_summary file is
+# never listed, since its arrival is what tells the driver the cell is ready to process.
+
+# If the cell has finished, ie. the final_summary file is there, nothing is printed and the
+# exit status is 3, meaning the whole cell should be synced in the usual way.
+
+upstream="$1"
+cell="$2"
+age="${3:-300}"
+
+list_cmd="cd $(printf %q "${upstream#*:}") && \
+if ls -d $(printf %q "$cell")/final_summary*.txt >/dev/null 2>&1 ; then exit 3 ; fi && \
+find $(printf %q "$cell") -type f ! -name 'final_summary*' ! -newermt '$age seconds ago'"
+
+if [[ "$upstream" =~ : ]] ; then
+    # If the driver has set up SSH_POOL_OPTS the connection will be shared.
+    exec ssh ${SSH_POOL_OPTS:-} -o ConnectTimeout=5 -T "${upstream%%:*}" "$list_cmd"
+else
+    exec bash -c "$list_cmd"
+fi
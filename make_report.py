@@ -10,6 +10,7 @@ from contextlib import suppress
 import shutil
 
 from hesiod import hesiod_version, glob, load_yaml, abspath, groupby, od_key_replace
+from hesiod.FastqCounter import merge_hists, hist_n50, hist_quantile
 
 def get_cell_metadata(ci):
     """Takes a cellinfo dict and returns an OrderedDict for display in the
@@ -85,8 +86,21 @@ def format_counts_per_cells(cells, heading="Read summary"):
              for row, label in enumerate(labels)
              for cat_counts in [{ k: [ c[row][k] for c in all_counts ]
                                   for k in ['total_reads', 'total_bases', 'max_length'] }] ]
+    headings = ["Part", "Total Reads", "Total Bases", "Max Length"]
 
-    return( format_table( ["Part", "Total Reads", "Total Bases", "Max Length"],
+    # If all the .count files had histograms we can add them up to get some more stats.
+    if all( '_length_hist' in f and '_meanq_hist' in f for c in all_counts for f in c ):
+        headings.extend(["N50", "Median Length", "Median Mean Q"])
+
+        for row, label in enumerate(labels):
+            length_hist = merge_hists( c[row]['_length_hist'] for c in all_counts )
+            meanq_hist = merge_hists( c[row]['_meanq_hist'] for c in all_counts )
+
+            rows[row] += ( hist_n50(length_hist),
+                           hist_quantile(length_hist, 0.5),
+                           hist_quantile(meanq_hist, 0.5) )
+
+    return( format_table( headings,
                           rows,
                           title = heading ) )
 
@@ -153,7 +167,15 @@ def get_cell_summary( all_info ):
         # Actually this doesn't seem to correspond to any of the numbers in the NanoPlot summary
         row["Passed Bases (Gb)"] = _round( sum( c['non_n_bases'] for c in ci['_counts']
                                                if c['_part'] == 'pass' ) / 1e9 )
-        row["Estimated N50 (kb)"] = _round(gs["Read length N50"] / 1e3)
+
+        # If the .count files have histograms, the N50 over all pass+fail reads can be
+        # had directly. Otherwise fall back to NanoPlot.
+        all_counts = [ c for c in ci['_counts'] if c['_part'] in ['pass', 'fail'] ]
+        if all_counts and all( '_length_hist' in c for c in all_counts ):
+            n50 = hist_n50( merge_hists( c['_length_hist'] for c in all_counts ) )
+        else:
+            n50 = gs["Read length N50"]
+        row["Estimated N50 (kb)"] = _round(n50 / 1e3)
 
         # Check I filled everything in
         assert list(row.keys()) == headings
@@ -682,6 +704,10 @@ def load_cell_yaml(filename):
             countsdict['max_length'] = int( rlsplit[-1] )
             del countsdict['read_length']
 
+        # Newer files have histograms, which should not be tabulated directly
+        for h in ['length_hist', 'meanq_hist']:
+            od_key_replace(countsdict, h, f"_{h}")
+
     return celldict
 
 def resolve_filter(bcfilter, all_info):
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+"""Check that pod5 files are complete and structurally sound, as a quick alternative to
+   'pod5 view -I -o /dev/null'. Only the file layout is checked, not the read data, but
+   this catches truncated files and corrupted copies while reading just a few KB from
+   each file. See hesiod/Pod5Check.py.
+
+   Prints a line for each good file, and logs an error for each bad one. The exit status
+   is 1 if any file is bad.
+"""
+
+import logging as L
+from concurrent.futures import ThreadPoolExecutor
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+from hesiod.Pod5Check import check_pod5
+
+def main(args):
+
+    L.basicConfig( level = L.DEBUG if args.verbose else L.INFO,
+                   format = "{levelname}:{message}",
+                   style = '{' )
+
+    def _check(filename):
+        try:
+            return check_pod5(filename, sample_batches=args.sample_batches)
+        except RuntimeError as e:
+            L.error(e)
+            return None
+
+    # The results come back in order
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        results = list(executor.map(_check, args.files))
+
+    for filename, res in zip(args.files, results):
+        if res:
+            tables = ", ".join( f"{t['content_type']}={t['record_batches']}"
+                                for t in res['tables'] )
+            print(f"{filename}\tOK\tpod5 {res['pod5_version']} from {res['software']}"
+                  f"\t{tables}")
+
+    bad_count = results.count(None)
+    if bad_count:
+        L.error(f"{bad_count} of {len(results)} files failed the check")
+        exit(1)
+
+def parse_args(*args):
+    description = """Check the structure of pod5 files."""
+
+    parser = ArgumentParser( description = description,
+                             formatter_class = ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("files", nargs='+',
+                        help="The pod5 files to check")
+    parser.add_argument("-s", "--sample_batches", type=int, default=3,
+                        help="Also check this many record batches from each table")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Check this many files at once")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Print more logging to stderr")
+
+    return parser.parse_args(*args)
+
+if __name__=="__main__":
+    main(parse_args())
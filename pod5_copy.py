@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""Copy pod5 files, and at the same time make the .md5 file and check that each copy is
+   a complete pod5 file. See hesiod/Pod5Copy.py.
+
+   This used to be three steps in the copy_md5sum_pod5 rule:
+     1) cp --no-preserve=all in.pod5 out.pod5
+     2) md5sum out.pod5 > out.pod5.md5
+     3) pod5 view -I -o /dev/null out.pod5
+   which read all the data three times. Here the data is read once. The MD5 is made from
+   the same buffer that is written out, the ends of the file are checked on the data as it
+   passes, and the embedded tables are checked from their footers, in place of
+   'pod5 view -I' (see hesiod/Pod5Check.py). As with 'cp --no-preserve=all' the copy gets
+   default permissions and times.
+
+   As with cp, give either one file and where to copy it, or several files and
+   -t/--target_directory. With -j, several files are copied at once and the .md5 file
+   has a line for each, in the order given, so one job can deal with a whole batch.
+"""
+
+import os
+import logging as L
+from concurrent.futures import ThreadPoolExecutor
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+from hesiod import md5sum_line
+from hesiod.Pod5Copy import copy_pod5, COPY_BLOCK_SIZE
+
+def main(args):
+
+    L.basicConfig( level = L.DEBUG if args.verbose else L.INFO,
+                   format = "{levelname}:{message}",
+                   style = '{' )
+
+    if args.target_directory:
+        pairs = [ (f, os.path.join(args.target_directory, os.path.basename(f)))
+                  for f in args.files ]
+    elif len(args.files) == 2:
+        pairs = [ tuple(args.files) ]
+    else:
+        exit("Give a file and where to copy it, or else use --target_directory")
+    L.info(f"Copying {len(pairs)} pod5 files")
+
+    def _copy(pair):
+        return copy_pod5( *pair,
+                          block_size = args.block_size,
+                          drop_cache = not args.keep_cache,
+                          check_tables = not args.ends_only,
+                          sample_batches = args.sample_batches )
+
+    # The results come back in order, even if the copies finish out of order
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        md5s = list(executor.map(_copy, pairs))
+
+    if args.md5:
+        # The names in the .md5 file are relative to --md5_base, as if md5sum had been
+        # run in that directory.
+        with open(args.md5 + ".tmp", "w") as mfh:
+            for (src, dest), md5 in zip(pairs, md5s):
+                md5_name = os.path.relpath(dest, args.md5_base or os.path.dirname(dest))
+                print(md5sum_line(md5, md5_name), file=mfh, end='')
+        os.replace(args.md5 + ".tmp", args.md5)
+
+def parse_args(*args):
+    description = """Copy, checksum and check pod5 files in a single pass."""
+
+    parser = ArgumentParser( description = description,
+                             formatter_class = ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("files", nargs='+',
+                        help="The pod5 file to copy and where to copy it to, or with"
+                             " --target_directory the files to copy")
+    parser.add_argument("-t", "--target_directory",
+                        help="Copy all the files into this directory")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Copy this many files at once")
+    parser.add_argument("--md5",
+                        help="Output .md5 file, in the format made by md5sum")
+    parser.add_argument("--md5_base",
+                        help="Directory the name in the .md5 file is relative to."
+                             " Defaults to the directory of the copy.")
+    parser.add_argument("--block_size", type=int, default=COPY_BLOCK_SIZE,
+                        help="Copy in blocks of this many bytes")
+    parser.add_argument("--sample_batches", type=int, default=0,
+                        help="Also check this many record batches from each table")
+    parser.add_argument("--ends_only", action="store_true",
+                        help="Only check the ends of the file, not the embedded tables")
+    parser.add_argument("--keep_cache", action="store_true",
+                        help="Don't drop the files from the page cache after copying")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Print more logging to stderr")
+
+    return parser.parse_args(*args)
+
+if __name__=="__main__":
+    main(parse_args())
@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 import os.path
 from glob import glob
+from fnmatch import fnmatchcase
 import sys
 import logging as L
 import datetime
+import time
 from hesiod import load_yaml
+from hesiod.RunIndex import RunIndex
 
 class RunStatus:
     """This Class provides information about a Promethion run, given a run folder.
@@ -43,12 +46,14 @@ class RunStatus:
         # Cell names are in the form library/cell as there are two levels of directory.
         # Note the glob pattern needs to be the same as in list_remote_cells.sh - really
         # old runs did not have "other_reports" but now this is indicative of a real cell.
+        # Allow for re-called cells which have an extension. Both patterns are checked in
+        # a single pass over the directories, rather than by two separate glob() calls.
         self.local_cells = set()
-        for l in glob( os.path.join(self.run_path, '*/20??????_*_????????/other_reports') ):
-            self.local_cells.add("{}/{}".format(*l.split('/')[-3:]))
-        # Allow for re-called cells which have an extension
-        for l in glob( os.path.join(self.run_path, '*/20??????_*_????????.*/other_reports') ):
-            self.local_cells.add("{}/{}".format(*l.split('/')[-3:]))
+        for lib, cell in self._list_cell_dirs():
+            if ( fnmatchcase(cell, '20??????_*_????????') or
+                 fnmatchcase(cell, '20??????_*_????????.*') ):
+                if os.path.lexists(os.path.join(self.run_path, lib, cell, 'other_reports')):
+                    self.local_cells.add("{}/{}".format(lib, cell))
 
         # Do we need a quick mode?
         self.quick_mode = 'q' in opts
@@ -57,24 +62,47 @@ class RunStatus:
 
     def _clear_cache( self ):
         self._exists_cache = dict()
+        self._pipeline_files = None
         self._cells_cache = None
 
-    def _exists_pipeline( self, glob_pattern ):
-        """ Returns if a file exists in the pipeline dir and caches the result.
+    def _list_cell_dirs( self ):
+        """ Yields (library, cell) for every directory two levels below the run_path,
+            skipping hidden names just as glob('*/*') would.
         """
-        return self._exists(glob_pattern, self.run_path + '/pipeline')
+        try:
+            libs = sorted( e.name for e in os.scandir(self.run_path)
+                           if e.is_dir() and not e.name.startswith('.') )
+        except (FileNotFoundError, NotADirectoryError):
+            return
 
-    def _exists( self, glob_pattern, root_path ):
-        """ Returns if a file exists in root_path and caches the result.
-            The check will be done with glob() so wildcards can be used, and
-            the result will be the number of matches.
+        for lib in libs:
+            try:
+                cells = sorted( e.name for e in os.scandir(os.path.join(self.run_path, lib))
+                                if e.is_dir() and not e.name.startswith('.') )
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for cell in cells:
+                yield lib, cell
+
+    def _exists_pipeline( self, glob_pattern ):
+        """ Returns if a file exists in the pipeline dir, as the number of matches.
+            The directory is listed just once and the listing is cached, so the pattern
+            is matched with fnmatch rather than by calling glob() for every touch file.
+            The pattern '.' checks that the pipeline directory itself exists.
         """
-        full_pattern = os.path.join(root_path, glob_pattern)
-        if full_pattern not in self._exists_cache:
-            self._exists_cache[full_pattern] = glob(full_pattern)
-            L.debug("_exists {} => {}".format(full_pattern, self._exists_cache[full_pattern]))
+        if self._pipeline_files is None:
+            try:
+                self._pipeline_files = os.listdir(os.path.join(self.run_path, 'pipeline'))
+            except (FileNotFoundError, NotADirectoryError):
+                self._pipeline_files = False
+            L.debug("_exists_pipeline listing => {}".format(self._pipeline_files))
+
+        if self._pipeline_files is False:
+            return 0
+        if glob_pattern == '.':
+            return 1
 
-        return len( self._exists_cache[full_pattern] )
+        return len([ f for f in self._pipeline_files if fnmatchcase(f, glob_pattern) ])
 
     def cell_to_tfn(self, cellname):
         """This corresponds to cell_to_tfn in driver.sh
@@ -272,8 +300,7 @@ class RunStatus:
         """ The directory name is the experiment name. Allow a .xxx extension
             since there are no '.'s is PacBio run names.
         """
-        realdir = os.path.basename(os.path.realpath(self.run_path))
-        return realdir.split('.')[0]
+        return experiment_for_dir(self.run_path)
 
     def get_instrument(self):
         """ This is controlled by the UPSTREAM setting and goes as the second
@@ -345,6 +372,12 @@ class RunStatus:
                                'StartTime: unknown',
                                'PipelineStatus: ' + pstatus ])
 
+def experiment_for_dir(run_path):
+    """ See RunStatus.get_experiment()
+    """
+    realdir = os.path.basename(os.path.realpath(run_path))
+    return realdir.split('.')[0]
+
 def parse_remote_cell_info():
     """Read a list of TSV lines form STDIN - run_id + remote_loc + remote_cell
        There may be multiple lines relating to each run_id, but the location should
@@ -364,6 +397,35 @@ def parse_remote_cell_info():
 
     return res
 
+def get_yaml_batch(runs, opts='', upstream=None, stall_time=None, debug=True, run_index=None):
+    """Get the status of several runs in one go, so the upstream info only needs to be
+       parsed once. Each block is headed with a 'RunDir:' line giving the run exactly as
+       supplied, so that the caller (driver.sh) can pick out the block it wants.
+       If a RunIndex is supplied, finished runs are taken from there where possible.
+    """
+    res = []
+    for run in runs:
+        run_key = os.path.abspath(run)
+        upstream_info = (upstream or {}).get(experiment_for_dir(run))
+
+        yaml = run_index and run_index.lookup(run_key, upstream_info)
+        if not yaml:
+            listed_at = time.time()
+            run_info = RunStatus(run, opts,
+                                 upstream = upstream,
+                                 stall_time = stall_time)
+            yaml = run_info.get_yaml(debug=debug)
+
+            if run_index:
+                status = yaml.rsplit('PipelineStatus: ', 1)[-1]
+                run_index.add( run_key, status, yaml, listed_at,
+                               libraries = set(c.split('/')[0] for c in run_info.local_cells),
+                               upstream_info = upstream_info )
+
+        res.append( 'RunDir: ' + run + '\n' + yaml + '\n' )
+
+    return '\n'.join(res)
+
 if __name__ == '__main__':
     # Very cursory option parsing
     optind = 1 ; opts = ''
@@ -381,9 +443,30 @@ if __name__ == '__main__':
 
     # If no run specified, examine the CWD.
     runs = sys.argv[optind:] or ['.']
-    for run in runs:
-        run_info = RunStatus(run, opts,
-                             upstream = remote_info,
-                             stall_time  = os.environ.get('STALL_TIME') or None)
-        print ( run_info.get_yaml( debug=os.environ.get('DEBUG', '0') != '0' ) )
-
+    stall_time = os.environ.get('STALL_TIME') or None
+    debug = os.environ.get('DEBUG', '0') != '0'
+
+    if 'B' in opts:
+        # Batch mode, with a header on each block. The RUN_INDEX file, if set, saves
+        # re-examining finished runs, and the F flag forces a full rescan.
+        start_time = time.time()
+        run_index = None
+        if os.environ.get('RUN_INDEX'):
+            run_index = RunIndex(os.environ['RUN_INDEX'], rebuild = 'F' in opts)
+
+        print( get_yaml_batch(runs, opts,
+                              upstream = remote_info,
+                              stall_time = stall_time,
+                              debug = debug,
+                              run_index = run_index), end='' )
+
+        if run_index:
+            run_index.save()
+            print( "Checked {} runs ({} finished runs from the index) in {:.2f} seconds".format(
+                        len(runs), run_index.hits, time.time() - start_time ), file=sys.stderr )
+    else:
+        for run in runs:
+            run_info = RunStatus(run, opts,
+                                 upstream = remote_info,
+                                 stall_time  = stall_time)
+            print ( run_info.get_yaml( debug=debug ) )
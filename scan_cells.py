@@ -10,12 +10,15 @@
 import os
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 import logging as L
-from itertools import product
+from itertools import product, islice
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint, pformat
 
 from hesiod import ( glob, groupby, parse_cell_name, load_final_summary,
-                     fast5_out, pod5_out, find_summary, dump_yaml, get_common_prefix )
+                     fast5_out, pod5_out, find_summary, dump_yaml, get_common_prefix,
+                     _glob_key_func )
+from hesiod.DirIndex import DirIndex, listdir
 
 DEFAULT_FILETYPES_TO_SCAN = ["fastq", "fastq.gz", "fast5", "pod5", "bam"]
 
@@ -39,13 +42,21 @@ def main(args):
     print( dump_yaml(res), end='' )
 
 def scan_main(args, experiment):
+    # If there is an index of directory listings, use it
+    dir_index = DirIndex(args.index, rebuild=args.rebuild) if args.index else None
+
     # This will yield a dict with scanned_cells and counts as keys
     res = scan_cells(args.expdir, cells = args.cells,
                                   cellsready = args.cellsready,
                                   look_in_output = args.missing_ok,
-                                  subset = args.subset)
+                                  subset = args.subset,
+                                  dir_index = dir_index,
+                                  jobs = args.jobs)
     sc = res['scanned_cells']
 
+    if dir_index:
+        dir_index.save()
+
     # Find a representative FAST5 and POD5 and FASTQ per cell
     for c, v in sc.items():
         rep_fast5 = res.setdefault('representative_fast5', dict())
@@ -79,7 +90,9 @@ def scan_main(args, experiment):
 def scan_cells( expdir, cells=None, cellsready=None,
                         look_in_output = False,
                         subset = None,
-                        filetypes_to_scan = DEFAULT_FILETYPES_TO_SCAN ):
+                        filetypes_to_scan = DEFAULT_FILETYPES_TO_SCAN,
+                        dir_index = None,
+                        jobs = 1 ):
     """ Work out all the cells to process. Normally simple since the list is just passed in
         by driver.sh directly but I do want to be able to process all the cells by default so
         there is some scanning capability too.
@@ -87,10 +100,11 @@ def scan_cells( expdir, cells=None, cellsready=None,
 
         res['scanned_cells'] structure is { cell : barcode : 'fastX_pass' : [ list of files ] }
         res['counts'] is headline counts for cells found
-    """
-    # Implement subset by providing a glob function with a baked-in limit
-    globn = partial(glob, limit=subset)
 
+        If dir_index is supplied (a hesiod.DirIndex) then unchanged directories will not be
+        re-listed.
+        If jobs > 1 then the cells are scanned in parallel, but the result is the same.
+    """
     if cells is None:
         if expdir:
             # Look for valid cells in the input files
@@ -128,86 +142,18 @@ def scan_cells( expdir, cells=None, cellsready=None,
 
     res = { c: dict() for c in cellsready }
 
-    # A place to store the skip files we otherwise ignore
-    skipped_skip_files = {}
-
     if expdir:
-        for c, d in res.items():
-            for pf, filetype in product(["", "_skip", "_pass", "_fail"], filetypes_to_scan):
-                category = f"{filetype}{pf}"
-                cat_dir  = f"{filetype.split('.')[0]}{pf}"
-                # Collect un-barcoded files
-                non_barcoded_files = [ f[len(expdir) + 1:]
-                                       for f in globn(f"{expdir}/{c}/{cat_dir}/*.{filetype}") ]
-                barcoded_files = [ f[len(expdir) + 1:]
-                                   for f in globn(f"{expdir}/{c}/{cat_dir}/*/*.{filetype}") ]
-                if non_barcoded_files:
-                    d.setdefault('.', dict())[category] = non_barcoded_files
-                for bf in barcoded_files:
-                    # Keys in d are to be the barcodes which we extract from the filenames like so:
-                    _, barcode, _ = bf[len(c) + 1:].split('/')
-                    d.setdefault(barcode, dict()).setdefault(category, list()).append(bf)
-
-        # Some fixing-upping...
-        for c, d in res.items():
-            # We may have files in fast5_skip (or pod5_skip) but these are never barcoded, nor are
-            # there any fastq files, since they are not even basecalled. They do need to be
-            # included in the tally when checking vs. the final summary.
-            # I'll keep these in pod5_skip, but any other skip types go into "_fail"
-            for filetype in filetypes_to_scan:
-                if filetype == "pod5":
-                    continue
-
-                files_in_skip = [ f[len(expdir) + 1:]
-                                  for f in globn(f"{expdir}/{c}/{filetype}_skip/*") ]
-
-                # For Promethion, at present, the skip files actually go into fast5_fail/.
-                # not fast5_skip/ but by my logic when there are barcodes these need to be in
-                # 'unclassified' so detect this case first and pull them out before making the
-                # empty lists.
-                if 'unclassified' in d and d.get('.',{}).get(f"{filetype}_fail"):
-                    files_in_skip.extend(d['.'][f"{filetype}_fail"])
-                    del d['.'][f"{filetype}_fail"]
-                    if not d['.']:
-                        # This is like rmdir - only remove the key if it now points to an empty dict.
-                        del d['.']
-
-                if files_in_skip:
-                    # Whatever we got in the skip, work out where to put it
-                    if 'unclassified' in d:
-                        d['unclassified'].setdefault(f"{filetype}_fail",[]).extend( files_in_skip )
-                    elif '.' in d:
-                        d['.'].setdefault(f"{filetype}_fail",[]).extend( files_in_skip )
-                    else:
-                        # Should never happen?
-                        skipped_skip_files[(c,filetype)] = files_in_skip
-
-            # A quirk of the logic above is that barcodes with "fail" reads but no "pass" reads
-            # are listed after those with "pass" reads, and this carries into the reports. If this
-            # is a problem, this is the place to fix it by sorting all dicts within res.
-
-        # Sanity-check that the file counts match with final_summary.txt
-        for c, d in res.items():
-            fs = load_final_summary(f"{expdir}/{c}/")
-            for ft in ["fastq", "fast5", "pod5"]:
-                # Add zipped and unzipped FASTQ files...
-                ft_sum = sum( len(fileslist.get(f"{ft}{z}{pf}",()))
-                                for fileslist in d.values()
-                                for z in (["", ".gz"] if ft == "fastq" else [""])
-                                for pf in ["", "_skip", "_pass", "_fail"] )
-                # Account for skipped_skip_files
-                if skipped_skip_files.get((c,ft)):
-                    L.warning(f"skipped_skip_files is non-empty for {(c,ft)}:"
-                              F" {skipped_skip_files[(c,ft)]}")
-                    ft_sum += len( skipped_skip_files[(c,ft)] )
-
-                # Specifically with MinKNOW 5.5.3 we have a bug where the pod5_files_in_final_dest
-                # is missing, so allow for this to be None and skip the check.
-                ft_expected = fs.get(f'{ft}_files_in_final_dest')
-                if (ft_expected is not None) and (ft_sum != ft_expected) and (subset is None):
-
-                    raise RuntimeError( f"Mismatch between count of {ft.upper()} files for {c}:\n" +
-                                        f"{ft_sum} (seen) != {ft_expected} (in final_summary.txt)" )
+        scan_func = partial( scan_one_cell, expdir,
+                             subset = subset,
+                             filetypes_to_scan = filetypes_to_scan,
+                             dir_index = dir_index )
+        if jobs > 1 and len(res) > 1:
+            # Most of the time is spent waiting on the filesystem so threads are fine.
+            # executor.map() yields the results in order, and any exception is re-raised.
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                res = dict(zip(res, executor.map(scan_func, res)))
+        else:
+            res = { c: scan_func(c) for c in res }
 
     # Return the dict of stuff to process, and other counts we've calculated
     counts = dict( cells = len(cells),
@@ -216,6 +162,136 @@ def scan_cells( expdir, cells=None, cellsready=None,
     return dict( scanned_cells = res,
                  counts = counts )
 
+def scan_one_cell( expdir, c,
+                   subset = None,
+                   filetypes_to_scan = DEFAULT_FILETYPES_TO_SCAN,
+                   dir_index = None ):
+    """Get the categorised index of all the files for one cell, in the form
+       { barcode : 'fastX_pass' : [ list of files ] }
+       and check the file counts against the final_summary.txt
+    """
+    d = dict()
+
+    # Implement subset by providing a sort function with a baked-in limit, which is
+    # what glob(limit=subset) did.
+    def sortn(files):
+        return sorted(islice(files, 0, subset), key=_glob_key_func)
+
+    # A place to store the skip files we otherwise ignore
+    skipped_skip_files = {}
+
+    # These are all the directories we might need to look in.
+    cat_dirs = set( f"{filetype.split('.')[0]}{pf}"
+                    for pf, filetype in product(["", "_skip", "_pass", "_fail"], filetypes_to_scan) )
+    skip_dirs = set( f"{filetype}_skip" for filetype in filetypes_to_scan )
+
+    # Get all the listings in one go, then sort them out.
+    cl = list_cell_dirs( f"{expdir}/{c}",
+                         dir_names = cat_dirs | skip_dirs,
+                         listdir = dir_index.listdir if dir_index else listdir )
+
+    for pf, filetype in product(["", "_skip", "_pass", "_fail"], filetypes_to_scan):
+        category = f"{filetype}{pf}"
+        cat_dir  = f"{filetype.split('.')[0]}{pf}"
+        cat_listing = cl.get(cat_dir, {})
+        # Collect un-barcoded files, equivalent to globbing {cat_dir}/*.{filetype}
+        non_barcoded_files = sortn( f"{c}/{cat_dir}/{f}"
+                                    for f in cat_listing.get('', [])
+                                    if f.endswith(f".{filetype}") )
+        # And {cat_dir}/*/*.{filetype}
+        barcoded_files = sortn( f"{c}/{cat_dir}/{bc}/{f}"
+                                for bc, bc_files in cat_listing.items() if bc
+                                for f in bc_files
+                                if f.endswith(f".{filetype}") )
+        if non_barcoded_files:
+            d.setdefault('.', dict())[category] = non_barcoded_files
+        for bf in barcoded_files:
+            # Keys in d are to be the barcodes which we extract from the filenames like so:
+            _, barcode, _ = bf[len(c) + 1:].split('/')
+            d.setdefault(barcode, dict()).setdefault(category, list()).append(bf)
+
+    # Some fixing-upping...
+    # We may have files in fast5_skip (or pod5_skip) but these are never barcoded, nor are
+    # there any fastq files, since they are not even basecalled. They do need to be
+    # included in the tally when checking vs. the final summary.
+    # I'll keep these in pod5_skip, but any other skip types go into "_fail"
+    for filetype in filetypes_to_scan:
+        if filetype == "pod5":
+            continue
+
+        files_in_skip = sortn( f"{c}/{filetype}_skip/{f}"
+                               for f in cl.get(f"{filetype}_skip", {}).get('', []) )
+
+        # For Promethion, at present, the skip files actually go into fast5_fail/.
+        # not fast5_skip/ but by my logic when there are barcodes these need to be in
+        # 'unclassified' so detect this case first and pull them out before making the
+        # empty lists.
+        if 'unclassified' in d and d.get('.',{}).get(f"{filetype}_fail"):
+            files_in_skip.extend(d['.'][f"{filetype}_fail"])
+            del d['.'][f"{filetype}_fail"]
+            if not d['.']:
+                # This is like rmdir - only remove the key if it now points to an empty dict.
+                del d['.']
+
+        if files_in_skip:
+            # Whatever we got in the skip, work out where to put it
+            if 'unclassified' in d:
+                d['unclassified'].setdefault(f"{filetype}_fail",[]).extend( files_in_skip )
+            elif '.' in d:
+                d['.'].setdefault(f"{filetype}_fail",[]).extend( files_in_skip )
+            else:
+                # Should never happen?
+                skipped_skip_files[filetype] = files_in_skip
+
+    # A quirk of the logic above is that barcodes with "fail" reads but no "pass" reads
+    # are listed after those with "pass" reads, and this carries into the reports. If this
+    # is a problem, this is the place to fix it by sorting all dicts within res.
+
+    # Sanity-check that the file counts match with final_summary.txt
+    fs = load_final_summary(f"{expdir}/{c}/")
+    for ft in ["fastq", "fast5", "pod5"]:
+        # Add zipped and unzipped FASTQ files...
+        ft_sum = sum( len(fileslist.get(f"{ft}{z}{pf}",()))
+                        for fileslist in d.values()
+                        for z in (["", ".gz"] if ft == "fastq" else [""])
+                        for pf in ["", "_skip", "_pass", "_fail"] )
+        # Account for skipped_skip_files
+        if skipped_skip_files.get(ft):
+            L.warning(f"skipped_skip_files is non-empty for {(c,ft)}:"
+                      F" {skipped_skip_files[ft]}")
+            ft_sum += len( skipped_skip_files[ft] )
+
+        # Specifically with MinKNOW 5.5.3 we have a bug where the pod5_files_in_final_dest
+        # is missing, so allow for this to be None and skip the check.
+        ft_expected = fs.get(f'{ft}_files_in_final_dest')
+        if (ft_expected is not None) and (ft_sum != ft_expected) and (subset is None):
+
+            raise RuntimeError( f"Mismatch between count of {ft.upper()} files for {c}:\n" +
+                                f"{ft_sum} (seen) != {ft_expected} (in final_summary.txt)" )
+
+    return d
+
+def list_cell_dirs(cell_dir, dir_names, listdir=listdir):
+    """Lists the named subdirectories of a cell, and any directories within them
+       (ie. the barcodes), without looking for any directories that don't exist.
+       Returns { dir_name: { '': [names], barcode: [names] } } where the names are all
+       the non-hidden entries (as glob would see them) in the order listdir gives them.
+    """
+    res = dict()
+    for name, is_dir in listdir(cell_dir):
+        if not (is_dir and name in dir_names):
+            continue
+
+        res[name] = dir_listing = { '': [] }
+        for sub_name, sub_is_dir in listdir(f"{cell_dir}/{name}"):
+            if sub_name.startswith('.'):
+                continue
+            dir_listing[''].append(sub_name)
+            if sub_is_dir:
+                dir_listing[sub_name] = [ n for n, _ in listdir(f"{cell_dir}/{name}/{sub_name}")
+                                          if not n.startswith('.') ]
+    return res
+
 def sc_counts(sc_dict, width=140, show_zeros=True):
     """ Make a printable summary of SC
     """
@@ -330,6 +406,15 @@ def parse_args(*args):
     parser.add_argument("-m", "--missing_ok", action="store_true",
                         help="If expdir is missing or incomplete, scan files in current dir.")
 
+    parser.add_argument("--index",
+                        help="Cache directory listings in this file, and only re-list directories"
+                             " that changed since the last scan.")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Ignore the contents of the --index file and make it afresh.")
+
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Scan this many cells in parallel.")
+
     parser.add_argument("--subset", type=int,
                         help="Only report the first N files per barcode. Useful for debugging only.")
     parser.add_argument("-v", "--verbose", action="store_true",
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+"""Measure the speed and compression ratio of the compression profiles (see
+   hesiod/Compression.py) and, for comparison, of other codecs, so we can choose the
+   settings for the merged FASTQ and the sequencing summary from data.
+
+   It is best to give it a real FASTQ file and a real sequencing_summary.txt, since
+   synthetic reads compress very differently, but if none are given some fake data is
+   made. Each file is read once to get it into the page cache, then compressed from
+   memory to /dev/null, so the disk speed does not come into it.
+
+   Run it from the top level of the Hesiod code, eg:
+     $ scripts/benchmark_compression.py --fastq some.fastq --summary sequencing_summary.txt
+     $ scripts/benchmark_compression.py --codecs pigz zstd --levels 1 3 6 9 -p 8
+"""
+
+import os, sys
+import logging as L
+import random
+import shlex
+import shutil
+import time
+from tempfile import NamedTemporaryFile
+from subprocess import run, PIPE
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+HESIOD_HOME = os.path.abspath(os.path.dirname(__file__) + '/..')
+sys.path.insert(0, HESIOD_HOME)
+
+from hesiod.Compression import PROFILES, CODECS, compression_profile, compressor_command
+from benchmark_fq_counter import make_fastq
+
+def main(args):
+
+    L.basicConfig( level = L.DEBUG if args.verbose else L.INFO,
+                   format = "{levelname}:{message}",
+                   style = '{' )
+
+    # What to try. Either the named profiles, or every codec at every level.
+    candidates = []
+    if args.codecs:
+        for codec in args.codecs:
+            if not shutil.which(CODECS[codec]['cmd'].split()[0]):
+                L.warning(f"{codec} is not installed. Skipping it.")
+                continue
+            for level in args.levels:
+                profile = compression_profile(level=level, threads=args.threads)
+                candidates.append((f"{codec} -{level}", codec, profile))
+    else:
+        for name in PROFILES:
+            profile = compression_profile(name, threads=args.threads)
+            candidates.append((name, args.codec, profile))
+
+    with NamedTemporaryFile(suffix=".fastq") as fq_tfh, \
+         NamedTemporaryFile(suffix=".txt") as ss_tfh:
+        samples = dict( fastq   = args.fastq,
+                        summary = args.summary )
+        if not samples['fastq']:
+            L.info(f"Writing {args.megabases} megabases of fake reads to {fq_tfh.name}")
+            make_fastq(fq_tfh, args.megabases * 1000000, seed=args.seed)
+            fq_tfh.flush()
+            samples['fastq'] = fq_tfh.name
+        if not samples['summary']:
+            L.info(f"Writing a fake sequencing summary to {ss_tfh.name}")
+            make_summary(ss_tfh, args.megabases * 100, seed=args.seed)
+            ss_tfh.flush()
+            samples['summary'] = ss_tfh.name
+
+        print(f"{'sample':8s} {'setting':12s} {'MB/s':>8s} {'ratio':>6s}")
+        for sname, sfile in samples.items():
+            size = os.path.getsize(sfile)
+            L.info(f"{sname} sample is {sfile} ({size} bytes)")
+            for label, codec, profile in candidates:
+                seconds, out_size = benchmark(sfile, codec, profile, args.repeats)
+                print(f"{sname:8s} {label:12s} {size / seconds / 1e6:8.1f} {size / out_size:6.2f}")
+
+def benchmark(filename, codec, profile, repeats):
+    """Compress the file with the codec and profile, returning the best time out of
+       repeats runs and the compressed size.
+    """
+    cmd = shlex.split(compressor_command(profile, codec, threads=True)) + ["-c"]
+    L.debug(f"Running {cmd}")
+
+    # Read the file once to get it into the page cache
+    with open(filename, 'rb') as fh:
+        while fh.read(1024*1024):
+            pass
+
+    timings = []
+    for _ in range(repeats):
+        with open(filename, 'rb') as ifh:
+            start = time.perf_counter()
+            p = run(cmd, stdin=ifh, stdout=PIPE, check=True)
+            timings.append(time.perf_counter() - start)
+
+    return min(timings), len(p.stdout)
+
+def make_summary(fh, lines, seed=42):
+    """Write something that looks like a sequencing_summary.txt, with some of the
+       columns that make up most of the size of the real thing.
+    """
+    rand = random.Random(seed)
+    fh.write( "filename_pod5\tread_id\tchannel\tstart_time\tduration\t"
+              "passes_filtering\tsequence_length_template\tmean_qscore_template\n".encode() )
+    for n in range(lines):
+        read_id = "%08x-%04x-%04x-%04x-%012x" % ( rand.getrandbits(32), rand.getrandbits(16),
+                                                  rand.getrandbits(16), rand.getrandbits(16),
+                                                  rand.getrandbits(48) )
+        fh.write( ( f"PAK00002_pass_{n // 4000}.pod5\t{read_id}\t{rand.randint(1, 3000)}\t"
+                    f"{n * 0.05:.6f}\t{rand.lognormvariate(1.5, 1.0):.6f}\t"
+                    f"{rand.choice(['TRUE', 'TRUE', 'TRUE', 'FALSE'])}\t"
+                    f"{int(rand.lognormvariate(8.5, 1.0)) + 1}\t{rand.uniform(5, 25):.6f}\n"
+                  ).encode() )
+
+def parse_args(*args):
+    description = """Benchmark the compression profiles on FASTQ and sequencing summary data."""
+
+    parser = ArgumentParser( description = description,
+                             formatter_class = ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--fastq",
+                        help="Sample FASTQ file. If not given, fake reads are used.")
+    parser.add_argument("--summary",
+                        help="Sample sequencing_summary.txt. If not given, fake data is used.")
+    parser.add_argument("--codec", choices=CODECS, default="pigz",
+                        help="Codec used to compare the profiles")
+    parser.add_argument("--codecs", nargs='+', choices=CODECS,
+                        help="Compare these codecs at --levels instead of comparing the profiles")
+    parser.add_argument("--levels", nargs='+', type=int, default=[1, 3, 6, 9],
+                        help="Levels to try with --codecs")
+    parser.add_argument("-p", "--threads", type=int, default=PROFILES['max']['threads'],
+                        help="Threads for codecs that support them")
+    parser.add_argument("--megabases", type=int, default=200,
+                        help="Amount of fake sequence to generate")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="Number of times to run each compressor")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="Random seed for the fake data")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Print more logging to stderr")
+
+    return parser.parse_args(*args)
+
+if __name__=="__main__":
+    main(parse_args())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+"""Compare the speed of fq_base_counter.awk and fq_base_counter.py on some synthetic
+   FASTQ data, and check they agree on the totals. Note the Python version does extra
+   work in making the histograms. Neither is given gzipped input, since in
+   production the decompression is done separately (or not at all, by fq_merge.py).
+
+   Run it from the top level of the Hesiod code, eg:
+     $ scripts/benchmark_fq_counter.py --megabases 2000
+"""
+
+import os, sys
+import logging as L
+import random
+import time
+from tempfile import NamedTemporaryFile
+from subprocess import run, PIPE
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+HESIOD_HOME = os.path.abspath(os.path.dirname(__file__) + '/..')
+
+def main(args):
+
+    L.basicConfig( level = L.DEBUG if args.verbose else L.INFO,
+                   format = "{levelname}:{message}",
+                   style = '{' )
+
+    with NamedTemporaryFile(suffix=".fastq") as tfh:
+        L.info(f"Writing {args.megabases} megabases of fake reads to {tfh.name}")
+        make_fastq(tfh, args.megabases * 1000000, seed=args.seed)
+        tfh.flush()
+        L.info(f"File size is {os.path.getsize(tfh.name)} bytes")
+
+        results = dict()
+        for name, cmd in [ ("awk", [args.awk, "-f", f"{HESIOD_HOME}/fq_base_counter.awk",
+                                    "-v", "fn=test.fastq", tfh.name]),
+                           ("python", [sys.executable, f"{HESIOD_HOME}/fq_base_counter.py",
+                                       "-n", "test.fastq", tfh.name]) ]:
+            # Read the file once to get it into the page cache
+            with open(tfh.name, 'rb') as fh:
+                while fh.read(1024*1024):
+                    pass
+
+            timings = []
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                p = run(cmd, stdout=PIPE, universal_newlines=True, check=True)
+                timings.append(time.perf_counter() - start)
+
+            results[name] = p.stdout
+            print(f"{name:8s} best of {args.repeats}: {min(timings):.2f} seconds")
+
+    # The awk version does not make the histograms, so just compare the totals
+    results["python"] = "".join(l for l in results["python"].splitlines(keepends=True)
+                                if not l.startswith(("length_hist:", "meanq_hist:")))
+
+    if results["awk"] != results["python"]:
+        print("Results differ!")
+        for k, v in results.items():
+            print(f"{k}:\n{v}")
+        exit(1)
+    else:
+        print("Results agree:\n" + results["python"], end='')
+
+def make_fastq(fh, total_bases, seed=42):
+    """Write reads with a spread of lengths, like a typical ONT run, and some Ns.
+    """
+    rand = random.Random(seed)
+    seq_pool = "".join(rand.choice("ACGT") for _ in range(100000))
+    seq_pool = seq_pool[:50000] + "N" * 10 + seq_pool[50010:]
+    qual_pool = "".join(chr(rand.randint(35, 75)) for _ in range(100000))
+
+    bases = 0
+    readnum = 0
+    while bases < total_bases:
+        readnum += 1
+        rlen = min(int(rand.lognormvariate(8.5, 1.0)) + 1, 100000)
+        offset = rand.randint(0, 100000 - rlen)
+        fh.write( ( f"@read{readnum}\n"
+                    f"{seq_pool[offset:offset+rlen]}\n"
+                    f"+\n"
+                    f"{qual_pool[offset:offset+rlen]}\n" ).encode() )
+        bases += rlen
+
+def parse_args(*args):
+    description = """Benchmark the AWK and Python FASTQ base counters."""
+
+    parser = ArgumentParser( description = description,
+                             formatter_class = ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--megabases", type=int, default=200,
+                        help="Amount of sequence to generate")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="Number of times to run each counter")
+    parser.add_argument("--awk", default="gawk",
+                        help="AWK to run fq_base_counter.awk with")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="Random seed for the fake reads")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Print more logging to stderr")
+
+    return parser.parse_args(*args)
+
+if __name__=="__main__":
+    main(parse_args())
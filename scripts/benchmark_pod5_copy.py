@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+"""Compare the speed of pod5_copy.py with the old copy_md5sum_pod5 rule, which ran
+   'cp --no-preserve=all', then md5sum, then 'pod5 view -I', and check they give the same
+   MD5. If pod5 is not installed the old way is timed without the 'pod5 view' step, so
+   the difference is understated.
+
+   Use a real pod5 file if possible, copying to the filesystem you care about (ie.
+   Lustre), since that is where reading the data three times really hurts. Otherwise a
+   fake file of random data in a pod5 container is made, and since this has no real
+   tables in it pod5_copy.py is run with --ends_only. Note that unless you are root
+   the page cache can't be cleared between runs, so on a local disk the old way gets
+   its second and third reads from memory.
+
+   Run it from the top level of the Hesiod code, eg:
+     $ scripts/benchmark_pod5_copy.py --pod5 /lustre/.../some.pod5 --to /lustre/tmp
+"""
+
+import os, sys
+import logging as L
+import shutil
+import time
+from tempfile import mkdtemp
+from subprocess import run, PIPE
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+HESIOD_HOME = os.path.abspath(os.path.dirname(__file__) + '/..')
+
+def main(args):
+
+    L.basicConfig( level = L.DEBUG if args.verbose else L.INFO,
+                   format = "{levelname}:{message}",
+                   style = '{' )
+
+    to_dir = mkdtemp(dir=args.to)
+    try:
+        if args.pod5:
+            src = args.pod5
+        else:
+            src = os.path.join(to_dir, "fake.pod5")
+            L.info(f"Writing {args.megabytes} megabytes of fake pod5 data to {src}")
+            with open(src, 'wb') as fh:
+                make_pod5(fh, args.megabytes * 1000000)
+        size = os.path.getsize(src)
+        dest = os.path.join(to_dir, "copy.pod5")
+
+        old_cmd = f"cp --no-preserve=all {src} {dest} && md5sum -- {dest}"
+        if shutil.which("pod5"):
+            old_cmd += f" && pod5 view -I -o /dev/null {dest}"
+        else:
+            L.warning("pod5 is not installed, so the old way is timed without 'pod5 view'")
+
+        new_cmd = [ sys.executable, f"{HESIOD_HOME}/pod5_copy.py",
+                    src, dest, "--md5", dest + ".md5" ]
+        if not args.pod5:
+            new_cmd.append("--ends_only")
+
+        results = dict()
+        for name, cmd in [ ("old", ["bash", "-c", old_cmd]),
+                           ("pod5_copy", new_cmd) ]:
+            timings = []
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                p = run(cmd, stdout=PIPE, universal_newlines=True, check=True)
+                timings.append(time.perf_counter() - start)
+                if name == "pod5_copy":
+                    with open(dest + ".md5") as mfh:
+                        results[name] = mfh.read().split()[0]
+                else:
+                    results[name] = p.stdout.split()[0]
+                os.unlink(dest)
+
+            print(f"{name:10s} best of {args.repeats}: {min(timings):.2f} seconds,"
+                  f" {size / min(timings) / 1e6:.1f} MB/s")
+    finally:
+        shutil.rmtree(to_dir)
+
+    if results["old"] != results["pod5_copy"]:
+        print(f"MD5 sums differ! {results}")
+        exit(1)
+    else:
+        print(f"MD5 sums agree: {results['old']}")
+
+def make_pod5(fh, size):
+    """Write random data in a pod5 container that will pass the checks on the ends of
+       the file in pod5_copy.py. The contents of the tables and the footer are not real.
+    """
+    marker = os.urandom(16)
+    fh.write(b"\x8bPOD\r\n\x1a\n" + marker + b"ARROW1\x00\x00")
+
+    block = 1024 * 1024
+    for n in range(0, size, block):
+        fh.write(os.urandom(min(block, size - n)))
+
+    footer = os.urandom(192)
+    fh.write(marker + b"FOOTER\x00\x00" + footer + len(footer).to_bytes(8, 'little'))
+    fh.write(marker + b"\x8bPOD\r\n\x1a\n")
+
+def parse_args(*args):
+    description = """Benchmark pod5_copy.py against cp + md5sum + pod5 view."""
+
+    parser = ArgumentParser( description = description,
+                             formatter_class = ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--pod5",
+                        help="Sample pod5 file. If not given, a fake one is made.")
+    parser.add_argument("--to",
+                        help="Directory to copy to. Defaults to the system temp dir.")
+    parser.add_argument("--megabytes", type=int, default=1000,
+                        help="Size of the fake pod5 file")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="Number of times to run each copy")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Print more logging to stderr")
+
+    return parser.parse_args(*args)
+
+if __name__=="__main__":
+    main(parse_args())
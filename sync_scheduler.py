@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+"""Runs the sync commands queued up by driver.sh, several at once.
+
+   Each line on STDIN is a job, as TSV:
+     experiment  upstream_name  cwd  log_file  label  command
+
+   The command is run with "bash -c" in the cwd, with all output appended to the log
+   file. At most --jobs commands run at once for any given upstream (or as set by
+   --limit NAME=N) and when a slot is free the upstreams take turns, so one big
+   experiment does not hold up the others.
+
+   If a command fails, no more jobs are started for that experiment. If a command
+   returns 130 or 20 (rsync interrupted) no more jobs are started at all.
+
+   The result for each experiment is printed as TSV - experiment plus one of
+   'done', 'failed' or 'aborted' - in the order the experiments were first seen.
+"""
+
+import sys
+import time
+import subprocess
+import threading
+import logging as L
+from queue import Queue
+from collections import OrderedDict, deque
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+# Return codes that indicate rsync was interrupted, so we should stop everything
+ABORT_CODES = [130, 20]
+
+def main(args):
+
+    L.basicConfig( level = L.DEBUG if args.verbose else L.INFO,
+                   format = "{levelname}:{message}",
+                   style = '{' )
+
+    jobs = list(read_jobs(sys.stdin))
+    limits = dict(parse_limit(l) for l in (args.limit or []))
+
+    results = run_jobs(jobs, default_limit=args.jobs, limits=limits)
+
+    for experiment, result in results.items():
+        print(experiment, result, sep='\t')
+
+def parse_limit(l):
+    """Turns "NAME=N" into (NAME, N)
+    """
+    name, n = l.split('=', 1)
+    return name, int(n)
+
+def read_jobs(fh):
+    """Read the jobs from TSV lines, as dicts.
+    """
+    for l in fh:
+        l = l.rstrip('\n')
+        if not l: continue
+        experiment, upstream, cwd, log_file, label, command = l.split('\t', 5)
+        yield dict( experiment = experiment,
+                    upstream = upstream,
+                    cwd = cwd,
+                    log_file = log_file,
+                    label = label,
+                    command = command )
+
+def run_one(job):
+    """Run a single job, logging to the job's log_file, and return the exit status.
+    """
+    with open(job['log_file'], 'a') as log_fh:
+        print(f">>> Starting sync of {job['label']} at {time.ctime()}", file=log_fh, flush=True)
+        p = subprocess.run( ["bash", "-c", job['command']],
+                            cwd = job['cwd'],
+                            stdin = subprocess.DEVNULL,
+                            stdout = log_fh,
+                            stderr = subprocess.STDOUT )
+        print(f"<<< Sync of {job['label']} finished with status {p.returncode} at {time.ctime()}",
+              file=log_fh, flush=True)
+    return p.returncode
+
+def run_jobs(jobs, default_limit=1, limits=None, run_func=run_one):
+    """Run all the jobs, respecting the per-upstream limits and taking the upstreams
+       in turn. Returns an OrderedDict of { experiment: result }
+    """
+    limits = limits or dict()
+
+    # A queue of pending jobs for each upstream, in the order the upstreams were seen
+    pending = OrderedDict()
+    results = OrderedDict()
+    for job in jobs:
+        pending.setdefault(job['upstream'], deque()).append(job)
+        results.setdefault(job['experiment'], 'done')
+
+    running = { u: 0 for u in pending }
+    finished = Queue()
+    aborted = False
+    next_turn = 0
+
+    def _run(job):
+        try:
+            rc = run_func(job)
+        except Exception as e:
+            L.error(f"Failed to run sync for {job['label']}: {e}")
+            rc = 1
+        finished.put((job, rc))
+
+    def _next_job():
+        # Find the next upstream, in turn, with a free slot and a job to run
+        nonlocal next_turn
+        upstreams = list(pending)
+        for i in range(len(upstreams)):
+            u = upstreams[(next_turn + i) % len(upstreams)]
+            limit = limits.get(u, default_limit)
+            while pending[u] and running[u] < limit:
+                job = pending[u].popleft()
+                if results[job['experiment']] != 'done':
+                    # Something in this experiment already failed
+                    continue
+                next_turn = (next_turn + i + 1) % len(upstreams)
+                return job
+        return None
+
+    n_running = 0
+    while True:
+        # Start as many jobs as we can
+        while not aborted:
+            job = _next_job()
+            if not job:
+                break
+            L.debug(f"Starting sync of {job['label']} from {job['upstream']}")
+            running[job['upstream']] += 1
+            n_running += 1
+            threading.Thread(target=_run, args=(job,), daemon=True).start()
+
+        if not n_running:
+            break
+
+        # Wait for something to finish
+        job, rc = finished.get()
+        running[job['upstream']] -= 1
+        n_running -= 1
+        L.debug(f"Sync of {job['label']} finished with status {rc}")
+
+        if rc in ABORT_CODES:
+            L.warning(f"Sync of {job['label']} was interrupted. Aborting all syncs.")
+            results[job['experiment']] = 'aborted'
+            aborted = True
+        elif rc != 0 and results[job['experiment']] == 'done':
+            L.warning(f"Sync of {job['label']} failed with status {rc}")
+            results[job['experiment']] = 'failed'
+
+    if aborted:
+        # Anything that did not get to run is also aborted
+        for u in pending:
+            for job in pending[u]:
+                if results[job['experiment']] == 'done':
+                    results[job['experiment']] = 'aborted'
+
+    return results
+
+def parse_args(*args):
+    description = """Run the queued sync commands for driver.sh, in parallel."""
+
+    parser = ArgumentParser( description = description,
+                             formatter_class = ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Run this many commands at once per upstream.")
+    parser.add_argument("-l", "--limit", action="append",
+                        help="Limit for a specific upstream, as NAME=N. May be repeated.")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Print more logging to stderr")
+
+    return parser.parse_args(*args)
+
+if __name__=="__main__":
+    main(parse_args())
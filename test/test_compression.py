@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+"""Test the compression profile settings"""
+
+import sys, os, re
+import unittest
+import logging
+
+VERBOSE = os.environ.get('VERBOSE', '0') != '0'
+
+from hesiod.Compression import compression_profile, compressor_command
+from hesiod.FastqCache import DEFAULT_COMPRESSOR
+
+class T(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        #Prevent the logger from printing messages - I like my tests to look pretty.
+        if VERBOSE:
+            logging.getLogger().setLevel(logging.DEBUG)
+        else:
+            logging.getLogger().setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        # See the errors in all their glory
+        self.maxDiff = None
+
+    ### THE TESTS ###
+    def test_default(self):
+        """The default should be what we always used
+        """
+        self.assertEqual(compressor_command(compression_profile()), "pigz -nT -9 -b512")
+        self.assertEqual(DEFAULT_COMPRESSOR, "pigz -nT -9 -b512")
+
+    def test_overrides(self):
+        """Settings from the Snakemake config arrive as strings, or None if unset
+        """
+        profile = compression_profile("fast", level="4", block=None, threads=2)
+        self.assertEqual(profile, dict(level=4, block=512, threads=2))
+
+        self.assertEqual(compressor_command(profile), "pigz -nT -4 -b512")
+        self.assertEqual(compressor_command(profile, threads=True), "pigz -nT -4 -b512 -p2")
+        self.assertEqual(compressor_command(profile, 'zstd', threads=True), "zstd -q -4 -T2")
+        self.assertEqual(compressor_command(profile, 'gzip', threads=True), "gzip -n -4")
+
+    def test_bad(self):
+        with self.assertRaisesRegex(ValueError, "Unknown compression profile 'slow'"):
+            compression_profile("slow")
+        with self.assertRaisesRegex(ValueError, "Unknown compression setting 'codec'"):
+            compression_profile(codec="zstd")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -182,6 +182,58 @@ class T(TestDriverBase):
         self.assertInStdout("Found 0 cells in upstream runs")
         self.assertInStdout("ls: cannot access '*/*/20??????_*_????????/other_reports': No such file or directory")
 
+    def test_missing_upstream(self):
+        """If an upstream location can't be listed, it should be marked as failed, so that
+           an incomplete run is not wrongly treated as having all its cells synced.
+           An upstream that is reachable but empty is fine.
+        """
+        self.copy_run('20190710_LOCALTEST_00missingfile')
+        os.makedirs(os.path.join(self.run_path, "pipeline/output"))
+
+        self.environment['UPSTREAM_TEST'] = EXAMPLES + '/no_such_upstream'
+        self.bm_rundriver()
+        self.assertInStdout("INCOMPLETE 20190710_LOCALTEST_00missingfile")
+        self.assertInStdout(f"Failed to list the cells in {EXAMPLES}/no_such_upstream")
+        self.assertEqual(glob(os.path.join(self.run_path, "pipeline", "*.synced")), [])
+
+        # Now with the empty upstream, the cell is seen to be ready
+        self.environment['UPSTREAM_TEST'] = EXAMPLES + '/empty'
+        self.bm_rundriver()
+        self.assertInStdout("INCOMPLETE 20190710_LOCALTEST_00missingfile")
+        self.assertEqual(len(glob(os.path.join(self.run_path, "pipeline", "*.synced"))), 1)
+
+    def test_multiple_upstreams(self):
+        """The upstream locations are listed concurrently, but the results should come
+           out in the order given in $UPSTREAM, and a slow one should time out without
+           holding up the rest.
+        """
+        self.environment['UPSTREAM'] = 'SLOW TEST3 TEST2'
+        self.environment['UPSTREAM_TEST2'] = f"{EXAMPLES}/upstream2"
+        self.environment['UPSTREAM_TEST3'] = f"{EXAMPLES}/upstream3"
+        self.environment['UPSTREAM_SLOW'] = "slowhost:/data"
+        self.environment['UPSTREAM_TIMEOUT_SLOW'] = '1'
+        self.environment['SYNC_CMD'] = 'rsync =$upstream_host= =$upstream_path= =$run= =$cell='
+        self.bm.add_mock('ssh', side_effect='sleep 60')
+
+        self.bm_rundriver()
+
+        self.assertInStdout("Timed out looking for upstream runs in slowhost:/data")
+        self.assertInStdout("Found 5 cells in upstream runs")
+
+        # The listing is logged when VERBOSE is set
+        listing = [ l.split('\t')[0] for l in self.bm.last_stdout.split('\n') if '\t' in l ]
+        self.assertEqual( listing, [ "20190226_TEST3_00testrun",
+                                     "20190226_TEST3_00testruncopy",
+                                     "20000101_TEST2_00testrun2",
+                                     "20000101_TEST2_00testrun2",
+                                     "20000101_TEST2_00testrun2" ] )
+
+        # All three new runs should be made
+        self.assertEqual( sorted(os.listdir(f"{self.temp_dir}/fastqdata")),
+                          [ "20000101_TEST2_00testrun2",
+                            "20190226_TEST3_00testrun",
+                            "20190226_TEST3_00testruncopy" ] )
+
     def test_new_but_output_exists(self):
         """There should be an error if the directory in fastqdata already exists
         """
@@ -239,6 +291,125 @@ class T(TestDriverBase):
                                     rsync_first_bit + ["=another test/20000101_0000_3-C1-C1_PAD00000_cccccccc="] ]
         self.assertEqual(self.bm.last_calls, expected_calls)
 
+    def test_sync_bwlimit(self):
+        """SYNC_BWLIMIT is shared between the jobs for the instrument, and may have
+           a unit suffix as for rsync
+        """
+        self.environment['UPSTREAM_TEST'] = f"{EXAMPLES}/upstream2"
+        self.environment['SYNC_CMD'] = 'rsync =$bwlimit= =$cell='
+        self.environment['SYNC_JOBS_TEST'] = '2'
+        self.environment['SYNC_BWLIMIT_TEST'] = '10M'
+        self.copy_run('20000101_TEST_00testrun2')
+
+        self.bm_rundriver()
+        self.assertInStdout("SYNC_NEEDED 20000101_TEST_00testrun2")
+        self.assertEqual( sorted(self.bm.last_calls['rsync']),
+                          [ ["=5120=", "=a test lib/20000101_0000_1-A1-A1_PAD00000_aaaaaaaa="],
+                            ["=5120=", "=a test lib/20000101_0000_2-B1-B1_PAD00000_bbbbbbbb="],
+                            ["=5120=", "=another test/20000101_0000_3-C1-C1_PAD00000_cccccccc="] ] )
+
+        # A value we can't divide is logged and used as-is
+        self.environment['SYNC_BWLIMIT_TEST'] = '1.5M'
+        self.bm_rundriver()
+        self.assertInStdout("cannot share SYNC_BWLIMIT value '1.5M' between jobs")
+        self.assertEqual( [ c[0] for c in self.bm.last_calls['rsync'] ], ["=1.5M="] * 3 )
+
+    def test_sync_needed_batch(self):
+        """As test_sync_needed but with SYNC_BATCH_CMD set, so all three cells are synced
+           in one go.
+        """
+        self.environment['UPSTREAM_TEST'] = f"{EXAMPLES}/upstream2"
+        self.environment['SYNC_CMD'] = 'rsync =$cell='
+        self.environment['SYNC_BATCH_CMD'] = 'rsync =$upstream_path= =$run= =$cell= =$files_from='
+        self.copy_run('20000101_TEST_00testrun2')
+
+        self.touch("a test lib/20000101_0000_1-A1-A1_PAD00000_aaaaaaaa/final_summary_PAD00000_1ea085ce.txt")
+
+        self.bm_rundriver()
+
+        self.assertInStdout("SYNC_NEEDED 20000101_TEST_00testrun2")
+        self.assertTrue(os.path.exists(self.run_path + "/pipeline/20000101_0000_1-A1-A1_PAD00000_aaaaaaaa.synced"))
+        self.assertTrue(os.path.exists(self.run_path + "/pipeline/sync.done"))
+
+        files_from = f"{self.run_path}/pipeline/sync_files_from.txt"
+        expected_calls = self.bm.empty_calls()
+        expected_calls['rsync'] = [[ f"={EXAMPLES}/upstream2/00testrun2=", "=20000101_TEST_00testrun2=",
+                                     "==", f"={files_from}=" ]]
+        self.assertEqual(self.bm.last_calls, expected_calls)
+
+        self.assertEqual( slurp_file(files_from), [ "a test lib/20000101_0000_1-A1-A1_PAD00000_aaaaaaaa",
+                                                    "a test lib/20000101_0000_2-B1-B1_PAD00000_bbbbbbbb",
+                                                    "another test/20000101_0000_3-C1-C1_PAD00000_cccccccc" ] )
+
+    def test_sync_trickle(self):
+        """With SYNC_TRICKLE_CMD set, cells that are still running upstream should just
+           have their settled files synced, and the final sync is done with SYNC_CMD.
+        """
+        upstream = f"{self.temp_dir}/upstream"
+        copytree(f"{EXAMPLES}/upstream2", upstream, symlinks=True)
+        self.environment['UPSTREAM_TEST'] = upstream
+        self.environment['SYNC_CMD'] = 'rsync =$cell='
+        self.environment['SYNC_TRICKLE_CMD'] = 'rsync =$cell= =$files_from='
+        self.environment['SYNC_TRICKLE_AGE'] = '0'
+        self.copy_run('20000101_TEST_00testrun2')
+
+        # The first cell has finished upstream
+        cell1 = "a test lib/20000101_0000_1-A1-A1_PAD00000_aaaaaaaa"
+        with open(f"{upstream}/00testrun2/{cell1}/final_summary_PAD00000_1ea085ce.txt", "x"):
+            pass
+
+        self.bm_rundriver()
+
+        self.assertInStdout("SYNC_NEEDED 20000101_TEST_00testrun2")
+        self.assertTrue(os.path.exists(self.run_path + "/pipeline/sync.done"))
+
+        cell2 = "a test lib/20000101_0000_2-B1-B1_PAD00000_bbbbbbbb"
+        cell3 = "another test/20000101_0000_3-C1-C1_PAD00000_cccccccc"
+        files_from = lambda c: f"{self.run_path}/pipeline/{c.split('/')[-1]}.settled_files.txt"
+        expected_calls = self.bm.empty_calls()
+        expected_calls['rsync'] = [ [ f"={cell1}=" ],
+                                    [ f"={cell2}=", f"={files_from(cell2)}=" ],
+                                    [ f"={cell3}=", f"={files_from(cell3)}=" ] ]
+        self.assertEqual(self.bm.last_calls, expected_calls)
+
+        # The settled files are listed relative to the upstream run directory
+        self.assertEqual( sorted(slurp_file(files_from(cell2))),
+                          [ f"{cell2}/fast5_pass/PAD38578_ceefaf6d76ad8167a2c1050da8a9b3de9601f838_0.fast5",
+                            f"{cell2}/fast5_pass/PAD38578_ceefaf6d76ad8167a2c1050da8a9b3de9601f838_1.fast5",
+                            f"{cell2}/fastq_pass/PAD38578_ceefaf6d76ad8167a2c1050da8a9b3de9601f838_0.fastq",
+                            f"{cell2}/fastq_pass/PAD38578_ceefaf6d76ad8167a2c1050da8a9b3de9601f838_1.fastq",
+                            f"{cell2}/other_reports/.gitkeep" ] )
+
+    def test_sync_ssh_pool(self):
+        """Any ssh in the sync command should share the pooled connection, unless
+           SSH_POOL=no is set.
+        """
+        self.environment['UPSTREAM_TEST'] = f"{EXAMPLES}/upstream2"
+        self.environment['SYNC_CMD'] = 'ssh -T =$upstream_host= rsync =$cell='
+        self.bm.add_mock('ssh')
+        self.copy_run('20000101_TEST_00testrun2')
+
+        self.bm_rundriver()
+
+        ssh_calls = self.bm.last_calls['ssh']
+        self.assertEqual(len(ssh_calls), 3)
+        for c in ssh_calls:
+            self.assertEqual(c[:2], ["-o", "ControlMaster=auto"])
+            self.assertRegex(c[3], r'^ControlPath=.*/hesiod_ssh\.\w+/%C$')
+            self.assertEqual(c[6:9], ["-T", "==", "rsync"])
+        # The control directory should be cleaned up on exit
+        self.assertFalse(os.path.exists(os.path.dirname(ssh_calls[0][3][len("ControlPath="):])))
+
+        # Now without the pool
+        os.remove(f"{self.run_path}/pipeline/sync.done")
+        self.environment['SSH_POOL'] = 'no'
+        self.bm_rundriver()
+
+        ssh_calls = self.bm.last_calls['ssh']
+        self.assertEqual(len(ssh_calls), 3)
+        for c in ssh_calls:
+            self.assertEqual(c[:3], ["-T", "==", "rsync"])
+
     def test_log_bug(self):
         """I had a bug where if there were multiple new upstream runs the logs would both go to the
            first of them. Not good.
@@ -341,7 +512,7 @@ class T(TestDriverBase):
             self.bm.last_calls['rt_runticket_manager.py'][i][-1] = re.sub( r'@\S+$', '@???', c[-1] )
 
         expected_calls = self.bm.empty_calls()
-        expected_calls['scan_cells.py'] = [[ "-m",
+        expected_calls['scan_cells.py'] = [[ "-m", "--index", "sc_data.index.json",
                                              "-r",
                                                 "a test lib/20000101_0000_1-A1-A1_PAD00000_aaaaaaaa",
                                                 "a test lib/20000101_0000_2-B1-B1_PAD00000_bbbbbbbb",
@@ -376,7 +547,7 @@ class T(TestDriverBase):
             self.bm.last_calls['rt_runticket_manager.py'][i][-1] = re.sub( r'@\S+$', '@???', c[-1] )
 
         expected_calls = self.bm.empty_calls()
-        expected_calls['scan_cells.py'] = [[ "-m",
+        expected_calls['scan_cells.py'] = [[ "-m", "--index", "sc_data.index.json",
                                              "-r",
                                                 "a test lib/20000101_0000_1-A1-A1_PAD00000_aaaaaaaa",
                                              "-c",
@@ -421,7 +592,7 @@ class T(TestDriverBase):
             rtcalls[i][-1] = re.sub( r'@\S+$', '@???', rtcalls[i][-1] )
 
         expected_calls = self.bm.empty_calls()
-        expected_calls['scan_cells.py'] = [[ "-m",
+        expected_calls['scan_cells.py'] = [[ "-m", "--index", "sc_data.index.json",
                                              "-r",
                                                 "a test lib/20000101_0000_1-A1-A1_PAD00000_aaaaaaaa",
                                                 "a test lib/20000101_0000_2-B1-B1_PAD00000_bbbbbbbb",
@@ -474,7 +645,7 @@ class T(TestDriverBase):
             rtcalls[i][-1] = re.sub( r'@\S+$', '@???', rtcalls[i][-1] )
 
         expected_calls = self.bm.empty_calls()
-        expected_calls['scan_cells.py'] = [[ "-m",
+        expected_calls['scan_cells.py'] = [[ "-m", "--index", "sc_data.index.json",
                                              "-r",
                                                 "a test lib/20000101_0000_1-A1-A1_PAD00000_aaaaaaaa",
                                                 "a test lib/20000101_0000_2-B1-B1_PAD00000_bbbbbbbb",
@@ -528,7 +699,7 @@ class T(TestDriverBase):
             rtcalls[i][-1] = re.sub( r'@\S+$', '@???', rtcalls[i][-1] )
 
         expected_calls = self.bm.empty_calls()
-        expected_calls['scan_cells.py'] = [[ "-m",
+        expected_calls['scan_cells.py'] = [[ "-m", "--index", "sc_data.index.json",
                                              "-r",
                                                 "a test lib/20000101_0000_1-A1-A1_PAD00000_aaaaaaaa",
                                              "-c",
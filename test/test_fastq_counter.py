@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+"""Test the FASTQ read/base counter against the original AWK version"""
+
+import sys, os, re
+import unittest
+import logging
+from io import BytesIO
+from subprocess import run, PIPE
+
+DATA_DIR = os.path.abspath(os.path.dirname(__file__) + '/examples')
+BIN_DIR = os.path.abspath(os.path.dirname(__file__) + '/..')
+VERBOSE = os.environ.get('VERBOSE', '0') != '0'
+
+from hesiod.FastqCounter import ( FastqCounter, count_fastq, length_bin, merge_hists,
+                                   hist_n50, hist_quantile )
+from fq_base_combiner import combine_counts
+
+FQ1 = ( "@read1\nACGTNNACGT\n+\n##########\n"
+        "@read2\nACG\n+\n###\n" )
+FQ2 = ( "@read3\nNNNNnnnnAC\n+\n##########\n"
+        "@read4\nACGTACGTACGTAC\n+\n##############\n" )
+
+class T(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        #Prevent the logger from printing messages - I like my tests to look pretty.
+        if VERBOSE:
+            logging.getLogger().setLevel(logging.DEBUG)
+        else:
+            logging.getLogger().setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        # See the errors in all their glory
+        self.maxDiff = None
+
+    def awk_count(self, content, fn):
+        """Get the answer from the original awk script for comparison
+        """
+        p = run( [ "awk", "-f", os.path.join(BIN_DIR, "fq_base_counter.awk"), "-v", f"fn={fn}" ],
+                 input = content, stdout = PIPE, universal_newlines = True, check = True )
+        return p.stdout
+
+    def py_count(self, content, chunk_size, hists=False):
+        """Get the answer from the Python version. The awk version doesn't make the
+           histograms so normally strip these off.
+        """
+        counter = count_fastq(BytesIO(content.encode()), block_size=chunk_size)
+        res = counter.format("foo.fastq")
+        if not hists:
+            res = "".join(res.splitlines(keepends=True)[:5])
+        return res
+
+    ### THE TESTS ###
+    def test_empty(self):
+        self.assertEqual(self.py_count("", 10, hists=True), "filename:    foo.fastq\n"
+                                                            "total_reads: 0\n"
+                                                            "read_length: 0-0\n"
+                                                            "total_bases: 0\n"
+                                                            "non_n_bases: 0\n"
+                                                            "length_hist: {}\n"
+                                                            "meanq_hist: {}\n" )
+
+    def test_chunking(self):
+        """The counter should give the same result regardless of chunking
+        """
+        for chunk_size in [1, 3, 7, 11, 1000]:
+            self.assertEqual( self.py_count(FQ1 + FQ2, chunk_size),
+                              self.awk_count(FQ1 + FQ2, "foo.fastq") )
+
+        c = count_fastq(BytesIO((FQ1 + FQ2).encode()))
+        self.assertEqual(c.total_reads(), "4")
+        self.assertEqual(c.non_n_bases, 31)
+
+    def test_broken(self):
+        """A file with a missing final newline, and one with missing lines
+        """
+        for fq in [FQ1.rstrip("\n"), FQ1 + "@read3\nAAAA\n"]:
+            for chunk_size in [5, 1000]:
+                self.assertEqual(self.py_count(fq, chunk_size), self.awk_count(fq, "foo.fastq"))
+
+    def test_zero_length(self):
+        """The awk version has a quirk where a zero-length read resets min_len
+        """
+        z = "@z\n\n+\n\n"
+        for fq in [ FQ2 + z + FQ1,
+                    FQ1 + z,
+                    z + FQ2,
+                    FQ2 + z + z + FQ1 + FQ2 ]:
+            for chunk_size in [1, 13, 1000]:
+                self.assertEqual(self.py_count(fq, chunk_size), self.awk_count(fq, "foo.fastq"))
+
+    def test_hists(self):
+        """Check the histograms come out as expected
+        """
+        # '#' is Q2, '+' is Q10, '5' is Q20
+        fq = ( "@r1\nACGTA\n+\n#####\n"
+               "@r2\nACGTACGTACGTACGTACGT\n+\n+++++55555+++++55555\n"
+               "@r3\nACGTACGTACGTACGTACGTA\n+\n555555555555555555555\n" )
+
+        for chunk_size in [1, 7, 1000]:
+            self.assertEqual( self.py_count(fq, chunk_size, hists=True).splitlines()[5:],
+                              [ "length_hist: {5: [1, 5], 20: [2, 41]}",
+                                "meanq_hist: {2: 1, 15: 1, 20: 1}" ] )
+
+        # And the long quality lines need to be added up correctly
+        c = count_fastq(BytesIO( b"@long\n" + b"A" * 100000 + b"\n+\n" +
+                                 b"~" * 50000 + b"!" * 50000 + b"\n" ))
+        self.assertEqual(c.meanq_hist, {46: 1})
+
+    def test_length_bin(self):
+        self.assertEqual([ length_bin(n) for n in [0, 1, 15, 16, 17, 18, 31, 32, 34, 1000, 1023] ],
+                         [ 0, 1, 15, 16, 16, 18, 30, 32, 32, 960, 960 ])
+
+    def test_hist_stats(self):
+        """N50 and quantiles from the histograms
+        """
+        lh = merge_hists([ {100: [10, 1000]},
+                           {100: [10, 1000], 1000: [1, 1000]},
+                           {4096: [2, 9000]} ])
+        self.assertEqual(lh, {100: [20, 2000], 1000: [1, 1000], 4096: [2, 9000]})
+
+        self.assertEqual(hist_n50(lh), 4500)
+        self.assertEqual(hist_quantile(lh, 0.5), 100)
+        self.assertEqual(hist_quantile(lh, 0.99), 4500)
+
+        self.assertEqual(hist_quantile(merge_hists([{10: 3, 12: 1}, {12: 3}]), 0.5), 12)
+        self.assertEqual(hist_n50({}), 0)
+        self.assertEqual(hist_quantile({}, 0.5), 0)
+
+    def test_combiner(self):
+        """fq_base_combiner.py adds up .count files
+        """
+        c1 = dict( total_reads = 2, read_length = "3-10", total_bases = 13, non_n_bases = 11,
+                   length_hist = {3: [1, 3], 10: [1, 10]}, meanq_hist = {2: 2} )
+        c2 = dict( total_reads = 2, read_length = "10-14", total_bases = 24, non_n_bases = 20,
+                   length_hist = {10: [1, 10], 14: [1, 14]}, meanq_hist = {2: 2} )
+
+        self.assertEqual( combine_counts([c1, c2], fn="foo.fastq"),
+                          self.py_count(FQ1 + FQ2, 1000, hists=True) )
+
+        # Without the histograms
+        c3 = dict( total_reads = 0, read_length = "0-0", total_bases = 0, non_n_bases = 0 )
+        self.assertEqual( combine_counts([c1, c2, c3]),
+                          "filename:    unknown\n"
+                          "total_reads: 4\n"
+                          "read_length: 3-14\n"
+                          "total_bases: 37\n"
+                          "non_n_bases: 31\n" )
+
+if __name__ == '__main__':
+    unittest.main()
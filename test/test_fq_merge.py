@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+
+"""Test the single-pass FASTQ merger"""
+
+import sys, os, re
+import unittest
+import logging
+import gzip, hashlib
+from tempfile import mkdtemp
+from shutil import rmtree
+from subprocess import run, PIPE
+from unittest.mock import patch
+
+DATA_DIR = os.path.abspath(os.path.dirname(__file__) + '/examples')
+VERBOSE = os.environ.get('VERBOSE', '0') != '0'
+
+import fq_merge
+from fq_merge import main as fq_merge_main, parse_args
+from hesiod.FastqCache import FastqCache
+from hesiod.Bgzf import load_gzi, BGZF_EOF
+
+# pigz may not be installed, but gzip -n gives the same style of output
+GZIP = "gzip -n"
+
+FQ1 = ( "@read1\nACGTNNACGT\n+\n##########\n"
+        "@read2\nACG\n+\n###\n" )
+FQ2 = ( "@read3\nNNNNnnnnAC\n+\n##########\n"
+        "@read4\nACGTACGTACGTAC\n+\n##############\n" )
+
+class T(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        #Prevent the logger from printing messages - I like my tests to look pretty.
+        if VERBOSE:
+            logging.getLogger().setLevel(logging.DEBUG)
+        else:
+            logging.getLogger().setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        # See the errors in all their glory
+        self.maxDiff = None
+
+        self.temp_dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def write_file(self, name, content):
+        """Write some content to the temp dir and return the full path
+        """
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'wb' if type(content) is bytes else 'w') as fh:
+            fh.write(content)
+        return path
+
+    def run_merge(self, fastq=(), fastq_gz=(), out="out.fastq.gz", extra_args=()):
+        """Run fq_merge.main() on the given files and return the contents of the outputs
+        """
+        fofn = self.write_file("fastq.list", "".join(f"{f}\n" for f in fastq))
+        fofn_gz = self.write_file("fastq.gz.list", "".join(f"{f}\n" for f in fastq_gz))
+
+        out = os.path.join(self.temp_dir, out)
+        # Stop main() from turning the logging back on
+        with patch('logging.basicConfig'):
+            fq_merge_main(parse_args([ "-z", GZIP,
+                                       "--fofn", fofn,
+                                       "--fofn_gz", fofn_gz,
+                                       "-o", out,
+                                       "--counts", out + ".count",
+                                       "--md5", out + ".md5",
+                                       *extra_args ]))
+
+        with open(out, 'rb') as fh:
+            gz = fh.read()
+        with open(out + ".count") as fh:
+            counts = fh.read()
+        with open(out + ".md5") as fh:
+            md5 = fh.read()
+
+        return gz, counts, md5
+
+    ### THE TESTS ###
+    def test_empty(self):
+        """No input at all still gives a valid gzip file
+        """
+        gz, counts, md5 = self.run_merge()
+
+        self.assertEqual(gzip.decompress(gz), b'')
+        self.assertEqual(counts, "filename:    out.fastq\n"
+                                 "total_reads: 0\n"
+                                 "read_length: 0-0\n"
+                                 "total_bases: 0\n"
+                                 "non_n_bases: 0\n"
+                                 "length_hist: {}\n"
+                                 "meanq_hist: {}\n" )
+        self.assertEqual(md5, f"{hashlib.md5(gz).hexdigest()}  out.fastq.gz\n")
+
+    def test_merge_plain(self):
+        """Merging plain files should be the same as cat | gzip
+        """
+        fq1 = self.write_file("1.fastq", FQ1)
+        fq2 = self.write_file("2.fastq", FQ2)
+
+        gz, counts, md5 = self.run_merge(fastq=[fq1, fq2])
+
+        expected_gz = run( GZIP.split() + ["-c"], input = (FQ1 + FQ2).encode(),
+                           stdout = PIPE, check = True ).stdout
+        self.assertEqual(gz, expected_gz)
+        self.assertEqual(counts, "filename:    out.fastq\n"
+                                 "total_reads: 4\n"
+                                 "read_length: 3-14\n"
+                                 "total_bases: 37\n"
+                                 "non_n_bases: 31\n"
+                                 "length_hist: {3: [1, 3], 10: [2, 20], 14: [1, 14]}\n"
+                                 "meanq_hist: {2: 4}\n" )
+
+        # Compare with the real md5sum
+        p = run( ["md5sum", "out.fastq.gz"], cwd = self.temp_dir,
+                 stdout = PIPE, universal_newlines = True, check = True )
+        self.assertEqual(md5, p.stdout)
+
+    def test_merge_mixed(self):
+        """Plain files are compressed first, then gzipped files are appended as-is.
+           A multi-member gzip file should be counted in full.
+        """
+        fq1 = self.write_file("1.fastq", FQ1)
+        fq2 = self.write_file("2.fastq.gz", gzip.compress(FQ2[:30].encode()) +
+                                            gzip.compress(FQ2[30:].encode()))
+        fq3 = self.write_file("3.fastq.gz", b'')
+
+        gz, counts, md5 = self.run_merge(fastq=[fq1], fastq_gz=[fq2, fq3])
+
+        with open(fq2, 'rb') as fh:
+            self.assertTrue(gz.endswith(fh.read()))
+        self.assertEqual(gzip.decompress(gz).decode(), FQ1 + FQ2)
+        self.assertEqual(counts.split("\n")[1:3], ["total_reads: 4", "read_length: 3-14"])
+        self.assertEqual(md5, f"{hashlib.md5(gz).hexdigest()}  out.fastq.gz\n")
+
+    def test_bad_gz(self):
+        """Corrupt or truncated inputs must be caught
+        """
+        good_gz = gzip.compress(FQ1.encode())
+
+        bad_crc = bytearray(good_gz)
+        bad_crc[-8] ^= 0xff
+        fq1 = self.write_file("1.fastq.gz", bytes(bad_crc))
+
+        with self.assertRaisesRegex(RuntimeError, r"1\.fastq\.gz"):
+            self.run_merge(fastq_gz=[fq1])
+
+        fq2 = self.write_file("2.fastq.gz", good_gz[:-10])
+        with self.assertRaisesRegex(RuntimeError, r"2\.fastq\.gz: file is truncated"):
+            self.run_merge(fastq_gz=[fq2])
+
+    def test_precompressed(self):
+        """Files in the cache are appended as they are, and the result should decompress
+           to the same thing with the same counts. Stale cache entries must be ignored.
+        """
+        os.mkdir(os.path.join(self.temp_dir, "fastq_pass"))
+        fq1 = self.write_file("fastq_pass/1.fastq", FQ1)
+        fq2 = self.write_file("fastq_pass/2.fastq", FQ2)
+        fq3 = self.write_file("fastq_pass/3.fastq", FQ1)
+        fq4 = self.write_file("fastq_pass/4.fastq.gz", gzip.compress(FQ2.encode()))
+
+        gz, counts, md5 = self.run_merge(fastq=[fq1, fq2, fq3], fastq_gz=[fq4])
+
+        cache = FastqCache(self.temp_dir, GZIP.split())
+        for f in [fq1, fq3, fq4]:
+            self.assertTrue(cache.store(f))
+        cached_gz = [ os.path.join(self.temp_dir, "pipeline/precompressed/fastq_pass", f)
+                      for f in ["1.fastq.gz", "3.fastq.gz"] ]
+
+        gz2, counts2, md5_2 = self.run_merge( fastq=[fq1, fq2, fq3], fastq_gz=[fq4],
+                                              extra_args=["--precompressed", self.temp_dir] )
+        self.assertEqual(gzip.decompress(gz2), gzip.decompress(gz))
+        self.assertEqual(counts2, counts)
+        self.assertEqual(md5_2, f"{hashlib.md5(gz2).hexdigest()}  out.fastq.gz\n")
+        with open(cached_gz[0], 'rb') as fh:
+            self.assertTrue(gz2.startswith(fh.read()))
+
+        # If a file changes the cached copy must not be used
+        self.write_file("fastq_pass/3.fastq", FQ2)
+        self.assertIsNone(cache.lookup(fq3))
+        gz3, counts3, _ = self.run_merge( fastq=[fq1, fq2, fq3], fastq_gz=[fq4],
+                                          extra_args=["--precompressed", self.temp_dir] )
+        self.assertEqual(gzip.decompress(gz3).decode(), FQ1 + FQ2 + FQ2 + FQ2)
+
+        # A file that is not whole FASTQ records can't be cached
+        fq5 = self.write_file("fastq_pass/5.fastq", FQ1[:20])
+        self.assertFalse(cache.store(fq5))
+        self.assertIsNone(cache.lookup(fq5))
+
+    def run_shards(self, fastq, fastq_gz, nshards, extra_args=()):
+        """Merge the files in shards, then put the shards together
+        """
+        fofn = self.write_file("fastq.list", "".join(f"{f}\n" for f in fastq))
+        fofn_gz = self.write_file("fastq.gz.list", "".join(f"{f}\n" for f in fastq_gz))
+        shards = [ os.path.join(self.temp_dir, f"shard{n}.gz") for n in range(nshards) ]
+
+        with patch('logging.basicConfig'):
+            for n, shard in enumerate(shards):
+                fq_merge_main(parse_args([ "-z", GZIP, "--fofn", fofn, "--fofn_gz", fofn_gz,
+                                           "--shard", f"{n}/{nshards}", "-o", shard,
+                                           *extra_args ]))
+            out = os.path.join(self.temp_dir, "sharded.fastq.gz")
+            fq_merge_main(parse_args([ "--from_shards", *shards, "-o", out,
+                                       "--counts", out + ".count", "--md5", out + ".md5",
+                                       *extra_args ]))
+
+        with open(out, 'rb') as fh:
+            gz = fh.read()
+        with open(out + ".count") as fh:
+            counts = fh.read()
+        return gz, counts
+
+    def test_shards(self):
+        """Merging in shards should give the same FASTQ and counts as merging in one go,
+           even if there are more shards than files or a file is cut short.
+        """
+        fqs = [ self.write_file(f"{n}.fastq", FQ1 if n % 2 else FQ2) for n in range(5) ]
+        fq_gz = self.write_file("5.fastq.gz", gzip.compress(FQ1.encode()))
+
+        gz, counts, md5 = self.run_merge(fastq=fqs, fastq_gz=[fq_gz])
+
+        for nshards in [1, 3, 10]:
+            gz2, counts2 = self.run_shards(fqs, [fq_gz], nshards)
+            self.assertEqual(gzip.decompress(gz2), gzip.decompress(gz))
+            self.assertEqual(counts2.replace("sharded.fastq", "out.fastq"), counts)
+
+        # Now with a broken record in the middle
+        fqs[2] = self.write_file("2.fastq", FQ1[:-5])
+        gz, counts, md5 = self.run_merge(fastq=fqs, fastq_gz=[fq_gz])
+        gz2, counts2 = self.run_shards(fqs, [fq_gz], 5)
+        self.assertEqual(gzip.decompress(gz2), gzip.decompress(gz))
+        self.assertEqual(counts2.replace("sharded.fastq", "out.fastq"), counts)
+
+    def test_resume(self):
+        """If the merge is killed part way through, running it again with --resume should
+           carry on from the last checkpoint and give the right output, counts and MD5.
+        """
+        fqs = [ self.write_file(f"{n}.fastq", FQ1 if n % 2 else FQ2) for n in range(6) ]
+        fq_gz = self.write_file("6.fastq.gz", gzip.compress(FQ1.encode()))
+        gz, counts, md5 = self.run_merge(fastq=fqs, fastq_gz=[fq_gz])
+        out = os.path.join(self.temp_dir, "out.fastq.gz")
+        os.unlink(out)
+
+        # With --checkpoint_size 1 every file is compressed separately. Fail on the fourth,
+        # leaving some junk in the output as a killed job might.
+        real_compress_fastq = fq_merge.compress_fastq
+        def killed_compress_fastq(files, out_fh, *args):
+            if files == [fqs[3]]:
+                out_fh.write(b"junk")
+                raise RuntimeError("Killed")
+            return real_compress_fastq(files, out_fh, *args)
+
+        resume_args = ["--resume", "--checkpoint_size", "1"]
+        with patch('fq_merge.compress_fastq', side_effect=killed_compress_fastq):
+            with self.assertRaisesRegex(RuntimeError, "Killed"):
+                self.run_merge(fastq=fqs, fastq_gz=[fq_gz], extra_args=resume_args)
+
+        self.assertFalse(os.path.exists(out))
+        self.assertTrue(os.path.exists(out + ".partial"))
+        self.assertTrue(os.path.exists(out + ".journal"))
+
+        # Now resume, and only the last three files should need compressing
+        compressed = []
+        def logged_compress_fastq(files, *args):
+            compressed.append(list(files))
+            return real_compress_fastq(files, *args)
+        with patch('fq_merge.compress_fastq', side_effect=logged_compress_fastq):
+            gz2, counts2, md5_2 = self.run_merge(fastq=fqs, fastq_gz=[fq_gz], extra_args=resume_args)
+        self.assertEqual(compressed, [ [f] for f in fqs[3:] ])
+
+        # The output is split into gzip members at the checkpoints, so it is not
+        # byte-identical to a merge done in one go, but the content is the same.
+        self.assertNotEqual(gz2, gz)
+        self.assertEqual(gzip.decompress(gz2), gzip.decompress(gz))
+        self.assertEqual(counts2, counts)
+        self.assertEqual(md5_2, f"{hashlib.md5(gz2).hexdigest()}  out.fastq.gz\n")
+        self.assertFalse(os.path.exists(out + ".partial"))
+        self.assertFalse(os.path.exists(out + ".journal"))
+
+        # If the inputs change, the journal must not be used
+        with patch('fq_merge.compress_fastq', side_effect=killed_compress_fastq):
+            with self.assertRaisesRegex(RuntimeError, "Killed"):
+                self.run_merge(fastq=fqs, fastq_gz=[fq_gz], extra_args=resume_args)
+        self.write_file("0.fastq", FQ1)
+        gz3, counts3, _ = self.run_merge(fastq=fqs, fastq_gz=[fq_gz], extra_args=resume_args)
+        self.assertEqual(gzip.decompress(gz3).decode(), FQ1 * 2 + FQ2 + FQ1 + FQ2 + FQ1 + FQ1)
+
+    def test_gz_parallel(self):
+        """Checking several .fastq.gz files at once must give the same output as one at a
+           time, and still catch a bad file.
+        """
+        fqs = [ FQ1, FQ2, FQ1[:-5], FQ1 + FQ2, FQ2, "" ]
+        fq_gzs = [ self.write_file(f"{n}.fastq.gz", gzip.compress(fq[:7].encode()) +
+                                                    gzip.compress(fq[7:].encode()))
+                   for n, fq in enumerate(fqs) ]
+
+        results = []
+        for jobs in [1, 3]:
+            with open(os.path.join(self.temp_dir, f"out{jobs}.fastq.gz"), "w+b") as out_fh:
+                counter, md5 = fq_merge.merge_fastq( [], fq_gzs, out_fh, compressor=GZIP.split(),
+                                                     gz_jobs=jobs )
+                out_fh.flush()
+                self.assertEqual(out_fh.tell(), os.fstat(out_fh.fileno()).st_size)
+                out_fh.seek(0)
+                gz = out_fh.read()
+            self.assertEqual(md5.hexdigest(), hashlib.md5(gz).hexdigest())
+            results.append((gz, counter.format()))
+
+        self.assertEqual(results[1], results[0])
+        self.assertEqual(gzip.decompress(results[0][0]).decode(), "".join(fqs))
+
+        # Now break the CRC of one file
+        with open(fq_gzs[3], 'r+b') as fh:
+            fh.seek(-8, os.SEEK_END)
+            fh.write(b"XXXX")
+        with open(os.path.join(self.temp_dir, "out.fastq.gz"), "w+b") as out_fh:
+            with self.assertRaisesRegex(RuntimeError, r"3\.fastq\.gz"):
+                fq_merge.merge_fastq([], fq_gzs, out_fh, compressor=GZIP.split(), gz_jobs=3)
+
+    def check_bgzf(self, gz, gzi_file, fq):
+        """Check that gz is valid BGZF holding the data in fq, and the index is right.
+        """
+        self.assertEqual(gzip.decompress(gz), fq)
+        self.assertTrue(gz.endswith(BGZF_EOF))
+
+        # Walk the blocks using the sizes in the headers
+        blocks = []
+        pos = upos = 0
+        while pos < len(gz):
+            self.assertEqual(gz[pos:pos+4], b"\x1f\x8b\x08\x04")
+            self.assertEqual(gz[pos+12:pos+16], b"BC\x02\x00")
+            bsize = int.from_bytes(gz[pos+16:pos+18], 'little') + 1
+            pos += bsize
+            upos += int.from_bytes(gz[pos-4:pos], 'little')
+            blocks.append((pos, upos))
+        self.assertEqual(pos, len(gz))
+
+        # The index has all the blocks but the EOF
+        with open(gzi_file, "rb") as fh:
+            index = load_gzi(fh)
+        self.assertEqual(index, blocks[:-1])
+
+        # And we can start decompressing at any indexed point
+        for coffset, uoffset in index:
+            self.assertEqual(gzip.decompress(gz[coffset:]), fq[uoffset:])
+
+    def test_bgzf(self):
+        """With --bgzf the output should be BGZF with an index, and the counts the same,
+           however many threads and shards there are.
+        """
+        # Enough reads to fill several blocks
+        fq_big = "".join( f"@read{n}\n{'ACGTN'[n % 5] * (n % 997)}\n+\n{'#' * (n % 997)}\n"
+                          for n in range(500) )
+        fqs = [ self.write_file("0.fastq", fq_big),
+                self.write_file("1.fastq", FQ1) ]
+        fq_gz = self.write_file("2.fastq.gz", gzip.compress(FQ2.encode()) + gzip.compress(FQ1.encode()))
+        fq_all = (fq_big + FQ1 + FQ2 + FQ1).encode()
+
+        gz, counts, md5 = self.run_merge(fastq=fqs, fastq_gz=[fq_gz])
+
+        out = os.path.join(self.temp_dir, "out.fastq.gz")
+        bgzf_outputs = []
+        for threads in ["1", "4"]:
+            gz2, counts2, md52 = self.run_merge( fastq=fqs, fastq_gz=[fq_gz],
+                                                 extra_args=["--bgzf", "-p", threads] )
+            self.check_bgzf(gz2, out + ".gzi", fq_all)
+            self.assertEqual(counts2, counts)
+            self.assertEqual(md52.split()[0], hashlib.md5(gz2).hexdigest())
+            bgzf_outputs.append(gz2)
+
+        # The number of threads makes no difference to the output
+        self.assertEqual(bgzf_outputs[1], bgzf_outputs[0])
+
+        gz3, counts3 = self.run_shards(fqs, [fq_gz], 3, extra_args=["--bgzf"])
+        self.check_bgzf(gz3, os.path.join(self.temp_dir, "sharded.fastq.gz.gzi"), fq_all)
+        self.assertEqual(counts3.replace("sharded.fastq", "out.fastq"), counts)
+
+        # An empty file is just the EOF block
+        gz4, counts4, md54 = self.run_merge(extra_args=["--bgzf"])
+        self.assertEqual(gz4, BGZF_EOF)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+"""Test the FASTQ pre-compressor"""
+
+import sys, os, re
+import shlex
+import unittest
+import logging
+import gzip
+from tempfile import mkdtemp
+from shutil import rmtree
+from unittest.mock import patch
+
+VERBOSE = os.environ.get('VERBOSE', '0') != '0'
+
+from fq_precompress import main as fq_precompress_main, parse_args
+from hesiod.FastqCache import FastqCache
+
+# pigz may not be installed, but gzip -n gives the same style of output
+GZIP = "gzip -n"
+
+FQ1 = "@read1\nACGTNNACGT\n+\n##########\n"
+
+class T(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        #Prevent the logger from printing messages - I like my tests to look pretty.
+        if VERBOSE:
+            logging.getLogger().setLevel(logging.DEBUG)
+        else:
+            logging.getLogger().setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        # See the errors in all their glory
+        self.maxDiff = None
+
+        self.temp_dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def write_file(self, name, content, age=1000):
+        """Write some content to the temp dir, with the mtime set age seconds ago
+        """
+        path = os.path.join(self.temp_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb' if type(content) is bytes else 'w') as fh:
+            fh.write(content)
+        mtime = os.stat(path).st_mtime - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def run_precompress(self, *args):
+        # Stop main() from turning the logging back on
+        with patch('logging.basicConfig'):
+            fq_precompress_main(parse_args(["-z", GZIP, self.temp_dir, *args]))
+
+    ### THE TESTS ###
+    def test_precompress(self):
+        """Only settled FASTQ files in the fastq_* directories get cached
+        """
+        cell = "lib/20000101_0000_1-A1-A1_PAD00000_aaaaaaaa"
+        settled = [ self.write_file(f"{cell}/fastq_pass/a.fastq", FQ1),
+                    self.write_file(f"{cell}/fastq_fail/barcode01/b.fastq.gz",
+                                    gzip.compress(FQ1.encode())) ]
+        unsettled = [ self.write_file(f"{cell}/fastq_pass/c.fastq", FQ1, age=0),
+                      self.write_file(f"{cell}/pod5_pass/d.fastq", FQ1) ]
+
+        self.run_precompress("--min_age", "300", cell, "lib/missing_cell")
+
+        cache = FastqCache(self.temp_dir, GZIP.split())
+        for f in settled:
+            gz_file, counter = cache.lookup(f)
+            self.assertEqual(counter.total_reads(), "1")
+            with open(gz_file, 'rb') as fh:
+                self.assertEqual(gzip.decompress(fh.read()).decode(), FQ1)
+        for f in unsettled:
+            self.assertIsNone(cache.lookup(f))
+
+        # With no minimum age the new file gets done
+        self.run_precompress("--min_age", "0", cell)
+        self.assertIsNotNone(cache.lookup(unsettled[0]))
+        self.assertIsNone(cache.lookup(unsettled[1]))
+
+    def test_compressor_key(self):
+        """An entry made with another compressor is not used, but the thread count
+           does not matter
+        """
+        cell = "lib/20000101_0000_1-A1-A1_PAD00000_aaaaaaaa"
+        fq = self.write_file(f"{cell}/fastq_pass/a.fastq", FQ1)
+
+        self.run_precompress(cell)
+
+        self.assertIsNotNone(FastqCache(self.temp_dir, GZIP.split()).lookup(fq))
+        self.assertIsNotNone(FastqCache(self.temp_dir, [*GZIP.split(), "-p4"]).lookup(fq))
+        self.assertIsNone(FastqCache(self.temp_dir, ["gzip", "-n", "-1"]).lookup(fq))
+        self.assertIsNone(FastqCache(self.temp_dir).lookup(fq))
+
+        # Re-running with a new compressor replaces the entry
+        with patch('logging.basicConfig'):
+            fq_precompress_main(parse_args(["-z", "gzip -n -1", self.temp_dir, cell]))
+        self.assertIsNotNone(FastqCache(self.temp_dir, ["gzip", "-n", "-1"]).lookup(fq))
+        self.assertIsNone(FastqCache(self.temp_dir, GZIP.split()).lookup(fq))
+
+    def test_time_limit(self):
+        """No new file is started once the time limit is reached
+        """
+        cell = "lib/20000101_0000_1-A1-A1_PAD00000_aaaaaaaa"
+        fqs = [ self.write_file(f"{cell}/fastq_pass/{n}.fastq", FQ1) for n in "abc" ]
+
+        # A slow compressor, so the first file takes longer than the limit
+        slow_gzip = "sh -c 'sleep 1.2 ; exec gzip -n'"
+        def run_slow():
+            with patch('logging.basicConfig'):
+                fq_precompress_main(parse_args(["-z", slow_gzip, "-t", "1",
+                                                self.temp_dir, cell]))
+
+        run_slow()
+        cache = FastqCache(self.temp_dir, shlex.split(slow_gzip))
+        self.assertEqual([ bool(cache.lookup(f)) for f in fqs ], [True, False, False])
+
+        # The next runs pick up the rest
+        run_slow()
+        run_slow()
+        self.assertEqual([ bool(cache.lookup(f)) for f in fqs ], [True, True, True])
+
+if __name__ == '__main__':
+    unittest.main()
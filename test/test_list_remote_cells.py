@@ -84,6 +84,32 @@ class T(unittest.TestCase):
                                                        "testlib/20190226_1723_2-A5-D5_PAD38578_c6ded78b\n" ])
 
 
+    def test_missing_upstream(self):
+        """If the upstream location can't be listed the exit status should be non-zero,
+           but an upstream with no cells in it is fine.
+        """
+        bm = self.bm
+        self.environment['UPSTREAM_NAME'] = 'TEST'
+
+        self.environment['UPSTREAM_LOC'] = EXAMPLES + '/no_such_upstream'
+        retval = bm.runscript(SCRIPT, env=self.environment)
+        self.assertNotEqual(retval, 0)
+        self.assertEqual(bm.last_stdout, '')
+        self.assertIn("Failed to list the cells", bm.last_stderr)
+
+        # Likewise if ssh can't connect, or the cd fails on the remote side
+        for ssh_status in ['255', '1']:
+            bm.add_mock('ssh', side_effect=f"exit {ssh_status}")
+            self.environment['UPSTREAM_LOC'] = 'foo@bar.example.com:whatever'
+            retval = bm.runscript(SCRIPT, env=self.environment)
+            self.assertEqual(retval, int(ssh_status))
+            self.assertEqual(bm.last_stdout, '')
+
+        self.environment['UPSTREAM_LOC'] = EXAMPLES + '/empty'
+        retval = bm.runscript(SCRIPT, env=self.environment)
+        self.assertEqual(retval, 0)
+        self.assertEqual(bm.last_stdout, '')
+
     def test_ssh(self):
         """With a ':' in the UPSTREAM_LOC, ssh should be invoked
         """
@@ -101,5 +127,82 @@ class T(unittest.TestCase):
         self.assertEqual( bm.last_calls['ssh'][0][:7],
                           ["-o", "ConnectTimeout=5", "-T", "foo@bar.example.com", "cd", "whatever", "&&"] )
 
+    def test_ssh_pool(self):
+        """The SSH_POOL_OPTS set by the driver should be passed to ssh
+        """
+        bm = self.bm
+        self.environment['UPSTREAM_LOC'] = 'foo@bar.example.com:whatever'
+        self.environment['UPSTREAM_NAME'] = 'TEST'
+        self.environment['SSH_POOL_OPTS'] = '-o ControlMaster=auto -o ControlPath=/tmp/pool/%C'
+
+        retval = bm.runscript(SCRIPT, env=self.environment)
+
+        self.assertEqual(retval, 0)
+        self.assertEqual( bm.last_calls['ssh'][0][:7],
+                          ["-o", "ControlMaster=auto", "-o", "ControlPath=/tmp/pool/%C",
+                           "-o", "ConnectTimeout=5", "-T"] )
+
+    def test_cache(self):
+        """With UPSTREAM_CACHE set, only libraries and cells changed recently are re-listed,
+           and the saved listing is used if the upstream is missing.
+        """
+        bm = self.bm
+        tmp_dir = mkdtemp()
+        self.addCleanup(rmtree, tmp_dir)
+        upstream = os.path.join(tmp_dir, "upstream")
+        copytree(EXAMPLES + '/upstream2', upstream, symlinks=True)
+        os.mkdir(os.path.join(tmp_dir, "cache"))
+
+        self.environment['UPSTREAM_LOC'] = upstream
+        self.environment['UPSTREAM_NAME'] = 'TEST'
+        self.environment['UPSTREAM_CACHE'] = os.path.join(tmp_dir, "cache")
+
+        def cells():
+            return [ l.split('\t')[2] for l in bm.last_stdout.splitlines() ]
+
+        retval = bm.runscript(SCRIPT, env=self.environment)
+        self.assertEqual(retval, 0)
+        self.assertEqual(len(cells()), 3)
+        self.assertTrue(os.path.exists(os.path.join(tmp_dir, "cache", "TEST.snapshot")))
+
+        # Add a cell to a new library, and one each to two existing libraries which I'll make
+        # look old. The first just looks like other_reports appeared in an existing cell, so
+        # the cell directory is new and that gets picked up. The second I'll make look old
+        # too, so that it's not picked up until the next full listing.
+        new_cell = "new lib/20000101_0000_4-D1-D1_PAD00000_dddddddd"
+        late_cell = "another test/20000101_0000_5-E1-E1_PAD00000_eeeeeeee"
+        old_cell = "a test lib/20000101_0000_6-F1-F1_PAD00000_ffffffff"
+        for c in [new_cell, late_cell, old_cell]:
+            os.makedirs(os.path.join(upstream, "00testrun2", c, "other_reports"))
+        for d in [old_cell, "a test lib", "another test"]:
+            os.utime(os.path.join(upstream, "00testrun2", d), (1e9, 1e9))
+
+        retval = bm.runscript(SCRIPT, env=self.environment)
+        self.assertEqual(retval, 0)
+        self.assertEqual(len(cells()), 5)
+        self.assertIn(new_cell, cells())
+        self.assertIn(late_cell, cells())
+
+        self.environment['UPSTREAM_FULL_LISTING'] = '0'
+        retval = bm.runscript(SCRIPT, env=self.environment)
+        self.assertEqual(retval, 0)
+        self.assertEqual(len(cells()), 6)
+        self.assertIn(old_cell, cells())
+
+        # Now if the upstream goes away we get the saved listing, with status 3
+        rmtree(upstream)
+        retval = bm.runscript(SCRIPT, env=self.environment)
+        self.assertEqual(retval, 3)
+        self.assertEqual(len(cells()), 6)
+        self.assertIn("Using the listing from", bm.last_stderr)
+
+        # But with no saved listing it's just an error
+        rmtree(os.path.join(tmp_dir, "cache"))
+        os.mkdir(os.path.join(tmp_dir, "cache"))
+        retval = bm.runscript(SCRIPT, env=self.environment)
+        self.assertNotIn(retval, [0, 3])
+        self.assertEqual(cells(), [])
+        self.assertEqual(os.listdir(os.path.join(tmp_dir, "cache")), [])
+
 if __name__ == '__main__':
     unittest.main()
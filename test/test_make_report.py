@@ -114,6 +114,40 @@ class T(unittest.TestCase):
                                 | All failed reads | 120\,106 | 123\,147\,574 | 354\,311 |
                              """) )
 
+    def test_format_counts_with_hists(self):
+        """If the .count files have histograms we get some extra columns, which
+           come from adding up the histograms over all cells and barcodes.
+        """
+        def _counts(part, total_reads, length_hist, meanq_hist):
+            return dict( _part = part,
+                         _label = f"All {part}ed reads",
+                         total_reads = total_reads,
+                         total_bases = sum(v[1] for v in length_hist.values()),
+                         max_length = max(length_hist),
+                         length_hist = length_hist,
+                         meanq_hist = meanq_hist )
+
+        cells = [ dict( _counts = [ _counts('pass', 3, {1000: [2, 2000], 8192: [1, 8200]}, {20: 3}),
+                                    _counts('fail', 1, {96: [1, 100]}, {5: 1}) ] ),
+                  dict( _counts = [ _counts('pass', 2, {1000: [2, 2010]}, {18: 1, 20: 1}),
+                                    _counts('fail', 1, {96: [1, 100]}, {6: 1}) ] ) ]
+
+        # load_cell_yaml normally fixes the keys
+        for c in cells:
+            for cd in c['_counts']:
+                cd['_length_hist'] = cd.pop('length_hist')
+                cd['_meanq_hist'] = cd.pop('meanq_hist')
+
+        self.assertEqual( format_counts_per_cells(cells, heading="BAZ"),
+                          dd("""\
+                                ### BAZ
+
+                                | Part | Total Reads | Total Bases | Max Length | N50 | Median Length | Median Mean Q |
+                                |------|-------------|-------------|------------|-----|---------------|---------------|
+                                | All passed reads | 5 | 12\,210 | 8\,192 | 8\,200 | 1\,002 | 20 |
+                                | All failed reads | 2 | 200 | 96 | 100 | 100 | 5 |
+                             """) )
+
     def test_array_slice(self):
         """At present this doesn't test any code. I just want to check my logic.
         """
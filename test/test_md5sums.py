@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+"""Test the parallel md5summer used by Snakefile.checksummer"""
+
+import sys, os, re
+import unittest
+import logging
+import heapq
+from tempfile import mkdtemp
+from shutil import rmtree
+from subprocess import run, PIPE
+
+VERBOSE = os.environ.get('VERBOSE', '0') != '0'
+
+from hesiod import md5sum_line
+from hesiod.Md5Sums import ( md5sum_files, md5_line_key, reuse_md5sums,
+                             load_manifest, save_manifest )
+
+class T(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        #Prevent the logger from printing messages - I like my tests to look pretty.
+        if VERBOSE:
+            logging.getLogger().setLevel(logging.DEBUG)
+        else:
+            logging.getLogger().setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        # See the errors in all their glory
+        self.maxDiff = None
+
+        self.temp_dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    ### THE TESTS ###
+    def test_md5sum_files(self):
+        """The output should be exactly what md5sum gives, in the same order, however
+           many jobs there are and whatever the file names.
+        """
+        files = [ "empty", "sub/small", "sub/weird\\name", "new\nline", "big" ]
+        os.makedirs(os.path.join(self.temp_dir, "sub"))
+        for n, f in enumerate(files):
+            with open(os.path.join(self.temp_dir, f), "wb") as fh:
+                fh.write(os.urandom(n * 1000 if f != "big" else 3000000))
+
+        expected = run( ["md5sum", "--", *files], cwd=self.temp_dir,
+                        stdout=PIPE, universal_newlines=True, check=True ).stdout
+
+        for jobs in [1, 3]:
+            self.assertEqual("".join(md5sum_files(files, self.temp_dir, jobs=jobs)), expected)
+
+        with self.assertRaises(FileNotFoundError):
+            md5sum_files(["missing"], self.temp_dir)
+
+    def test_manifest(self):
+        """The manifest records what we hashed, and lets us skip unchanged files
+        """
+        for f in ["a", "b", "c"]:
+            with open(os.path.join(self.temp_dir, f), "w") as fh:
+                fh.write(f)
+
+        manifest = dict()
+        lines = md5sum_files(["a", "b", "c"], self.temp_dir, jobs=2, manifest=manifest)
+        self.assertEqual(sorted(manifest), ["a", "b", "c"])
+        self.assertEqual(manifest["a"][0], 1)
+        self.assertEqual([ md5sum_line(e[-1], f) for f, e in manifest.items() ], lines)
+
+        # Round trip through the file
+        mfile = os.path.join(self.temp_dir, "manifest.json")
+        save_manifest(manifest, mfile)
+        self.assertEqual(load_manifest(mfile), manifest)
+        self.assertEqual(load_manifest(mfile + ".missing"), {})
+
+        # Change one file, and one has no signature as it could not be stat'ed
+        sigs = { f: e[:-1] for f, e in manifest.items() }
+        sigs["b"] = [sigs["b"][0], sigs["b"][1] + 1, sigs["b"][2]]
+        files = [("a", sigs["a"]), ("b", sigs["b"]), ("c", None), ("d", [0, 0, 0])]
+        to_hash, reused = reuse_md5sums(files, load_manifest(mfile))
+        self.assertEqual(to_hash, files[1:])
+        self.assertEqual(reused, { "a": manifest["a"] })
+
+    def test_merge(self):
+        """Batches sorted by md5_line_key can be merged to give one sorted list
+        """
+        batches = [ [ "x  a/1\n", "x  b\n", "\\x  b\\\\c\n" ],
+                    [ "x  a/0\n", "x  c d\n" ] ]
+        merged = list(heapq.merge(*batches, key=md5_line_key))
+        self.assertEqual(merged, [ "x  a/0\n", "x  a/1\n", "x  b\n", "\\x  b\\\\c\n", "x  c d\n" ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+"""Test the structural pod5 checker"""
+
+import sys, os, re
+import unittest
+import logging
+import gzip
+from tempfile import mkdtemp
+from shutil import rmtree
+from unittest.mock import patch
+
+DATA_DIR = os.path.abspath(os.path.dirname(__file__) + '/examples')
+VERBOSE = os.environ.get('VERBOSE', '0') != '0'
+
+from pod5_check import main as pod5_check_main, parse_args
+from hesiod.Pod5Check import check_pod5
+
+POD5_FILES = [ "PAK00002_fail_barcode07_b7f7032d_0.pod5.gz",
+               "PAS23464_fail_barcode11_c3f8b1dd_5ed8849a_0.pod5.gz" ]
+
+class T(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        #Prevent the logger from printing messages - I like my tests to look pretty.
+        if VERBOSE:
+            logging.getLogger().setLevel(logging.DEBUG)
+        else:
+            logging.getLogger().setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        # See the errors in all their glory
+        self.maxDiff = None
+
+        self.temp_dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def unzip_example(self, name):
+        """Get the uncompressed content of an example file, and save it in the temp dir
+        """
+        with gzip.open(os.path.join(DATA_DIR, name)) as fh:
+            content = fh.read()
+        path = os.path.join(self.temp_dir, name[:-3])
+        with open(path, 'wb') as fh:
+            fh.write(content)
+        return path, content
+
+    def check_content(self, content, sample_batches=0):
+        """Save the content to a file and check it
+        """
+        path = os.path.join(self.temp_dir, "test.pod5")
+        with open(path, 'wb') as fh:
+            fh.write(content)
+        return check_pod5(path, sample_batches=sample_batches)
+
+    ### THE TESTS ###
+    def test_good_files(self):
+        """The example files pass, and we can see what is in them
+        """
+        path, content = self.unzip_example(POD5_FILES[0])
+        self.assertEqual( check_pod5(path, sample_batches=3),
+                          dict( file_identifier = 'edfbc67c-b38c-4ba6-b6f6-4f995337aaea',
+                                software = 'Python API',
+                                pod5_version = '0.0.15',
+                                tables = [ dict( content_type = 'SignalTable',
+                                                 offset = 24,
+                                                 length = 5002,
+                                                 record_batches = 1 ),
+                                           dict( content_type = 'ReadsTable',
+                                                 offset = 5048,
+                                                 length = 11450,
+                                                 record_batches = 1 ) ] ) )
+
+        path, content = self.unzip_example(POD5_FILES[1])
+        res = check_pod5(path, sample_batches=3)
+        self.assertEqual(res['pod5_version'], '0.2.7')
+        self.assertEqual( [ t['content_type'] for t in res['tables'] ],
+                          ['SignalTable', 'RunInfoTable', 'ReadsTable'] )
+
+    def test_bad_files(self):
+        """Truncated and corrupted files are caught
+        """
+        path, content = self.unzip_example(POD5_FILES[0])
+
+        def zap(pos, length=1, byte=b"\0"):
+            return content[:pos] + byte * length + content[pos+length:]
+
+        # The ReadsTable is at 5048 and is 11450 bytes long, with the Arrow footer at the end
+        for desc, bad_content, err in [
+                ( "truncated", content[:-1000], "signature at the end" ),
+                ( "empty", b'', "too short" ),
+                ( "zapped marker", zap(16504, 16), "section marker around the ReadsTable" ),
+                ( "zapped table start", zap(5048), "Arrow magic at the start" ),
+                ( "zapped table end", zap(5048 + 11450 - 1), "Arrow magic at the end" ),
+                ( "bad Arrow footer length", zap(5048 + 11450 - 10, 4, b"\xff"),
+                                             "bad Arrow footer length" ) ]:
+            with self.assertRaisesRegex(RuntimeError, f"Bad pod5 file .*: .*{err}", msg=desc):
+                self.check_content(bad_content)
+
+        with self.assertRaisesRegex(RuntimeError, "No such file"):
+            check_pod5(path + ".missing")
+
+    def test_sample_batches(self):
+        """A corrupted record batch is only seen if we sample it
+        """
+        path, content = self.unzip_example(POD5_FILES[0])
+
+        # The ReadsTable has its one record batch at 7608 in the table
+        batch_pos = 5048 + 7608
+        bad_content = content[:batch_pos] + b"\0" * 4 + content[batch_pos+4:]
+
+        self.assertEqual(len(self.check_content(bad_content)['tables']), 2)
+        with self.assertRaisesRegex(RuntimeError, "bad Arrow message header"):
+            self.check_content(bad_content, sample_batches=1)
+
+    def test_fuzz(self):
+        """Whatever byte we change, we get a RuntimeError or a pass, never a crash
+        """
+        path, content = self.unzip_example(POD5_FILES[1])
+
+        for pos in range(0, len(content), 7):
+            bad_content = content[:pos] + bytes([content[pos] ^ 0xff]) + content[pos+1:]
+            try:
+                self.check_content(bad_content, sample_batches=3)
+            except RuntimeError:
+                pass
+
+    def test_main(self):
+        """The script checks all the files and fails if any is bad
+        """
+        paths = [ self.unzip_example(pod5)[0] for pod5 in POD5_FILES ]
+
+        with patch('logging.basicConfig'):
+            pod5_check_main(parse_args(["-j", "2", *paths]))
+
+        with open(paths[1], 'r+b') as fh:
+            fh.truncate(1000)
+        with patch('logging.basicConfig'):
+            with self.assertRaises(SystemExit):
+                pod5_check_main(parse_args(paths))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+"""Test the single-pass pod5 copier"""
+
+import sys, os, re
+import unittest
+import logging
+import gzip, hashlib
+from tempfile import mkdtemp
+from shutil import rmtree
+from unittest.mock import patch
+
+DATA_DIR = os.path.abspath(os.path.dirname(__file__) + '/examples')
+VERBOSE = os.environ.get('VERBOSE', '0') != '0'
+
+from pod5_copy import main as pod5_copy_main, parse_args
+from hesiod.Pod5Copy import copy_pod5
+
+POD5_FILES = [ "PAK00002_fail_barcode07_b7f7032d_0.pod5.gz",
+               "PAS23464_fail_barcode11_c3f8b1dd_5ed8849a_0.pod5.gz" ]
+
+class T(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        #Prevent the logger from printing messages - I like my tests to look pretty.
+        if VERBOSE:
+            logging.getLogger().setLevel(logging.DEBUG)
+        else:
+            logging.getLogger().setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        # See the errors in all their glory
+        self.maxDiff = None
+
+        self.temp_dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def unzip_example(self, name, new_name=None):
+        """Get the uncompressed content of an example file, and save it in the temp dir
+        """
+        with gzip.open(os.path.join(DATA_DIR, name)) as fh:
+            content = fh.read()
+        path = os.path.join(self.temp_dir, new_name or name[:-3])
+        with open(path, 'wb') as fh:
+            fh.write(content)
+        return path, content
+
+    ### THE TESTS ###
+    def test_copy(self):
+        """Copying a good file gives an identical copy and the same .md5 as md5sum would
+        """
+        for pod5 in POD5_FILES:
+            src, content = self.unzip_example(pod5)
+            cell_dir = os.path.join(self.temp_dir, "cell")
+            dest = os.path.join(cell_dir, "pod5_pass", os.path.basename(src))
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+
+            # Use a tiny block size so the signature and footer straddle the blocks
+            with patch('logging.basicConfig'):
+                pod5_copy_main(parse_args([ src, dest,
+                                            "--md5", dest + ".md5",
+                                            "--md5_base", cell_dir,
+                                            "--block_size", "4096" ]))
+
+            with open(dest, 'rb') as fh:
+                self.assertEqual(fh.read(), content)
+            with open(dest + ".md5") as fh:
+                self.assertEqual( fh.read(),
+                                  f"{hashlib.md5(content).hexdigest()}"
+                                  f"  pod5_pass/{os.path.basename(src)}\n" )
+            self.assertFalse(os.path.exists(dest + ".md5.tmp"))
+
+    def test_target_directory(self):
+        """Several files copied at once into a directory give one .md5 file, in order
+        """
+        srcs = [ self.unzip_example(pod5, f"PAK00002_pass_{n}.pod5")
+                 for n, pod5 in enumerate(POD5_FILES * 2) ]
+
+        cell_dir = os.path.join(self.temp_dir, "cell")
+        pod5_dir = os.path.join(cell_dir, "pod5_barcode01_pass")
+        os.makedirs(pod5_dir)
+        with patch('logging.basicConfig'):
+            pod5_copy_main(parse_args([ "-j", "3", "-t", pod5_dir,
+                                        "--md5", os.path.join(self.temp_dir, "batch.md5"),
+                                        "--md5_base", cell_dir,
+                                        *[ s for s, c in srcs ] ]))
+
+        expected = []
+        for src, content in srcs:
+            with open(os.path.join(pod5_dir, os.path.basename(src)), 'rb') as fh:
+                self.assertEqual(fh.read(), content)
+            expected.append( f"{hashlib.md5(content).hexdigest()}"
+                             f"  pod5_barcode01_pass/{os.path.basename(src)}\n" )
+        with open(os.path.join(self.temp_dir, "batch.md5")) as fh:
+            self.assertEqual(fh.read(), "".join(expected))
+        self.assertEqual(len(os.listdir(pod5_dir)), 4)
+
+    def test_bad_files(self):
+        """Truncated or corrupted files are caught, and no copy is left
+        """
+        src, content = self.unzip_example(POD5_FILES[0])
+        dest = os.path.join(self.temp_dir, "copy.pod5")
+
+        footer_len = int.from_bytes(content[-32:-24], 'little')
+        for desc, bad_content in [ ("truncated", content[:-1000]),
+                                   ("empty", b''),
+                                   ("zapped footer", content[:-32-footer_len-8] +
+                                                     b"\0" * 8 + content[-32-footer_len:]),
+                                   ("bad footer length", content[:-32] + b"\xff" * 8 +
+                                                         content[-24:]),
+                                   ("zapped table", content[:16490] + b"\0" * 8 +
+                                                    content[16498:]),
+                                   ("not pod5", b"\0" * len(content)) ]:
+            with open(src, 'wb') as fh:
+                fh.write(bad_content)
+            with self.assertRaisesRegex(RuntimeError, f"Failed to copy {src}", msg=desc):
+                copy_pod5(src, dest, block_size=4096)
+            self.assertFalse(os.path.exists(dest), msg=desc)
+            self.assertEqual(os.listdir(self.temp_dir), [os.path.basename(src)])
+
+        # And a missing file
+        with self.assertRaisesRegex(RuntimeError, "No such file"):
+            copy_pod5(src + ".missing", dest)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,7 +11,8 @@ from unittest.mock import Mock, patch
 from io import StringIO
 
 # Adding this to sys.path makes the test work if you just run it directly.
-from run_status import RunStatus, parse_remote_cell_info
+from run_status import RunStatus, parse_remote_cell_info, get_yaml_batch
+from hesiod.RunIndex import RunIndex
 
 EXAMPLES = os.path.dirname(__file__) + '/examples'
 VERBOSE = os.environ.get('VERBOSE', '0') != '0'
@@ -192,6 +193,89 @@ class T(unittest.TestCase):
                                         "cells": set([ "11685BN0002L01_unsheare/XXX",
                                                        "11685BN0002L01_unsheare/YYY" ]) } })
 
+    def test_batch_mode(self):
+        """With the -B flag, run_status.py reports on several runs at once, each with
+           a RunDir: header so that driver.sh can pick out the one it wants.
+        """
+        runs = [ os.path.join(EXAMPLES, "runs", r) for r in [ "20190710_LOCALTEST_00newrun",
+                                                              "20000101_TEST_00testrun2" ] ]
+        upstream = { "20000101_TEST_00testrun2": {
+                        "loc": "xxx",
+                        "cells": set([ "a test lib/20000101_0000_1-A1-A1_PAD00000_aaaaaaaa" ]) } }
+
+        blocks = get_yaml_batch(runs, upstream=upstream).split('\n\n')
+        self.assertEqual(len(blocks), 2)
+
+        for run, block in zip(runs, blocks):
+            self.assertEqual( block.split('\n')[0], 'RunDir: ' + run )
+            # The rest should be just as if we'd asked for the run individually
+            self.assertEqual( block.rstrip('\n').split('\n')[1:],
+                              RunStatus(run, upstream=upstream).get_yaml().split('\n') )
+
+        self.assertEqual( dictify(blocks[1].rstrip('\n'))['PipelineStatus:'], 'sync_needed' )
+        self.assertEqual( get_yaml_batch([]), '' )
+
+    def test_run_index(self):
+        """Finished runs are saved in the RunIndex and need not be examined again
+           until something changes.
+        """
+        self.use_run("20000101_TEST_00testrun2", copy=True)
+        self.touch("pipeline/20000101_0000_1-A1-A1_PAD00000_aaaaaaaa.done")
+        self.touch("pipeline/20000101_0000_2-B1-B1_PAD00000_bbbbbbbb.done")
+
+        # The index won't trust directories that were modified just now
+        for d in [".", "pipeline", "a test lib"]:
+            os.utime(os.path.join(self.current_run_dir, d), (1e9, 1e9))
+
+        index_file = os.path.join(self.tmp_dir, "index.json")
+        run_index = RunIndex(index_file)
+        res1 = get_yaml_batch([self.current_run_dir], run_index=run_index)
+        run_index.save()
+        self.assertEqual( (run_index.hits, run_index.misses), (0, 1) )
+        self.assertEqual( dictify(res1.rstrip('\n'))['PipelineStatus:'], 'complete' )
+
+        # Now we should get the same from the index
+        run_index = RunIndex(index_file)
+        self.assertEqual( get_yaml_batch([self.current_run_dir], run_index=run_index), res1 )
+        self.assertEqual( (run_index.hits, run_index.misses), (1, 0) )
+
+        # But not if there is new upstream info, or if we are rebuilding
+        upstream = { "20000101_TEST_00testrun2": { "loc": "xxx",
+                                                   "cells": set([ "a test lib/TEST123" ]) } }
+        self.assertEqual( dictify( get_yaml_batch( [self.current_run_dir],
+                                                   upstream = upstream,
+                                                   run_index = run_index ).rstrip('\n')
+                                 )['PipelineStatus:'], 'sync_needed' )
+        self.assertEqual( RunIndex(index_file, rebuild=True).lookup(self.current_run_dir), None )
+
+        # Adding a touch file changes the pipeline dir mtime so we see it
+        self.touch("pipeline/aborted")
+        run_index = RunIndex(index_file)
+        self.assertEqual( run_index.lookup(self.current_run_dir), None )
+        self.assertEqual( dictify( get_yaml_batch( [self.current_run_dir],
+                                                   run_index = run_index ).rstrip('\n')
+                                 )['PipelineStatus:'], 'aborted' )
+
+    def test_exists_pipeline(self):
+        """The pipeline directory is only listed once per RunStatus, and '.' checks the
+           directory itself.
+        """
+        run_info = self.use_run("20000101_TEST_00testrun2", copy=True)
+
+        self.assertTrue( run_info._exists_pipeline('.') )
+        self.assertFalse( run_info._exists_pipeline('sync.done') )
+
+        # This is not seen until the cache is cleared
+        self.touch("pipeline/sync.done")
+        self.assertFalse( run_info._exists_pipeline('sync.done') )
+        run_info._clear_cache()
+        self.assertEqual( run_info._exists_pipeline('sync.*'), 1 )
+
+        self.rm("pipeline")
+        run_info._clear_cache()
+        self.assertFalse( run_info._exists_pipeline('.') )
+        self.assertEqual( run_info.get_status(), 'new' )
+
     def test_sync_in_progress(self):
         """Test for bug noted on 30/7 - a run with sync in progress should appear in this state even if
            there is no upstream info provided.
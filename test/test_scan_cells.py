@@ -7,14 +7,19 @@ import unittest
 import logging
 from pprint import pprint
 from textwrap import dedent
+from tempfile import mkdtemp
+from shutil import rmtree, copytree
 
 import yaml
+import json
 
 DATA_DIR = os.path.abspath(os.path.dirname(__file__) + '/examples')
 VERBOSE = os.environ.get('VERBOSE', '0') != '0'
 
-from scan_cells import ( scan_main, parse_args, scan_cells, sc_counts,
+from scan_cells import ( scan_main, parse_args, scan_cells, sc_counts, list_cell_dirs,
                          find_representative_fast5, find_representative_pod5 )
+from hesiod import glob
+from hesiod.DirIndex import DirIndex, listdir
 
 class T(unittest.TestCase):
 
@@ -94,6 +99,123 @@ class T(unittest.TestCase):
         # And just to be sure:
         self.assertEqual(sc, expected)
 
+    def copy_run_with_old_mtimes(self, run):
+        """Make a copy of an example run where no directory has been modified
+           recently, so the DirIndex will trust its listings.
+        """
+        temp_dir = mkdtemp()
+        self.addCleanup(rmtree, temp_dir)
+
+        run_copy = copytree(f"{DATA_DIR}/runs/{run}", f"{temp_dir}/{run}", symlinks=True)
+        for root, dirs, files in os.walk(run_copy):
+            os.utime(root, (1e9, 1e9))
+
+        return temp_dir, run_copy
+
+    def test_scan_main_with_index(self):
+        """Scanning with the directory index must give exactly the same result as a
+           cold scan, whether the index is new, re-used or partly stale.
+        """
+        temp_dir, run_copy = self.copy_run_with_old_mtimes("20221103_EGS2_25070AT")
+        index_file = f"{temp_dir}/sc_data.index.json"
+
+        cold = scan_main(parse_args([run_copy]), "20221103_EGS2_25070AT")
+        indexed1 = scan_main(parse_args(["--index", index_file, run_copy]), "20221103_EGS2_25070AT")
+        self.assertTrue(os.path.exists(index_file))
+        indexed2 = scan_main(parse_args(["--index", index_file, run_copy]), "20221103_EGS2_25070AT")
+
+        self.assertEqual(indexed1, cold)
+        self.assertEqual(indexed2, cold)
+
+        # The second time around, nothing should be re-listed
+        dir_index = DirIndex(index_file)
+        scan_cells(run_copy, dir_index=dir_index)
+        self.assertEqual(dir_index.misses, 0)
+        self.assertTrue(dir_index.hits > 0)
+
+        # Rename a file, which changes the mtime of the directory
+        some_bam, = [ f for f in glob(f"{run_copy}/*/*/bam_pass/*/*.bam") ][:1]
+        os.rename(some_bam, some_bam[:-4] + "_renamed.bam")
+
+        indexed3 = scan_main(parse_args(["--index", index_file, run_copy]), "20221103_EGS2_25070AT")
+        cold3 = scan_main(parse_args([run_copy]), "20221103_EGS2_25070AT")
+        self.assertEqual(indexed3, cold3)
+        self.assertNotEqual(indexed3, cold)
+
+    def test_index_rebuild(self):
+        """--rebuild ignores whatever is in the index
+        """
+        temp_dir, run_copy = self.copy_run_with_old_mtimes("20231107_MIN2_26171SS")
+        index_file = f"{temp_dir}/sc_data.index.json"
+
+        cold = scan_main(parse_args([run_copy]), "foobarfoo")
+        scan_main(parse_args(["--index", index_file, run_copy]), "foobarfoo")
+
+        # Sabotage the index, by removing all the files from every listing
+        with open(index_file) as fh:
+            index = json.load(fh)
+        for v in index.values():
+            v['entries'] = [ e for e in v['entries'] if e[1] ]
+        with open(index_file, "w") as fh:
+            json.dump(index, fh)
+
+        # So the scan now thinks files are missing
+        with self.assertRaisesRegex(RuntimeError, "Mismatch between count"):
+            scan_cells(run_copy, dir_index=DirIndex(index_file))
+
+        rebuilt = scan_main(parse_args(["--index", index_file, "--rebuild", run_copy]), "foobarfoo")
+        self.assertEqual(rebuilt, cold)
+
+    def test_scan_main_jobs(self):
+        """Scanning in parallel must give the same result, in the same order
+        """
+        args = parse_args(["--jobs", "4", f"{DATA_DIR}/runs/20221103_EGS2_25070AT"])
+        sc = scan_main( args, "20221103_EGS2_25070AT" )
+
+        with open(f"{DATA_DIR}/runs/20221103_EGS2_25070AT/sc_data.yaml") as yfh:
+            expected = yaml.safe_load(yfh)
+
+        self.assertEqual(sc, expected)
+        self.assertEqual(list(sc['scanned_cells']), list(expected['scanned_cells']))
+
+    def test_scan_error_jobs(self):
+        """The mismatch error should still be raised in parallel mode
+        """
+        temp_dir, run_copy = self.copy_run_with_old_mtimes("20221103_EGS2_25070AT")
+        cells = sorted(glob(f"{run_copy}/*/*/final_summary_*.txt"))
+        self.assertTrue(len(cells) > 1)
+
+        # Remove a file from the last cell
+        bad_cell = '/'.join(cells[-1].split('/')[-3:-1])
+        bad_file = sorted(glob(f"{run_copy}/{bad_cell}/fastq_pass/*/*"))[0]
+        os.unlink(bad_file)
+
+        with self.assertRaisesRegex(RuntimeError, f"Mismatch between count of .* files for {bad_cell}:"):
+            scan_cells(run_copy, jobs=4)
+
+    def test_list_cell_dirs(self):
+        """This should look in each directory just once, and never in directories that
+           do not exist.
+        """
+        cell_dir = f"{DATA_DIR}/runs/20210520_EGS1_16031BA/16031BApool01/20210520_1105_2-E1-H1_PAG23119_76e7e00f"
+
+        listed = []
+        def _listdir(path):
+            listed.append(path[len(cell_dir):])
+            return listdir(path)
+
+        res = list_cell_dirs(cell_dir, {"fastq_pass", "fastq_fail", "pod5_pass", "fast5_skip"}, _listdir)
+
+        self.assertEqual(sorted(res), ["fastq_fail", "fastq_pass"])
+        self.assertEqual(sorted(listed), sorted(set(listed)))
+        self.assertEqual( sorted(listed),
+                          sorted([ "",
+                                   "/fastq_fail", "/fastq_pass",
+                                   *[ f"/fastq_{pf}/{bc}" for pf in ["pass", "fail"]
+                                                          for bc in res[f"fastq_{pf}"] if bc ] ]) )
+        self.assertEqual( sorted(res["fastq_pass"]['']),
+                          sorted(os.listdir(f"{cell_dir}/fastq_pass")) )
+
     def test_find_representative_pod5(self):
         """This is rather redundant given the test above, but technically we can
            change the batch size, and ther may be no passing reads.
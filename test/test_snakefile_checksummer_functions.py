@@ -8,7 +8,7 @@ import logging
 from itertools import takewhile
 from pprint import pprint
 from unittest.mock import Mock, patch
-from tempfile import mkstemp
+from tempfile import mkstemp, TemporaryDirectory
 from collections import OrderedDict
 
 from snakemake import Workflow
@@ -21,6 +21,7 @@ VERBOSE = os.environ.get('VERBOSE', '0') != '0'
 split_input_dir = '_importme'
 batchlist = '_importme'
 scan_for_batches = '_importme'
+scan_files = '_importme'
 
 class T(unittest.TestCase):
 
@@ -70,7 +71,8 @@ class T(unittest.TestCase):
 
     def test_batchlist(self):
 
-        l = "abcdefghijklmnopqrstuvwxyz"
+        # When all the files are the same size, the batches are even by count
+        l = [ (x, 1) for x in "abcdefghijklmnopqrstuvwxyz" ]
 
         b1 = batchlist(l, 2, min_pad=1)
         self.assertEqual(b1, { '00': ['a', 'n'],
@@ -93,33 +95,87 @@ class T(unittest.TestCase):
                                '0002': ['c', 'g', 'k'],
                                '0003': ['d', 'h', 'l'], })
 
-    @patch('os.walk')
-    def test_scan_for_batches(self, dummy_walk):
-
-        dummy_walk.return_value = []
-        res = scan_for_batches('test', '')
-        self.assertEqual(res, {})
-
-        dummy_walk.return_value = [ ( 'wrong', [], [] ) ]
-        self.assertRaises( AssertionError, scan_for_batches, 'test', '' )
-
-        # When prefix_p is empty
-        dummy_walk.return_value = [ ( 'test',     [ 'd1' ], [ 'f1', 'f2' ] ),
-                                    ( 'test/foo', [], [ 'f4', 'f3' ] ), ]
-        res = scan_for_batches('test', '')
-        self.assertEqual(res, { '000': [ 'f1',
-                                         'f2',
-                                         'foo/f3',
-                                         'foo/f4' ] })
-
-        # When prefix_p is non-empty
-        dummy_walk.return_value = [ ( '/test/x/y',     [ 'd1' ], [ 'f1', 'f2' ] ),
-                                    ( '/test/x/y/foo', [], [ 'f4', 'f3' ] ), ]
-        res = scan_for_batches('/test', 'x/y')
-        self.assertEqual(res, { '000': [ 'x/y/f1',
-                                         'x/y/f2',
-                                         'x/y/foo/f3',
-                                         'x/y/foo/f4' ] })
+        self.assertEqual(batchlist([], 4), {})
+
+    def test_batchlist_bytes(self):
+
+        # Big files are spread out, and the little ones fill in around them
+        l = [ ('a', 50), ('b', 10), ('c', 40), ('d', 10), ('e', 45), ('f', 5), ('g', 0) ]
+
+        # By count we only need one batch, but by bytes we need two
+        b1 = batchlist(l, 100, batch_bytes=100)
+        self.assertEqual(b1, { '0': ['a', 'b', 'd', 'f', 'g'],
+                               '1': ['c', 'e'] })
+
+        # The count limit still applies
+        b2 = batchlist(l, 2, batch_bytes=1000)
+        self.assertEqual(sorted( len(b) for b in b2.values() ), [1, 2, 2, 2])
+
+        # But there is never more than one batch per file
+        b3 = batchlist(l, 100, batch_bytes=1)
+        self.assertEqual(len(b3), 7)
+        self.assertEqual(sorted(sum(b3.values(), [])), list("abcdefg"))
+
+    def test_scan_for_batches(self):
+
+        with TemporaryDirectory() as tmpdir:
+            res = scan_for_batches(tmpdir, '')
+            self.assertEqual(res, {})
+
+            for f, size in [ ('x/y/f1', 10), ('x/y/f2', 20), ('x/y/foo/f4', 5),
+                             ('x/y/foo/f3', 0), ('x/z', 1) ]:
+                os.makedirs(os.path.dirname(f"{tmpdir}/{f}"), exist_ok=True)
+                with open(f"{tmpdir}/{f}", "w") as fh:
+                    fh.write("x" * size)
+            # Links to files are listed but links to directories are not followed
+            os.symlink("f1", f"{tmpdir}/x/y/f5")
+            os.symlink("foo", f"{tmpdir}/x/y/bar")
+
+            # When prefix_p is empty
+            res = scan_for_batches(f"{tmpdir}/x/y", '')
+            self.assertEqual(res, { '000': [ 'f1',
+                                             'f2',
+                                             'f5',
+                                             'foo/f3',
+                                             'foo/f4' ] })
+
+            # When prefix_p is non-empty
+            res = scan_for_batches(tmpdir, 'x/y')
+            self.assertEqual(res, { '000': [ 'x/y/f1',
+                                             'x/y/f2',
+                                             'x/y/f5',
+                                             'x/y/foo/f3',
+                                             'x/y/foo/f4' ] })
+
+            # Split by size
+            res = scan_for_batches(tmpdir, 'x', batch_gb=20e-9)
+            self.assertEqual(res, { '000': [ 'x/y/f2' ],
+                                    '001': [ 'x/y/f1', 'x/y/foo/f4' ],
+                                    '002': [ 'x/y/f5', 'x/y/foo/f3', 'x/z' ] })
+
+            # Or batch a list of files we already have
+            files = scan_files(tmpdir, 'x/y/foo')
+            res = scan_for_batches(tmpdir, 'x', files=files)
+            self.assertEqual(res, { '000': [ 'x/y/foo/f3', 'x/y/foo/f4' ] })
+
+    def test_scan_files(self):
+
+        with TemporaryDirectory() as tmpdir:
+            self.assertEqual(scan_files(tmpdir, ''), [])
+
+            os.makedirs(f"{tmpdir}/x/y")
+            for f in [ 'x/y/f1', 'x/f2' ]:
+                with open(f"{tmpdir}/{f}", "w") as fh:
+                    fh.write(f)
+            # A broken link is listed, but with no stat signature
+            os.symlink("nowhere", f"{tmpdir}/x/f3")
+
+            res = scan_files(tmpdir, 'x')
+            self.assertEqual([ f for f, sig in res ], [ 'x/f2', 'x/f3', 'x/y/f1' ])
+
+            st = os.stat(f"{tmpdir}/x/y/f1")
+            self.assertEqual(res[2][1], [ 6, st.st_mtime_ns, st.st_ino ])
+            self.assertEqual(res[1][1], None)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+"""Test the scheduler that runs sync commands for driver.sh"""
+
+import sys, os, re
+import unittest
+import logging
+import threading
+import time
+from tempfile import mkdtemp
+from shutil import rmtree
+
+DATA_DIR = os.path.abspath(os.path.dirname(__file__) + '/examples')
+VERBOSE = os.environ.get('VERBOSE', '0') != '0'
+
+from sync_scheduler import run_jobs, read_jobs, run_one
+
+def job(experiment, upstream, label, command="true", cwd=".", log_file="/dev/null"):
+    return dict( experiment=experiment, upstream=upstream, label=label,
+                 command=command, cwd=cwd, log_file=log_file )
+
+class T(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        #Prevent the logger from printing messages - I like my tests to look pretty.
+        if VERBOSE:
+            logging.getLogger().setLevel(logging.DEBUG)
+        else:
+            logging.getLogger().setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        # See the errors in all their glory
+        self.maxDiff = None
+
+    def fake_runner(self, retvals=None):
+        """Get a run_func that notes the order of jobs and the peak concurrency
+        """
+        self.started = []
+        self.peak = dict()
+        running = dict()
+        lock = threading.Lock()
+        retvals = retvals or dict()
+
+        def run_func(job):
+            u = job['upstream']
+            with lock:
+                self.started.append(job['label'])
+                running[u] = running.get(u, 0) + 1
+                self.peak[u] = max(self.peak.get(u, 0), running[u])
+            time.sleep(0.05)
+            with lock:
+                running[u] -= 1
+            return retvals.get(job['label'], 0)
+
+        return run_func
+
+    ### THE TESTS ###
+    def test_read_jobs(self):
+        jobs = list(read_jobs(["e1\tEGS1\t/tmp\t/tmp/log\tlib/cell\techo 'a\tb'\n", "\n"]))
+        self.assertEqual(jobs, [ job("e1", "EGS1", "lib/cell", "echo 'a\tb'", "/tmp", "/tmp/log") ])
+
+    def test_interleave(self):
+        """Upstreams take turns, and the limits are respected
+        """
+        jobs = [ job("e1", "EGS1", f"a{n}") for n in range(4) ] + \
+               [ job("e2", "MIN2", f"b{n}") for n in range(2) ]
+
+        res = run_jobs(jobs, run_func=self.fake_runner())
+        self.assertEqual(list(res.items()), [("e1", "done"), ("e2", "done")])
+        # The second upstream should not have to wait for the first
+        self.assertEqual(self.started[:2], ["a0", "b0"])
+        self.assertEqual([ l for l in self.started if l.startswith('a') ], ["a0", "a1", "a2", "a3"])
+        self.assertEqual(self.peak, dict(EGS1=1, MIN2=1))
+
+        res = run_jobs(jobs, default_limit=1, limits=dict(EGS1=3), run_func=self.fake_runner())
+        self.assertEqual(self.peak, dict(EGS1=3, MIN2=1))
+        self.assertCountEqual(self.started, ["a0", "a1", "a2", "a3", "b0", "b1"])
+
+    def test_failures(self):
+        """A failure stops the rest of that experiment. 130 or 20 stops everything.
+        """
+        jobs = [ job("e1", "EGS1", "a0"), job("e1", "EGS1", "a1"),
+                 job("e2", "EGS1", "b0"), job("e3", "EGS1", "c0") ]
+
+        res = run_jobs(jobs, run_func=self.fake_runner(dict(a0=1)))
+        self.assertEqual(dict(res), dict(e1="failed", e2="done", e3="done"))
+        self.assertEqual(self.started, ["a0", "b0", "c0"])
+
+        res = run_jobs(jobs, run_func=self.fake_runner(dict(a1=20)))
+        self.assertEqual(dict(res), dict(e1="aborted", e2="aborted", e3="aborted"))
+        self.assertEqual(self.started, ["a0", "a1"])
+
+        self.assertEqual(run_jobs([]), dict())
+
+    def test_run_one(self):
+        """Run real commands, copying between local directories as a stand-in
+           for rsync from an instrument.
+        """
+        tmp_dir = mkdtemp()
+        self.addCleanup(rmtree, tmp_dir)
+        os.mkdir(f"{tmp_dir}/dest")
+        log_file = f"{tmp_dir}/sync.log"
+
+        jobs = [ job( "e1", "TEST", f"lib/cell{n}",
+                      command = f"mkdir -p lib && cp -rv {DATA_DIR}/upstream1/00testrun/testlib lib/cell{n}",
+                      cwd = f"{tmp_dir}/dest",
+                      log_file = log_file )
+                 for n in range(3) ]
+        jobs.append(job("e2", "TEST", "lib/cell", "echo oops ; exit 1", f"{tmp_dir}/dest", log_file))
+
+        res = run_jobs(jobs, default_limit=2)
+        self.assertEqual(dict(res), dict(e1="done", e2="failed"))
+        self.assertEqual(sorted(os.listdir(f"{tmp_dir}/dest/lib")), ["cell0", "cell1", "cell2"])
+
+        with open(log_file) as fh:
+            log_lines = fh.read().splitlines()
+        self.assertIn("oops", log_lines)
+        self.assertEqual(len([l for l in log_lines if l.startswith(">>> Starting sync of")]), 4)
+        self.assertTrue([ l for l in log_lines if "lib/cell finished with status 1" in l ])
+
+if __name__ == '__main__':
+    unittest.main()